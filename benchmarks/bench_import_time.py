@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Import-time benchmark of the command line front end.
+
+Runs "python -X importtime -c 'import <module>'" several times in fresh interpreters and fails (exit status 1)
+if the best cumulative import time exceeds the budget, or if one of the lazily loaded backends (hash
+libraries, thread pools, structured output) is imported at startup.
+
+Starting the benchmark:
+./benchmarks/bench_import_time.py [--module ctf_cli] [--budget-ms 30] [--runs 7]
+"""
+
+import argparse
+import compileall
+import json
+import os
+import subprocess
+import sys
+
+
+SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sources")
+
+# Modules which must only be imported on first use
+LAZY_MODULES = (
+    "hashlib",
+    "blake3",
+    "concurrent.futures",
+    "csv",
+    "json",
+    "numpy",
+)
+
+
+def measure_import_time(
+    def_module,
+    def_python=sys.executable,
+):
+    """
+    Imports a module in a fresh interpreter.
+    :param def_module:      str, module to import
+    :param def_python:      str, python interpreter
+    :return:                int (cumulative import time of the module in microseconds), list (imported modules)
+    """
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    environment["PYTHONPATH"] = SOURCES
+    completed = subprocess.run(
+        [def_python, "-X", "importtime", "-c", f"import {def_module}"],
+        capture_output=True,
+        text=True,
+        env=environment,
+        check=True,
+    )
+    cumulative_us = None
+    imported_modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        imported_modules.append(name.strip())
+        if name.strip() == def_module:
+            cumulative_us = int(cumulative)
+    return cumulative_us, imported_modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="ctf_cli", help="module to import (default: ctf_cli)")
+    parser.add_argument("--budget-ms", type=float, default=30.0, help="import time budget (default: 30 ms)")
+    parser.add_argument("--runs", type=int, default=7, help="number of fresh interpreters (default: 7)")
+    args = parser.parse_args()
+
+    # Measure with up-to-date bytecode, compiling the sources is not part of the startup cost
+    compileall.compile_dir(SOURCES, quiet=1)
+
+    timings_us = []
+    imported_modules = []
+    for _ in range(args.runs):
+        cumulative_us, imported_modules = measure_import_time(args.module)
+        timings_us.append(cumulative_us)
+    best_ms = min(timings_us) / 1000
+    eagerly_imported = [module for module in LAZY_MODULES if module in imported_modules]
+
+    result = {
+        "benchmark": "import_time",
+        "module": args.module,
+        "python": sys.version.split()[0],
+        "runs_ms": [timing / 1000 for timing in timings_us],
+        "best_ms": best_ms,
+        "budget_ms": args.budget_ms,
+        "eagerly_imported": eagerly_imported,
+        "passed": best_ms <= args.budget_ms and not eagerly_imported,
+    }
+    print(json.dumps(result, indent=2))
+    return 0 if result["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+"""
+Phase benchmark on synthetic folder trees.
+
+Generates reproducible (seeded) source and target trees for several scenarios and times the phases of a
+comparison separately: scanning (create_file_dict), comparing (collect_comparison_data), searching missing files
+(print_files_missing_with_search) and rendering the report. The results are printed as JSON, to be kept and
+compared across versions.
+
+Scenarios (counts and sizes are multiplied by --scale):
+- tiny_files:       1,000,000 files of 0 to 64 bytes, 1,000 per directory, all identical
+- deep_nesting:     20,000 files in directories nested 64 levels deep, 1% differing
+- huge_sparse:      3 sparse files of 1 GiB with a few written blocks, one differing block in one file
+- high_missing:     50,000 files, 50% missing in target and 10% missing in source
+- mtime_only:       50,000 files, 30% with only a differing mtime
+
+The trees are kept in the work folder and reused by later runs with the same scenario, seed and scale.
+
+Starting the benchmark:
+./benchmarks/bench_phases.py [--scenario tiny_files ...] [--scale 0.01] [--seed 1] [--workdir /tmp/ctf-bench]
+                             [--options STHB] [--workers 1] [--search-limit 100] [--output results.json]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sources")
+sys.path.insert(0, SOURCES)
+
+from ctf_functions import (  # noqa: E402
+    collect_comparison_data,
+    create_file_dict,
+)
+from ctf_report import (  # noqa: E402
+    ReportLogger,
+    ReportWriter,
+    set_report_writer,
+)
+import compare_two_folders  # noqa: E402
+
+
+SCENARIOS = {
+    "tiny_files": {
+        "files": 1000000,
+        "files_per_folder": 1000,
+        "depth": 1,
+        "max_size": 64,
+    },
+    "deep_nesting": {
+        "files": 20000,
+        "files_per_folder": 10,
+        "depth": 64,
+        "max_size": 4096,
+        "differing": 0.01,
+    },
+    "huge_sparse": {
+        "files": 3,
+        "files_per_folder": 3,
+        "depth": 1,
+        "sparse_size": 1073741824,
+        "sparse_blocks": 16,
+    },
+    "high_missing": {
+        "files": 50000,
+        "files_per_folder": 500,
+        "depth": 2,
+        "max_size": 4096,
+        "missing_target": 0.5,
+        "missing_source": 0.1,
+    },
+    "mtime_only": {
+        "files": 50000,
+        "files_per_folder": 500,
+        "depth": 2,
+        "max_size": 4096,
+        "mtime_only": 0.3,
+    },
+}
+
+# Fixed mtime of the generated files, so that source and target match unless a difference is generated
+BASE_MTIME_NS = 1600000000 * 10**9
+
+# Verbosity used for the timed phases, everything is formatted
+VERBOSE = {
+    "general": True,
+    "files-pass": True,
+    "details": True,
+    "summary": True,
+}
+
+
+def relative_folder(
+    def_index,
+    def_files_per_folder,
+    def_depth,
+):
+    """
+    :return:    str, folder of the file with the given index, def_depth levels below the root
+    """
+    folder_index = def_index // def_files_per_folder
+    parts = [f"d{folder_index % 100:02d}"] * (def_depth - 1) + [f"f{folder_index}"]
+    return os.path.join(*parts)
+
+
+def write_file(
+    def_path,
+    def_data,
+    def_mtime_ns=BASE_MTIME_NS,
+):
+    fd = os.open(def_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, def_data)
+    finally:
+        os.close(fd)
+    os.utime(def_path, ns=(def_mtime_ns, def_mtime_ns))
+
+
+def write_sparse_file(
+    def_path,
+    def_size,
+    def_blocks,
+    def_mtime_ns=BASE_MTIME_NS,
+):
+    """
+    :param def_blocks:  list, (offset, data) written into the otherwise empty file
+    """
+    with open(def_path, "wb") as f:
+        f.truncate(def_size)
+        for offset, data in def_blocks:
+            f.seek(offset)
+            f.write(data)
+    os.utime(def_path, ns=(def_mtime_ns, def_mtime_ns))
+
+
+def generate_tree(
+    def_folder,
+    def_scenario,
+    def_seed,
+    def_scale,
+):
+    """
+    Generates the source and the target tree of a scenario (unless generated before).
+    :return:    str (source folder), str (target folder)
+    """
+    folder_source = os.path.join(def_folder, "source")
+    folder_target = os.path.join(def_folder, "target")
+    marker = os.path.join(def_folder, "complete")
+    if os.path.exists(marker):
+        return folder_source, folder_target
+
+    parameters = SCENARIOS[def_scenario]
+    rng = random.Random(f"{def_scenario}-{def_seed}")
+    number_of_files = max(1, int(parameters["files"] * def_scale))
+    created_folders = set()
+    for index in range(number_of_files):
+        folder = relative_folder(
+            index,
+            parameters["files_per_folder"],
+            parameters["depth"],
+        )
+        if folder not in created_folders:
+            os.makedirs(os.path.join(folder_source, folder), exist_ok=True)
+            os.makedirs(os.path.join(folder_target, folder), exist_ok=True)
+            created_folders.add(folder)
+        file = os.path.join(folder, f"file{index}.dat")
+        in_source = rng.random() >= parameters.get("missing_source", 0)
+        in_target = rng.random() >= parameters.get("missing_target", 0)
+        if not in_source and not in_target:
+            in_target = True
+
+        if "sparse_size" in parameters:
+            size = max(1048576, int(parameters["sparse_size"] * def_scale))
+            blocks = [
+                (rng.randrange(0, size - 4096), rng.randbytes(4096))
+                for _ in range(parameters["sparse_blocks"])
+            ]
+            write_sparse_file(os.path.join(folder_source, file), size, blocks)
+            if index == 0:
+                blocks[-1] = (blocks[-1][0], rng.randbytes(4096))
+            write_sparse_file(os.path.join(folder_target, file), size, blocks)
+            continue
+
+        data = rng.randbytes(rng.randint(0, parameters["max_size"]))
+        if in_source:
+            write_file(os.path.join(folder_source, file), data)
+        if in_target:
+            mtime_ns = BASE_MTIME_NS
+            if rng.random() < parameters.get("mtime_only", 0):
+                mtime_ns += 10**9
+            elif rng.random() < parameters.get("differing", 0) and data:
+                data = bytes([data[0] ^ 0xFF]) + data[1:]
+            write_file(os.path.join(folder_target, file), data, mtime_ns)
+
+    with open(marker, "w") as f:
+        f.write(f"{number_of_files}\n")
+    return folder_source, folder_target
+
+
+def time_phase(def_function, *def_args):
+    """
+    :return:    result of the function, dict (wall and CPU seconds)
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = def_function(*def_args)
+    return result, {
+        "wall_s": round(time.perf_counter() - wall_start, 6),
+        "cpu_s": round(time.process_time() - cpu_start, 6),
+    }
+
+
+def run_scenario(
+    def_folder_source,
+    def_folder_target,
+    def_options,
+    def_algorithm,
+    def_workers,
+    def_block_size,
+    def_search_limit,
+):
+    """
+    Times the phases of one comparison of the two trees.
+    :return:    dict, results of the scenario
+    """
+    logger = ReportLogger(VERBOSE)
+    phases = {}
+    file_sizes_source = {}
+    (files_source, files_source_size), phases["scan_source"] = time_phase(
+        create_file_dict,
+        def_folder_source,
+        None,
+        None,
+        file_sizes_source,
+    )
+    (files_target, files_target_size), phases["scan_target"] = time_phase(
+        create_file_dict,
+        def_folder_target,
+    )
+
+    comparison_data, phases["compare"] = time_phase(
+        collect_comparison_data,
+        len(files_source),
+        len(files_target),
+        files_source,
+        files_target,
+        def_algorithm,
+        def_options,
+        VERBOSE,
+        file_sizes_source,
+        None,
+        0,
+        def_workers,
+        def_block_size,
+    )
+    files_identical, count_files_identical, files_only_mtime_difference, files_any_difference_but_mtime = (
+        comparison_data
+    )
+
+    # Searching is quadratic (one walk of both trees per missing file), only a sample is searched
+    missing_source = sorted(files_target.keys() - files_source.keys())
+    missing_target = sorted(files_source.keys() - files_target.keys())
+    sample_source = {
+        file: os.path.join(def_folder_target, file)
+        for file in missing_source[:def_search_limit]
+    }
+    sample_target = {
+        file: os.path.join(def_folder_target, file)
+        for file in missing_target[:def_search_limit]
+    }
+
+    def search():
+        for files, info in ((sample_source, "source"), (sample_target, "target")):
+            compare_two_folders.print_files_missing_with_search(
+                files,
+                info,
+                def_folder_source,
+                def_folder_target,
+                def_algorithm,
+                def_options,
+                logger,
+                None,
+                None,
+                def_block_size,
+            )
+
+    _, phases["search"] = time_phase(search)
+    searched = len(sample_source) + len(sample_target)
+    if searched:
+        phases["search"]["per_file_ms"] = round(phases["search"]["wall_s"] * 1000 / searched, 3)
+
+    def render():
+        compare_two_folders.print_files_identical(
+            files_identical,
+            logger,
+        )
+        compare_two_folders.print_files_only_mtime_difference(
+            files_only_mtime_difference,
+            logger,
+        )
+        compare_two_folders.print_files_any_difference_but_mtime(
+            files_any_difference_but_mtime,
+            logger,
+        )
+        compare_two_folders.print_summary(
+            {
+                "files_pass": count_files_identical,
+                "files_missing_in_source": len(missing_source),
+                "files_missing_in_target": len(missing_target),
+                "files_only_mtime_difference": len(files_only_mtime_difference),
+                "files_any_difference_but_mtime": len(files_any_difference_but_mtime),
+                "files_source_size": files_source_size,
+                "files_target_size": files_target_size,
+            },
+            VERBOSE,
+            datetime.datetime.now(),
+        )
+
+    _, phases["report"] = time_phase(render)
+
+    return {
+        "files_source": len(files_source),
+        "files_target": len(files_target),
+        "bytes_source": files_source_size,
+        "files_pass": count_files_identical,
+        "files_missing_in_source": len(missing_source),
+        "files_missing_in_target": len(missing_target),
+        "files_only_mtime_difference": len(files_only_mtime_difference),
+        "files_any_difference_but_mtime": len(files_any_difference_but_mtime),
+        "files_searched": searched,
+        "phases": phases,
+    }
+
+
+def git_revision():
+    """
+    :return:    str, revision of the checkout (None: not a git checkout)
+    """
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SOURCES,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run (repeatable; default: all)",
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="factor for counts and sizes (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated trees (default: 1)")
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "ctf-bench"),
+        help="folder of the generated trees (default: <tmp>/ctf-bench)",
+    )
+    parser.add_argument("--options", default="STHB", help="comparison options (default: STHB)")
+    parser.add_argument("--algorithm", default="blake3", help="hash algorithm (default: blake3)")
+    parser.add_argument("--workers", type=int, default=1, help="comparison workers (default: 1)")
+    parser.add_argument("--block-size", type=int, default=4096, help="read block size (default: 4096)")
+    parser.add_argument(
+        "--search-limit",
+        type=int,
+        default=100,
+        help="number of missing files searched per side (default: 100)",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "phases",
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "scale": args.scale,
+        "seed": args.seed,
+        "options": args.options,
+        "algorithm": args.algorithm,
+        "workers": args.workers,
+        "block_size": args.block_size,
+        "scenarios": {},
+    }
+    for scenario in args.scenario or sorted(SCENARIOS):
+        folder = os.path.join(args.workdir, f"{scenario}-seed{args.seed}-scale{args.scale:g}")
+        (folder_source, folder_target), generation = time_phase(
+            generate_tree,
+            folder,
+            scenario,
+            args.seed,
+            args.scale,
+        )
+        # The report is rendered into /dev/null, only the formatting and writing cost is measured
+        report_writer = ReportWriter(os.devnull)
+        set_report_writer(report_writer)
+        try:
+            results["scenarios"][scenario] = run_scenario(
+                folder_source,
+                folder_target,
+                args.options,
+                args.algorithm,
+                args.workers,
+                args.block_size,
+                args.search_limit,
+            )
+        finally:
+            set_report_writer(None)
+            report_writer.close()
+        results["scenarios"][scenario]["generation"] = generation
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
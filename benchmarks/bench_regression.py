@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+
+"""
+Regression benchmark of the current engine against the historical revisions in old/.
+
+Two parts:
+- Revisions: the current engine (sources/) and the selected revisions of old/ compare the same generated trees
+  (see bench_phases). The classification counts of every revision have to be equal to the ones of the current
+  engine, the throughput of every revision is reported with the delta of the current engine against it.
+- Micro-benchmarks: sha_hash, compare_files and create_file_dict of the current engine and of revision 11 are
+  timed in the same run. The budgets in regression_budgets.json are the highest allowed ratio of the current
+  time to the time of revision 11, so they hold on any host; a micro-benchmark fails if its ratio exceeds the
+  budget. --update-budgets stores the measured ratios times --budget-margin.
+
+Revisions 1 to 5 only print their results (no return value) and can not be compared, revisions 6 and 7 always
+hash with SHA-512 and revision 6 always compares with STHB. For comparable throughputs the default algorithm is
+sha512 for all revisions.
+
+The results are printed as JSON, the exit code is 1 if a classification differs or a budget is exceeded.
+
+Starting the benchmark:
+./benchmarks/bench_regression.py [--revision 11 --revision 8 ...] [--scenario mtime_only ...] [--scale 0.02]
+                                 [--repeat 3] [--skip-revisions] [--skip-micro] [--update-budgets]
+"""
+
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Also puts sources/ on the path
+from bench_phases import (
+    SCENARIOS,
+    generate_tree,
+    git_revision,
+)
+
+from ctf_functions import (
+    compare_files,
+    create_file_dict,
+    sha_hash,
+)
+from ctf_report import (
+    ReportWriter,
+    set_report_writer,
+)
+
+import compare_two_folders
+
+
+OLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "old")
+
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression_budgets.json")
+
+# Revision of old/ the micro-benchmarks are measured against
+BASELINE_REVISION = 11
+
+# Revisions of old/ whose results can be read (see the adapters below)
+REVISIONS = (6, 7, 8, 9, 10, 11)
+
+# Scenarios of bench_phases used by default (huge_sparse hashes gigabytes per revision)
+DEFAULT_SCENARIOS = (
+    "deep_nesting",
+    "high_missing",
+    "mtime_only",
+)
+
+CATEGORIES = (
+    "files_pass",
+    "files_missing_in_source",
+    "files_missing_in_target",
+    "files_only_mtime_difference",
+    "files_any_difference_but_mtime",
+)
+
+# Nothing is reported, the revisions print into /dev/null anyway
+VERBOSE_QUIET = {
+    "general": False,
+    "files-pass": False,
+    "details": False,
+    "summary": False,
+}
+
+
+def load_revision(def_revision):
+    """
+    :param def_revision:    int, number of old/compare_two_folders_revN.py
+    :return:                module
+    """
+    name = f"compare_two_folders_rev{def_revision}"
+    spec = importlib.util.spec_from_file_location(name, os.path.join(OLD, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def counts_of_state(def_state):
+    """
+    :param def_state:   tuple, (missing in source, missing in target, identical, only mtime, any difference) as
+                        returned by evaluate_file_comparison_state of revisions 6 and 7
+    :return:            dict, category -> number of files
+    """
+    files_missing_source, files_missing_target, files_identical, files_only_mtime, files_any_difference = def_state
+    return {
+        "files_pass": len(files_identical),
+        "files_missing_in_source": len(files_missing_source),
+        "files_missing_in_target": len(files_missing_target),
+        "files_only_mtime_difference": len(files_only_mtime),
+        "files_any_difference_but_mtime": len(files_any_difference),
+    }
+
+
+def run_revision(
+    def_revision,
+    def_module,
+    def_folder_source,
+    def_folder_target,
+    def_options,
+    def_algorithm,
+):
+    """
+    Runs one comparison with the interface of the revision.
+    :param def_revision:    int, revision number (None: current engine)
+    :return:                dict, category -> number of files
+    """
+    if def_revision is None:
+        return_data = compare_two_folders.compare_folders(
+            def_folder_source,
+            def_folder_target,
+            def_algorithm,
+            [],
+            [],
+            def_options,
+            VERBOSE_QUIET,
+            None,
+            0,
+        )
+    elif def_revision == 6:
+        return counts_of_state(
+            def_module.evaluate_file_comparison_state(
+                def_folder_source,
+                def_folder_target,
+                [],
+                [],
+            )
+        )
+    elif def_revision == 7:
+        return counts_of_state(
+            def_module.evaluate_file_comparison_state(
+                def_folder_source,
+                def_folder_target,
+                [],
+                [],
+                def_options,
+                False,
+            )
+        )
+    elif def_revision == 8:
+        return_data = def_module.compare_folders(
+            def_folder_source,
+            def_folder_target,
+            [],
+            [],
+            def_options,
+            dict(VERBOSE_QUIET),
+            def_algorithm,
+        )
+    else:
+        return_data = def_module.compare_folders(
+            def_folder_source,
+            def_folder_target,
+            def_algorithm,
+            [],
+            [],
+            def_options,
+            dict(VERBOSE_QUIET),
+        )
+    return {category: return_data[category] for category in CATEGORIES}
+
+
+def time_revision(
+    def_revision,
+    def_module,
+    def_folder_source,
+    def_folder_target,
+    def_options,
+    def_algorithm,
+    def_repeat,
+):
+    """
+    :return:    dict (category -> number of files), float (best wall time in seconds)
+    """
+    best_time = None
+    counts = None
+    for _ in range(def_repeat):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start_time = time.perf_counter()
+            counts = run_revision(
+                def_revision,
+                def_module,
+                def_folder_source,
+                def_folder_target,
+                def_options,
+                def_algorithm,
+            )
+            elapsed_time = time.perf_counter() - start_time
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+    return counts, best_time
+
+
+def compare_revisions(
+    def_revisions,
+    def_scenarios,
+    def_workdir,
+    def_seed,
+    def_scale,
+    def_options,
+    def_algorithm,
+    def_repeat,
+    def_failures,
+):
+    """
+    :param def_failures:    list, failed checks are appended
+    :return:                dict, scenario -> results of the current engine and of every revision
+    """
+    modules = {}
+    results = {}
+    for revision in def_revisions:
+        try:
+            modules[revision] = load_revision(revision)
+        except ImportError as error:
+            # e.g. blake3 not installed for revisions 8 and later
+            results.setdefault("skipped", {})[f"rev{revision}"] = str(error)
+
+    for scenario in def_scenarios:
+        folder = os.path.join(def_workdir, f"{scenario}-seed{def_seed}-scale{def_scale:g}")
+        folder_source, folder_target = generate_tree(
+            folder,
+            scenario,
+            def_seed,
+            def_scale,
+        )
+        bytes_source = sum(
+            os.path.getsize(os.path.join(root, file))
+            for root, _, files in os.walk(folder_source)
+            for file in files
+        )
+        counts_current, time_current = time_revision(
+            None,
+            None,
+            folder_source,
+            folder_target,
+            def_options,
+            def_algorithm,
+            def_repeat,
+        )
+        scenario_results = {
+            "bytes_source": bytes_source,
+            "current": {
+                "counts": counts_current,
+                "wall_s": round(time_current, 6),
+                "mb_per_s": round(bytes_source / time_current / 1048576, 3),
+            },
+        }
+        for revision, module in modules.items():
+            counts, wall_time = time_revision(
+                revision,
+                module,
+                folder_source,
+                folder_target,
+                def_options,
+                def_algorithm,
+                def_repeat,
+            )
+            equal = counts == counts_current
+            scenario_results[f"rev{revision}"] = {
+                "counts": counts,
+                "classification_equal": equal,
+                "wall_s": round(wall_time, 6),
+                "mb_per_s": round(bytes_source / wall_time / 1048576, 3),
+                # Positive: the current engine is faster than the revision
+                "current_speedup_percent": round(100 * (wall_time / time_current - 1), 1),
+            }
+            if not equal:
+                def_failures.append(
+                    f"{scenario}: classification of rev{revision} differs: {counts} (current: {counts_current})"
+                )
+        results[scenario] = scenario_results
+    return results
+
+
+def best_time_per_call(
+    def_function,
+    def_args,
+    def_repeat,
+    def_min_time=0.2,
+):
+    """
+    Calls the function in rounds of at least def_min_time seconds.
+    :return:    float, best seconds per call of def_repeat rounds
+    """
+    number = 1
+    while True:
+        start_time = time.perf_counter()
+        for _ in range(number):
+            def_function(*def_args)
+        elapsed_time = time.perf_counter() - start_time
+        if elapsed_time >= def_min_time:
+            break
+        number *= 2
+    best_time = elapsed_time / number
+    for _ in range(def_repeat - 1):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            def_function(*def_args)
+        best_time = min(best_time, (time.perf_counter() - start_time) / number)
+    return best_time
+
+
+def run_micro_benchmarks(
+    def_workdir,
+    def_algorithm,
+    def_repeat,
+    def_baseline,
+):
+    """
+    Times every micro-benchmark with the current engine and, right after it, with the baseline revision.
+    :param def_baseline:    module, revision of old/ with the same functions
+    :return:                dict, micro-benchmark -> (description, seconds per call current, seconds per call
+                            baseline)
+    """
+    folder = os.path.join(def_workdir, "micro")
+    folder_tree = os.path.join(folder, "tree")
+    if not os.path.isdir(folder_tree):
+        for index in range(2000):
+            sub_folder = os.path.join(folder_tree, f"d{index % 20:02d}")
+            os.makedirs(sub_folder, exist_ok=True)
+            with open(os.path.join(sub_folder, f"file{index}.dat"), "wb") as f:
+                f.write(b"x" * (index % 512))
+    file_large = os.path.join(folder, "large.dat")
+    file_small_source = os.path.join(folder, "small_source.dat")
+    file_small_target = os.path.join(folder, "small_target.dat")
+    data = bytes(range(256)) * 16384
+    for file, size in ((file_large, 4194304), (file_small_source, 65536), (file_small_target, 65536)):
+        if not os.path.exists(file):
+            with open(file, "wb") as f:
+                f.write(data[:size])
+            os.utime(file, ns=(1600000000 * 10**9, 1600000000 * 10**9))
+
+    # Micro-benchmark -> description, function of the current engine, function of the baseline, arguments
+    benchmarks = {
+        "sha_hash": (
+            f"{def_algorithm} of a 4 MiB file",
+            sha_hash,
+            def_baseline.sha_hash,
+            (file_large, def_algorithm),
+        ),
+        "compare_files": (
+            f"STHB of two identical 64 KiB files ({def_algorithm})",
+            compare_files,
+            def_baseline.compare_files,
+            (file_small_source, file_small_target, def_algorithm, "STHB"),
+        ),
+        "create_file_dict": (
+            "scan of 2,000 files in 20 folders",
+            create_file_dict,
+            def_baseline.create_file_dict,
+            (folder_tree,),
+        ),
+    }
+    return {
+        name: (
+            description,
+            best_time_per_call(
+                function_current,
+                args,
+                def_repeat,
+            ),
+            best_time_per_call(
+                function_baseline,
+                args,
+                def_repeat,
+            ),
+        )
+        for name, (description, function_current, function_baseline, args) in benchmarks.items()
+    }
+
+
+def read_budgets():
+    """
+    :return:    dict, micro-benchmark -> highest ratio of the current time to the baseline time
+    """
+    try:
+        with open(BUDGETS, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def check_budgets(
+    def_micro,
+    def_failures,
+):
+    """
+    :return:    dict, micro-benchmark -> measured milliseconds per call, measured and budgeted ratio
+    """
+    budgets = read_budgets()
+    results = {}
+    for name, (description, seconds_current, seconds_baseline) in def_micro.items():
+        ratio = seconds_current / seconds_baseline
+        budget = budgets.get(name)
+        results[name] = {
+            "description": description,
+            "ms_per_call": round(seconds_current * 1000, 4),
+            f"ms_per_call_rev{BASELINE_REVISION}": round(seconds_baseline * 1000, 4),
+            "ratio": round(ratio, 3),
+            "budget_ratio": budget,
+        }
+        if budget is None:
+            def_failures.append(f"{name}: no budget in {os.path.basename(BUDGETS)}")
+        elif ratio > budget:
+            def_failures.append(
+                f"{name}: '{ratio:.3f}' times the time of rev{BASELINE_REVISION} exceeds the budget of '{budget}'"
+            )
+    return results
+
+
+def update_budgets(
+    def_micro,
+    def_margin,
+):
+    """
+    Stores the measured ratios times the margin as the budgets.
+    """
+    budgets = read_budgets()
+    for name, (_, seconds_current, seconds_baseline) in def_micro.items():
+        budgets[name] = round(seconds_current / seconds_baseline * def_margin, 2)
+    with open(BUDGETS, "w", encoding="utf-8") as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--revision",
+        action="append",
+        type=int,
+        choices=REVISIONS,
+        help="revision of old/ to compare with (repeatable; default: all comparable)",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help=f"scenario of bench_phases (repeatable; default: {', '.join(DEFAULT_SCENARIOS)})",
+    )
+    parser.add_argument("--scale", type=float, default=0.02, help="factor for counts and sizes (default: 0.02)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated trees (default: 1)")
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "ctf-bench"),
+        help="folder of the generated trees (default: <tmp>/ctf-bench)",
+    )
+    parser.add_argument("--options", default="STHB", help="comparison options (default: STHB)")
+    parser.add_argument("--algorithm", default="sha512", help="hash algorithm (default: sha512)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best counts (default: 3)")
+    parser.add_argument("--skip-revisions", action="store_true", help="run only the micro-benchmarks")
+    parser.add_argument("--skip-micro", action="store_true", help="run only the revision comparison")
+    parser.add_argument(
+        "--update-budgets",
+        action="store_true",
+        help=f"store the measured ratios to rev{BASELINE_REVISION} (times the margin) as the budgets",
+    )
+    parser.add_argument(
+        "--budget-margin",
+        type=float,
+        default=1.5,
+        help="factor between the measured ratios and the stored budgets (default: 1.5)",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "regression",
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "scale": args.scale,
+        "seed": args.seed,
+        "options": args.options,
+        "algorithm": args.algorithm,
+    }
+    failures = []
+
+    # The report of the current engine is rendered into /dev/null
+    report_writer = ReportWriter(os.devnull)
+    set_report_writer(report_writer)
+    try:
+        if not args.skip_revisions:
+            results["revisions"] = compare_revisions(
+                args.revision or REVISIONS,
+                args.scenario or DEFAULT_SCENARIOS,
+                args.workdir,
+                args.seed,
+                args.scale,
+                args.options,
+                args.algorithm,
+                args.repeat,
+                failures,
+            )
+        if not args.skip_micro:
+            try:
+                baseline = load_revision(BASELINE_REVISION)
+            except ImportError as error:
+                # Without the baseline the budgets can not be checked
+                baseline = None
+                failures.append(f"micro-benchmarks: rev{BASELINE_REVISION} can not be loaded: {error}")
+            if baseline is not None:
+                micro = run_micro_benchmarks(
+                    args.workdir,
+                    args.algorithm,
+                    args.repeat,
+                    baseline,
+                )
+                if args.update_budgets:
+                    update_budgets(
+                        micro,
+                        args.budget_margin,
+                    )
+                results["micro"] = check_budgets(
+                    micro,
+                    failures,
+                )
+    finally:
+        set_report_writer(None)
+        report_writer.close()
+    results["failures"] = failures
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,22 @@ Issue Log:
 
 
 Starting the script:
-./ctf.py
+./compare_two_folders.py compare SOURCE TARGET [--options STHB] [--algorithm blake3] [--workers 4] ...
+./compare_two_folders.py compare --config compare_two_folders.ini --config-profile ulmenstrasse
+./compare_two_folders.py agent FOLDER [--host 127.0.0.1] [--port 8765]
+./compare_two_folders.py compare SOURCE agent://HOST:PORT
+./compare_two_folders.py manifest FOLDER MANIFEST [--algorithm blake3] [--format binary [--compression lzma]]
+./compare_two_folders.py compare MANIFEST|SOURCE MANIFEST|TARGET
+./compare_two_folders.py compare SOURCE TARGET --shard 0/4 [--shard-method top] --shard-result shard0.json
+./compare_two_folders.py merge-shards shard0.json shard1.json shard2.json shard3.json
+./compare_two_folders.py replicas SOURCE REPLICA [REPLICA ...] [--options STHB] [--workers 4]
+./compare_two_folders.py compare SOURCE TARGET --sync [--no-verify] [--repair [--repair-min-size 64M]]
+./compare_two_folders.py compare SOURCE TARGET --profiler cprofile|sampling [--profile-output PREFIX]
+./compare_two_folders.py calibrate [--block-size 1M]
+./compare_two_folders.py compare SOURCE TARGET --algorithm auto [--security-bits 256]
+./compare_two_folders.py compare SOURCE TARGET --metrics-file /var/lib/node_exporter/textfile_collector/ctf.prom
+./compare_two_folders.py watch SOURCE TARGET [--settle 2] [--output changes.jsonl]
+./compare_two_folders.py compare --help
 
 
 Required packages in PyCharm and Raspberry Pi:
@@ -20,197 +35,339 @@ Name                         Type               Mac/Raspi Version  Dependencies
 ------------------------------------------------------------------------------------------------------------------------
 os                           standard-library   latest             -             -
 datetime                     standard-library   latest             -             -
+argparse                     standard-library   latest             -             -
+configparser                 standard-library   latest             -             -
 """
 
 import os
+import sys
 import datetime
 
 from ctf_functions import (
-    print_verbose,
+    CHECKS,
     search_file,
     compare_files,
+    options_to_mask,
+    classify_outcome,
+    FileCategory,
     evaluate_file_comparison_state,
+    derive_comparison_data,
+)
+from ctf_latency import (
+    LatencyRecorder,
+    latency_quantile,
+)
+from ctf_phases import (
+    PhaseTimings,
+    process_counters,
+)
+from ctf_report import (
+    ReportLogger,
+    print_report,
+    timestamp,
 )
 
 
-def compare_folders(
-    def_folder_source,
-    def_folder_target,
-    def_hash_algorithm,
-    def_exclude_files=None,
-    def_exclude_extensions=None,
-    def_options="STHB",
-    def_verbose=None,
+def print_files_identical(
+    def_files_identical,
+    def_logger,
 ):
-    def print_files_identical(def_files_identical):
-        digits_pass = f"0{len(str(len(def_files_identical)))}d"
-        count_files = 0
-        for idx, file in enumerate(
-            def_files_identical,
-            1,
-        ):
-            count_files += 1
-            print_verbose(
-                f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                f"PASS:      Files are identical:    '{file}' (file number: '{idx:{digits_pass}}')",
-                def_verbose["files-pass"],
-            )
-            for detail in def_files_identical[file]:
-                print_verbose(
-                    f"                     -> {detail}",
-                    def_verbose["details"] and def_verbose["files-pass"],
-                )
-        if def_files_identical:
-            print()
-        return count_files
+    digits_pass = f"0{len(str(len(def_files_identical)))}d"
+    for idx, file in enumerate(
+        def_files_identical,
+        1,
+    ):
+        def_logger.log_time(
+            "files-pass",
+            "PASS:      Files are identical:    '{}' (file number: '{:{}}')",
+            file,
+            idx,
+            digits_pass,
+        )
+        def_logger.log_details(
+            ("details", "files-pass"),
+            def_files_identical[file],
+        )
+    if def_files_identical:
+        print_report()
 
-    def print_files_missing(
-        def_files,
-        def_info_text,
+
+def print_files_missing(
+    def_files,
+    def_info_text,
+):
+    count_files = 0
+    for idx, (file, path) in enumerate(
+        def_files.items(),
+        1,
     ):
-        count_files = 0
-        for idx, (file, path) in enumerate(
-            def_files.items(),
-            1,
-        ):
-            count_files += 1
-            print(
-                f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                f"{def_info_text}: '{file}' in '{path}'"
-            )
-        if def_files.items():
-            print()
-        return count_files
+        count_files += 1
+        print_report(
+            f"{timestamp()}: "
+            f"{def_info_text}: '{file}' in '{path}'"
+        )
+    if def_files.items():
+        print_report()
+    return count_files
+
 
-    def print_files_missing_with_search(
-        def_files,
-        def_info,
+def print_files_missing_with_search(
+    def_files,
+    def_info,
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm,
+    def_options,
+    def_logger,
+    def_search_results=None,
+    def_options_compare=None,
+    def_block_size=4096,
+    def_call_counter=None,
+):
+    """
+    Prints the missing files and whether a file with the same name exists elsewhere in both folders.
+    :param def_files:               dict, missing files (relative path -> path)
+    :param def_info:                str, "source" or "target"
+    :param def_options:             str, options of the reported comparison
+    :param def_search_results:      dict, if given, the search and comparison results are stored in and reused from it
+    :param def_options_compare:     str, options for comparing the found files, must include def_options
+                                    (default: def_options)
+    :param def_call_counter:        CallCounter, counts the calls of the search and the comparison (see ctf_phases)
+    :return:                        int, number of missing files
+    """
+    option_mask = options_to_mask(def_options)
+    count_files = 0
+    for idx, (file, path) in enumerate(
+        def_files.items(),
+        1,
     ):
-        count_files = 0
-        for idx, (file, path) in enumerate(
-            def_files.items(),
-            1,
-        ):
-            count_files += 1
-            file_name_only = os.path.basename(file)
-            path_only = os.path.dirname(path)
+        count_files += 1
+        file_name_only = os.path.basename(file)
+        path_only = os.path.dirname(path)
+        if def_search_results is not None and file in def_search_results:
+            file_found_in_source, file_found_in_target, results = def_search_results[
+                file
+            ]
+        else:
             file_found_in_source = search_file(
-                file_name_only, search_path=def_folder_source
+                file_name_only,
+                search_path=def_folder_source,
+                def_call_counter=def_call_counter,
             )
             file_found_in_target = search_file(
-                file_name_only, search_path=def_folder_target
+                file_name_only,
+                search_path=def_folder_target,
+                def_call_counter=def_call_counter,
             )
+            results = None
             if file_found_in_source and file_found_in_target:
                 results = compare_files(
                     file_found_in_source,
                     file_found_in_target,
                     def_hash_algorithm,
-                    def_options,
+                    def_options_compare or def_options,
+                    def_block_size,
+                    def_call_counter=def_call_counter,
+                )
+            if def_search_results is not None:
+                def_search_results[file] = (
+                    file_found_in_source,
+                    file_found_in_target,
+                    results,
                 )
-                file_found_in_folder = {
-                    "source": file_found_in_source,
-                    "target": file_found_in_target,
-                }
-
-                file_identical = all((item["result"] for item in results))
-                if file_identical:
-                    print()
-                    print(
-                        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                        f"ERROR->OK: File missing in {def_info}: '{file_name_only}' in '{path_only}'"
-                    )
-                    print(
-                        f"                     -> but found in {def_info} folder: {file_found_in_folder[def_info]}"
-                    )
-                    print("                     -> and are identical: OK")
-                    print(
-                        f"                     -> check source file: {file_found_in_source}\n",
-                        f"                    -> check target file: {file_found_in_target}",
-                    )
-                    for detail in results:
-                        print_verbose(
-                            f"                     -> {detail}",
-                            def_verbose["details"],
-                        )
-                    print()
-                else:
-                    print()
-                    print(
-                        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                        f"ERROR:     File missing in {def_info}: '{file_name_only}' in '{path_only}'"
-                    )
-                    print(
-                        f"                     -> but found in {def_info} folder: {file_found_in_folder[def_info]}"
-                    )
-                    print("                     -> but are NOT identical: ERROR")
-                    print(
-                        f"                     -> check source file: {file_found_in_source}\n",
-                        f"                    -> check target file: {file_found_in_target}",
-                    )
-                    for detail in results:
-                        print_verbose(
-                            f"                     -> {detail}",
-                            def_verbose["details"],
-                        )
-                    print()
+        if results is not None:
+            results = results.restricted(option_mask)
+            file_found_in_folder = {
+                "source": file_found_in_source,
+                "target": file_found_in_target,
+            }
+
+            file_identical = (
+                classify_outcome(results.checked, results.passed)
+                == FileCategory.PASS
+            )
+            if file_identical:
+                print_report()
+                print_report(
+                    f"{timestamp()}: "
+                    f"ERROR->OK: File missing in {def_info}: '{file_name_only}' in '{path_only}'"
+                )
+                print_report(
+                    f"                     -> but found in {def_info} folder: {file_found_in_folder[def_info]}"
+                )
+                print_report("                     -> and are identical: OK")
+                print_report(
+                    f"                     -> check source file: {file_found_in_source}\n",
+                    f"                    -> check target file: {file_found_in_target}",
+                )
+                def_logger.log_details(
+                    "details",
+                    results,
+                )
+                print_report()
             else:
-                print(
-                    f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+                print_report()
+                print_report(
+                    f"{timestamp()}: "
                     f"ERROR:     File missing in {def_info}: '{file_name_only}' in '{path_only}'"
                 )
-        if def_files.items():
-            print()
-        return count_files
-
-    def print_files_only_mtime_difference(def_files_only_mtime_difference):
-        count_files = 0
-        for idx, (file, details) in enumerate(
-            def_files_only_mtime_difference.items(),
-            1,
-        ):
-            count_files += 1
-            print(
-                f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                f"ERROR->OK: File differs:           '{file}':"
-            )
-            print(
-                "                     -> OK: Only mtime differs. "
-                "Files are otherwise identical (size, hash or bits)."
-            )
-            for detail in details:
-                print_verbose(
-                    f"                     -> {detail}",
-                    def_verbose["details"],
+                print_report(
+                    f"                     -> but found in {def_info} folder: {file_found_in_folder[def_info]}"
                 )
-        if def_files_only_mtime_difference:
-            print()
-        return count_files
-
-    def print_files_any_difference_but_mtime(def_files_any_difference_but_mtime):
-        count_files = 0
-        for idx, (file, details) in enumerate(
-            def_files_any_difference_but_mtime.items(),
-            1,
-        ):
-            count_files += 1
-            print(
-                f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                f"ERROR:     File differs:           '{file}':"
-            )
-            for detail in details:
-                print_verbose(
-                    f"                     -> {detail}",
-                    def_verbose["details"],
+                print_report("                     -> but are NOT identical: ERROR")
+                print_report(
+                    f"                     -> check source file: {file_found_in_source}\n",
+                    f"                    -> check target file: {file_found_in_target}",
+                )
+                def_logger.log_details(
+                    "details",
+                    results,
                 )
-        if def_files_any_difference_but_mtime:
-            print()
-        return count_files
+                print_report()
+        else:
+            print_report(
+                f"{timestamp()}: "
+                f"ERROR:     File missing in {def_info}: '{file_name_only}' in '{path_only}'"
+            )
+    if def_files.items():
+        print_report()
+    return count_files
+
+
+def print_files_only_mtime_difference(
+    def_files_only_mtime_difference,
+    def_logger,
+):
+    count_files = 0
+    for idx, (file, details) in enumerate(
+        def_files_only_mtime_difference.items(),
+        1,
+    ):
+        count_files += 1
+        print_report(
+            f"{timestamp()}: "
+            f"ERROR->OK: File differs:           '{file}':"
+        )
+        print_report(
+            "                     -> OK: Only mtime differs. "
+            "Files are otherwise identical (size, hash or bits)."
+        )
+        def_logger.log_details(
+            "details",
+            details,
+        )
+    if def_files_only_mtime_difference:
+        print_report()
+    return count_files
 
+
+def print_files_any_difference_but_mtime(
+    def_files_any_difference_but_mtime,
+    def_logger,
+):
+    count_files = 0
+    for idx, (file, details) in enumerate(
+        def_files_any_difference_but_mtime.items(),
+        1,
+    ):
+        count_files += 1
+        print_report(
+            f"{timestamp()}: "
+            f"ERROR:     File differs:           '{file}':"
+        )
+        def_logger.log_details(
+            "details",
+            details,
+        )
+    if def_files_any_difference_but_mtime:
+        print_report()
+    return count_files
+
+
+def compare_folders(
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options="STHB",
+    def_verbose=None,
+    def_structured_writer=None,
+    def_progress_interval=10.0,
+    def_workers=1,
+    def_block_size=4096,
+    def_sync=False,
+    def_sync_verify=True,
+    def_repair=False,
+    def_repair_min_size=67108864,
+    def_shard=None,
+    def_metrics=None,
+):
+    return compare_folders_multi_options(
+        def_folder_source,
+        def_folder_target,
+        def_hash_algorithm,
+        def_exclude_files,
+        def_exclude_extensions,
+        [def_options],
+        def_verbose,
+        def_structured_writer,
+        def_progress_interval,
+        def_workers,
+        def_block_size,
+        def_sync,
+        def_sync_verify,
+        def_repair,
+        def_repair_min_size,
+        def_shard,
+        def_metrics,
+    )[def_options]
+
+
+def compare_folders_multi_options(
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options_list=("STHB",),
+    def_verbose=None,
+    def_structured_writer=None,
+    def_progress_interval=10.0,
+    def_workers=1,
+    def_block_size=4096,
+    def_sync=False,
+    def_sync_verify=True,
+    def_repair=False,
+    def_repair_min_size=67108864,
+    def_shard=None,
+    def_metrics=None,
+):
+    """
+    Compares two folders for several option strings at once. Both folders are scanned once and every check
+    of the union of the options is run once per file, the classification and report of each option string
+    is then derived from the stored per-check outcomes.
+    :param def_options_list:    list, option strings, e.g. ["S", "ST", "STHB"]
+    :param def_sync:            bool, afterwards copy the files missing in target and the differing files to target
+    :param def_sync_verify:     bool, hash the copied data and compare it with the source digest of the comparison
+    :param def_repair:          bool, when syncing, only write the differing data of differing files from
+                                def_repair_min_size bytes on
+    :param def_shard:           tuple, (index, count, method) to compare only one shard (see ctf_shard)
+    :param def_metrics:         ComparisonMetrics, updated during the run and given the results at the end
+                                (see ctf_metrics, created and closed by the caller)
+    :return:                    dict, option string -> counts (as returned by compare_folders), including
+                                "phases" (resource usage per phase, see ctf_phases), "process" (I/O counters
+                                and resource usage of the process) and "latency" (per-file latency histogram and
+                                slowest files and directories, see ctf_latency)
+    """
     if not os.path.exists(def_folder_source):
-        print(f"ERROR: Source folder '{def_folder_source}' does not exist")
+        print_report(f"ERROR: Source folder '{def_folder_source}' does not exist")
         exit()
-    if not os.path.exists(def_folder_target):
-        print(f"ERROR: Target folder '{def_folder_target}' does not exist")
+    # A target served by an agent ("agent://host:port", see ctf_agent) is checked when it is listed
+    if not def_folder_target.startswith("agent://") and not os.path.exists(
+        def_folder_target
+    ):
+        print_report(f"ERROR: Target folder '{def_folder_target}' does not exist")
         exit()
 
     if def_verbose is None:
@@ -220,12 +377,23 @@ def compare_folders(
             "details": True,
             "summary": True,
         }
+    logger = ReportLogger(def_verbose)
+    phase_timings = PhaseTimings()
+    latencies = LatencyRecorder()
+
+    options_all = "".join(
+        option
+        for _, option, _ in CHECKS
+        if any(option in options for options in def_options_list)
+    )
+
     (
         files_missing_source,
         files_missing_target,
-        files_identical,
-        files_only_mtime_difference,
-        files_any_difference_but_mtime,
+        files_identical_all,
+        count_files_pass_all,
+        files_only_mtime_difference_all,
+        files_any_difference_but_mtime_all,
         files_source_size,
         files_target_size,
     ) = evaluate_file_comparison_state(
@@ -234,260 +402,388 @@ def compare_folders(
         def_hash_algorithm,
         def_exclude_files,
         def_exclude_extensions,
-        def_options,
+        options_all,
         def_verbose,
+        def_structured_writer,
+        def_progress_interval,
+        def_workers,
+        def_block_size,
+        def_shard,
+        phase_timings,
+        def_metrics,
+        latencies,
+        def_options_list,
     )
 
-    print()
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-        f"BEGIN:     Evaluation of files comparison"
-    )
-    print_verbose(
-        "",
-        def_verbose["general"],
-    )
-
-    # Printing all identical files
-    count_files_pass = print_files_identical(files_identical)
+    # Files missing on one side are searched and compared once for all options
+    search_results = {}
+
+    return_data_per_options = {}
+    for options in def_options_list:
+        with phase_timings.phase("report"):
+            (
+                files_identical,
+                count_files_pass,
+                files_only_mtime_difference,
+                files_any_difference_but_mtime,
+            ) = derive_comparison_data(
+                files_identical_all,
+                count_files_pass_all,
+                files_only_mtime_difference_all,
+                files_any_difference_but_mtime_all,
+                options,
+                def_verbose["files-pass"],
+            )
 
-    # Printing all files missing in source
-    count_files_missing_in_source = print_files_missing_with_search(
-        files_missing_source,
-        "source",
-    )
+            print_report()
+            print_report(
+                f"{timestamp()}: "
+                f"BEGIN:     Evaluation of files comparison"
+            )
+            if options != options_all:
+                print_report(
+                    f"{timestamp()}: "
+                    f"OPTIONS:   '{options}' (derived from '{options_all}')"
+                )
+            logger.log(
+                "general",
+                "",
+            )
 
-    # Printing all files missing in target
-    count_files_missing_in_target = print_files_missing_with_search(
-        files_missing_target,
-        "target",
-    )
-    # TODO: COPY TO TARGET?
+            # Printing all identical files (only retained if passing files are reported)
+            print_files_identical(
+                files_identical,
+                logger,
+            )
 
-    # Printing all files which are identical apart from the modification times (mtime)
-    count_files_only_mtime_difference = print_files_only_mtime_difference(
-        files_only_mtime_difference
-    )
+        with phase_timings.phase("search"):
+            # Printing all files missing in source
+            count_files_missing_in_source = print_files_missing_with_search(
+                files_missing_source,
+                "source",
+                def_folder_source,
+                def_folder_target,
+                def_hash_algorithm,
+                options,
+                logger,
+                search_results,
+                options_all,
+                def_block_size,
+                phase_timings.calls,
+            )
 
-    # Printing all files which are identical apart from the modification times (mtime)
-    count_files_any_difference_but_mtime = print_files_any_difference_but_mtime(
-        files_any_difference_but_mtime
-    )
+            # Printing all files missing in target
+            count_files_missing_in_target = print_files_missing_with_search(
+                files_missing_target,
+                "target",
+                def_folder_source,
+                def_folder_target,
+                def_hash_algorithm,
+                options,
+                logger,
+                search_results,
+                options_all,
+                def_block_size,
+                phase_timings.calls,
+            )
 
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-        f"END:       Evaluation of files comparison"
-    )
-    print()
-    print()
-    return {
-        "files_pass": count_files_pass,
-        "files_missing_in_source": count_files_missing_in_source,
-        "files_missing_in_target": count_files_missing_in_target,
-        "files_only_mtime_difference": count_files_only_mtime_difference,
-        "files_any_difference_but_mtime": count_files_any_difference_but_mtime,
-        "files_source_size": files_source_size,
-        "files_target_size": files_target_size,
-    }
+        with phase_timings.phase("report"):
+            # Printing all files which are identical apart from the modification times (mtime)
+            count_files_only_mtime_difference = print_files_only_mtime_difference(
+                files_only_mtime_difference,
+                logger,
+            )
 
+            # Printing all files which are identical apart from the modification times (mtime)
+            count_files_any_difference_but_mtime = print_files_any_difference_but_mtime(
+                files_any_difference_but_mtime,
+                logger,
+            )
 
-if __name__ == "__main__":
-    start_time = datetime.datetime.now()
-    # if len(sys.argv) != 3:
-    #     print("Usage: python compare_folders.py folder1 folder2")
-    #     sys.exit(1)
-    # folder1 = sys.argv[1]
-    # folder2 = sys.argv[2]
-
-    # /usr/local/bin/rsync -avzHXA --delete --progress --progress --stats --dry-run --iconv=UTF8,UTF8-MAC
-    # --checksum test1/ test2/
-
-    # folder1 = "/Users/mh/temp/test1"
-    # folder2 = "/Users/mh/temp/test2"
-    # folder1 = "/Users/mh/temp/movieposters1"
-    # folder2 = "/Users/mh/temp/movieposters2"
-    # folder1 = "/Users/mh/temp/01 - Januar"
-    # folder2 = "/Users/mh/temp/02 - Januar"
-    # folder1 = "/Volumes/Untitled"
-    # folder2 = "/Users/mh/Documents/DJI Mini 3 Pro/DJI Mini 3 Pro"
-    # folder1 = "/Users/mh/Documents/Bilder/Diverse Fotos"
-    # folder2 = "/Volumes/ASRDataVolume_12004 - Daten/Users/mh/Documents/Bilder/Diverse Fotos"
-    folder1 = "/Users/mh/ownCloud/HM/Ulmenstrasse 16"
-    folder2 = "/Users/mh/ownCloud - hm@192.168.1.5/Ulmenstrasse 16"
-
-    # Optional: specify a list of files to exclude
-    # exclude_files = []
-    exclude_files = [".DS_Store"]
-
-    # Optional: specify a list of file extensions to exclude
-    # exclude_extensions = [".log"]
-    exclude_extensions = []
-
-    options_all_possible = [
-        "S",
-        "T",
-        "H",
-        "B",
-        "ST",
-        "SH",
-        "SB",
-        "TH",
-        "TB",
-        "HB",
-        "STH",
-        "STB",
-        "SHB",
-        "THB",
-        "STHB",
-    ]
+            print_report(
+                f"{timestamp()}: "
+                f"END:       Evaluation of files comparison"
+            )
+            print_report()
+            print_report()
+        return_data = {
+            "files_pass": count_files_pass,
+            "files_missing_in_source": count_files_missing_in_source,
+            "files_missing_in_target": count_files_missing_in_target,
+            "files_only_mtime_difference": count_files_only_mtime_difference,
+            "files_any_difference_but_mtime": count_files_any_difference_but_mtime,
+            "files_source_size": files_source_size,
+            "files_target_size": files_target_size,
+        }
+        if def_structured_writer is not None:
+            def_structured_writer.write_summary_record(
+                options,
+                return_data,
+            )
+        return_data_per_options[options] = return_data
 
-    options = ["STHB"]
-    # S = Compare the files for their size
-    # T = Compare the files for their modification time
-    # H = Compare the files using hashes
-    # B = Compare the files bitwise
-
-    verbose = {
-        "general": True,
-        "files-pass": False,
-        "details": True,
-        "summary": True,
-    }
-
-    hash_algorithm = "blake3"
-    # Possible algorithms:
-    # "sha256"
-    # "sha3_256"
-    # "blake2s" (256-bit)
-    # "sha512"
-    # "sha3_512"
-    # "blake2b" (512-bit)
-    # "blake3" (512-bit)
-
-    for option in options:
-        return_data = compare_folders(
-            folder1,
-            folder2,
-            hash_algorithm,
-            exclude_files,
-            exclude_extensions,
-            option,
-            verbose,
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"SUMMARY:",
-            verbose["summary"],
-        )
-        number_files_pass = return_data["files_pass"]
-        number_files_missing_in_source = return_data["files_missing_in_source"]
-        number_files_missing_in_target = return_data["files_missing_in_target"]
-        number_files_only_mtime_difference = return_data["files_only_mtime_difference"]
-        number_files_any_difference_but_mtime = return_data[
-            "files_any_difference_but_mtime"
-        ]
-        number_files_source_size = return_data["files_source_size"]
-        number_files_target_size = return_data["files_target_size"]
-        sum_both = (
-            number_files_pass
-            + number_files_only_mtime_difference
-            + number_files_any_difference_but_mtime
-        )
-        sum_source = sum_both + number_files_missing_in_target
-        sum_target = sum_both + number_files_missing_in_source
-        digits_num_files = f"0{len(str(max(sum_source, sum_target)))}d"
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files passed as being identical:                "
-            f"'{number_files_pass:{digits_num_files}}'",
-            verbose["summary"],
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files missing in source:                        "
-            f"'{number_files_missing_in_source:{digits_num_files}}'",
-            verbose["summary"],
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files missing in target:                        "
-            f"'{number_files_missing_in_target:{digits_num_files}}'",
-            verbose["summary"],
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files where only mtime differs:                 "
-            f"'{number_files_only_mtime_difference:{digits_num_files}}'",
-            verbose["summary"],
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files where something differs other than mtime: "
-            f"'{number_files_any_difference_but_mtime:{digits_num_files}}'",
-            verbose["summary"],
-        )
-        print_verbose(
-            "",
-            verbose["summary"],
+    # The target is synchronised once, from the index and classification of the comparison
+    if def_sync and (
+        def_folder_target.startswith("agent://")
+        or os.path.isfile(def_folder_source)
+        or os.path.isfile(def_folder_target)
+    ):
+        print_report(
+            f"{timestamp()}: "
+            f"ERROR:     Synchronisation needs a source and a target folder (no agent or manifest)"
         )
+    elif def_sync:
+        from ctf_sync import sync_to_target
+
+        with phase_timings.phase("sync"):
+            sync_to_target(
+                def_folder_source,
+                def_folder_target,
+                files_missing_target,
+                files_only_mtime_difference_all,
+                files_any_difference_but_mtime_all,
+                def_hash_algorithm,
+                def_sync_verify,
+                def_verbose,
+                def_workers,
+                def_block_size,
+                def_repair=def_repair,
+                def_repair_min_size=def_repair_min_size,
+            )
 
-        sum_source_check = (
-            number_files_any_difference_but_mtime
-            + number_files_only_mtime_difference
-            + number_files_pass
-            + number_files_missing_in_target
-        )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files in source:                                "
-            f"'{sum_source:{digits_num_files}}' (checked: {sum_source_check})",
-            verbose["summary"],
+    # The phases are shared by all option strings (one scan and one comparison pass)
+    phases = phase_timings.as_dict()
+    process = process_counters()
+    latency = latencies.as_dict()
+    for return_data in return_data_per_options.values():
+        return_data["phases"] = phases
+        return_data["process"] = process
+        return_data["latency"] = latency
+    if def_structured_writer is not None:
+        def_structured_writer.write_latency_record(latency)
+    if def_metrics is not None:
+        # Every option string looks up every missing file, only the first lookup searches
+        search_lookups = len(def_options_list) * (len(files_missing_source) + len(files_missing_target))
+        def_metrics.set_results(
+            return_data_per_options,
+            {
+                "missing_file_search": 1 - len(search_results) / search_lookups if search_lookups else 0.0,
+            },
         )
-        sum_target_check = (
-            number_files_any_difference_but_mtime
-            + number_files_only_mtime_difference
-            + number_files_pass
-            + number_files_missing_in_source
+    return return_data_per_options
+
+
+def print_summary(
+    def_return_data,
+    def_verbose,
+    def_start_time,
+    def_options=None,
+):
+    """
+    Prints the summary of a comparison run.
+    :param def_return_data:     dict, counts as returned by compare_folders
+    :param def_verbose:         dict, verbosity per category
+    :param def_start_time:      datetime, start of the run (for the running time)
+    :param def_options:         str, options shown in the headline (None: not shown)
+    """
+    logger = ReportLogger(def_verbose)
+    if not logger.enabled("summary"):
+        return
+    if def_options is None:
+        logger.log_time(
+            "summary",
+            "SUMMARY:",
         )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Number of files in target:                                "
-            f"'{sum_target:{digits_num_files}}' (checked: {sum_target_check})",
-            verbose["summary"],
+    else:
+        logger.log_time(
+            "summary",
+            "SUMMARY:   '{}'",
+            def_options,
         )
-        print_verbose(
-            "",
-            verbose["summary"],
+    number_files_pass = def_return_data["files_pass"]
+    number_files_missing_in_source = def_return_data["files_missing_in_source"]
+    number_files_missing_in_target = def_return_data["files_missing_in_target"]
+    number_files_only_mtime_difference = def_return_data["files_only_mtime_difference"]
+    number_files_any_difference_but_mtime = def_return_data[
+        "files_any_difference_but_mtime"
+    ]
+    number_files_source_size = def_return_data["files_source_size"]
+    number_files_target_size = def_return_data["files_target_size"]
+    sum_both = (
+        number_files_pass
+        + number_files_only_mtime_difference
+        + number_files_any_difference_but_mtime
+        + def_return_data.get("files_error", 0)
+    )
+    sum_source = sum_both + number_files_missing_in_target
+    sum_target = sum_both + number_files_missing_in_source
+    digits_num_files = f"0{len(str(max(sum_source, sum_target)))}d"
+    logger.log_time(
+        "summary",
+        "Number of files passed as being identical:                '{:{}}'",
+        number_files_pass,
+        digits_num_files,
+    )
+    logger.log_time(
+        "summary",
+        "Number of files missing in source:                        '{:{}}'",
+        number_files_missing_in_source,
+        digits_num_files,
+    )
+    logger.log_time(
+        "summary",
+        "Number of files missing in target:                        '{:{}}'",
+        number_files_missing_in_target,
+        digits_num_files,
+    )
+    logger.log_time(
+        "summary",
+        "Number of files where only mtime differs:                 '{:{}}'",
+        number_files_only_mtime_difference,
+        digits_num_files,
+    )
+    logger.log_time(
+        "summary",
+        "Number of files where something differs other than mtime: '{:{}}'",
+        number_files_any_difference_but_mtime,
+        digits_num_files,
+    )
+    if def_return_data.get("files_error"):
+        # Only replicas: files which could not be read on the replica
+        logger.log_time(
+            "summary",
+            "Number of files which could not be read:                  '{:{}}'",
+            def_return_data["files_error"],
+            digits_num_files,
         )
+    logger.log(
+        "summary",
+        "",
+    )
 
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Total size of files in source:                            "
-            f"'{number_files_source_size}' bytes",
-            verbose["summary"],
+    sum_source_check = (
+        number_files_any_difference_but_mtime
+        + number_files_only_mtime_difference
+        + number_files_pass
+        + number_files_missing_in_target
+    )
+    logger.log_time(
+        "summary",
+        "Number of files in source:                                '{:{}}' (checked: {})",
+        sum_source,
+        digits_num_files,
+        sum_source_check,
+    )
+    sum_target_check = (
+        number_files_any_difference_but_mtime
+        + number_files_only_mtime_difference
+        + number_files_pass
+        + number_files_missing_in_source
+    )
+    logger.log_time(
+        "summary",
+        "Number of files in target:                                '{:{}}' (checked: {})",
+        sum_target,
+        digits_num_files,
+        sum_target_check,
+    )
+    logger.log(
+        "summary",
+        "",
+    )
+
+    logger.log_time(
+        "summary",
+        "Total size of files in source:                            '{}' bytes",
+        number_files_source_size,
+    )
+    logger.log_time(
+        "summary",
+        "Total size of files in target:                            '{}' bytes",
+        number_files_target_size,
+    )
+    logger.log_time(
+        "summary",
+        "Delta:                                                    '{}' bytes",
+        abs(number_files_target_size - number_files_source_size),
+    )
+    logger.log(
+        "summary",
+        "",
+    )
+
+    end_time = datetime.datetime.now()
+    elapsed_time = end_time - def_start_time
+    logger.log_time(
+        "summary",
+        "Running time: '{}'",
+        elapsed_time,
+    )
+    # Resource usage per phase (see ctf_phases)
+    for phase, values in def_return_data.get("phases", {}).items():
+        logger.log_time(
+            "summary",
+            "Phase {:<14} wall '{:.3f}' s, CPU '{:.3f}' s, read '{}' bytes, opens '{}', stats '{}', listings '{}'",
+            f"'{phase}':",
+            values["wall_s"],
+            values["cpu_s"],
+            values.get("bytes_read", "-"),
+            values["opens"],
+            values["stats"],
+            values["listings"],
         )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Total size of files in target:                            "
-            f"'{number_files_target_size}' bytes",
-            verbose["summary"],
+
+    # Latency of the compared files (see ctf_latency)
+    latency = def_return_data.get("latency")
+    if latency and latency["files"]:
+        logger.log_time(
+            "summary",
+            "Latency per file: median < '{}' s, 90% < '{}' s, 99% < '{}' s, total '{:.3f}' s of '{}' files",
+            latency_quantile(latency["buckets"], 0.5),
+            latency_quantile(latency["buckets"], 0.9),
+            latency_quantile(latency["buckets"], 0.99),
+            latency["total_s"],
+            latency["files"],
         )
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Delta:                                                    "
-            f"'{abs(number_files_target_size - number_files_source_size)}' bytes",
-            verbose["summary"],
+        digits_files = len(str(max(latency["buckets"].values())))
+        for bound, count in latency["buckets"].items():
+            logger.log(
+                "summary",
+                "                     -> < {:>11} s: '{:{}d}' {}",
+                bound,
+                count,
+                digits_files,
+                "#" * max(1, round(40 * count / latency["files"])),
+            )
+        logger.log_time(
+            "summary",
+            "Slowest files:",
         )
-        print_verbose(
-            "",
-            verbose["summary"],
+        for item in latency["slowest_files"]:
+            logger.log(
+                "summary",
+                "                     -> '{:.6f}' s '{}' (size: '{}' bytes, checks: '{}')",
+                item["seconds"],
+                item["file"],
+                item["size"],
+                item["checks"],
+            )
+        logger.log_time(
+            "summary",
+            "Slowest directories:",
         )
+        for item in latency["slowest_directories"]:
+            logger.log(
+                "summary",
+                "                     -> '{:.6f}' s '{}' (files: '{}', size: '{}' bytes)",
+                item["seconds"],
+                item["directory"] or ".",
+                item["files"],
+                item["size"],
+            )
 
-        end_time = datetime.datetime.now()
-        elapsed_time = end_time - start_time
-        print_verbose(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-            f"Running time: "
-            f"'{elapsed_time}'",
-            verbose["summary"],
-        )
+
+if __name__ == "__main__":
+    from ctf_cli import main
+
+    sys.exit(main())
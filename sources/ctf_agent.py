@@ -0,0 +1,376 @@
+"""
+Hashing agent: runs next to the data of one folder (e.g. on the machine exporting a network share) and answers
+listing and hashing requests, so a comparison against it only transfers metadata and digests.
+
+Protocol: one JSON object per line in both directions over TCP.
+    {"command": "list", "exclude_files": [...], "exclude_extensions": [...]}
+        -> {"files": {relative path: [size, mtime_ns]}, "size": total size}
+    {"command": "hash", "file": relative path, "algorithm": "blake3", "block_size": 1048576}
+        -> {"digest": hex digest}
+    {"command": "block_digests", "file": relative path, "algorithm": "blake3", "block_size": 1048576}
+        -> {"digests": [hex digest of every block]}
+Errors are answered with {"error": message}.
+
+The agent does not authenticate clients, it listens on localhost unless told otherwise.
+
+Starting the agent and comparing against it:
+./compare_two_folders.py agent /srv/share/folder --host 127.0.0.1 --port 8765
+./compare_two_folders.py compare /local/folder agent://127.0.0.1:8765
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from ctf_functions import (
+    CHECK_BIT,
+    CHECK_HASH,
+    CHECK_MTIME,
+    CHECK_SIZE,
+    ComparisonResult,
+    create_file_dict,
+    new_hash,
+    sha_digest,
+)
+from ctf_report import (
+    print_report,
+    timestamp,
+)
+
+
+AGENT_URL_PREFIX = "agent://"
+
+AGENT_DEFAULT_PORT = 8765
+
+# Block size of the block digests used for the bitwise check against an agent
+AGENT_BLOCK_SIZE = 1048576
+
+# Seconds the client waits for an answer before it gives up on a stalled agent. The agent answers a hash
+# request only after reading the whole file, so this bounds the size of the files it can hash in time.
+AGENT_TIMEOUT = 600.0
+
+
+def parse_agent_url(def_url):
+    """
+    :param def_url:     str, e.g. "agent://192.168.1.5:8765"
+    :return:            str (host), int (port)
+    """
+    address = def_url[len(AGENT_URL_PREFIX) :].rstrip("/")
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address, AGENT_DEFAULT_PORT
+    return host, int(port)
+
+
+def file_block_digests(
+    def_filename,
+    def_hash_algorithm,
+    def_block_size=AGENT_BLOCK_SIZE,
+):
+    """
+    :return:    list of bytes, digest of every block of the file
+    """
+    digests = []
+    with open(def_filename, "rb") as f:
+        while data := f.read(def_block_size):
+            digests.append(new_hash(def_hash_algorithm, data).digest())
+    return digests
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the requests of one connection until the client closes it
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.answer(json.loads(line))
+            except (OSError, ValueError, KeyError, NotImplementedError) as error:
+                response = {"error": f"{type(error).__name__}: {error}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+    def resolve(self, def_file):
+        """
+        The listing does not follow symbolic links to directories but reports symbolic links to files, so the
+        directory of the file has to be below the folder while the file itself may point anywhere.
+        :return:    str, path of a file below the folder of the agent
+        """
+        folder = self.server.folder
+        path = os.path.normpath(os.path.join(folder, def_file))
+        directory = os.path.realpath(os.path.dirname(path))
+        if directory != folder and not directory.startswith(folder + os.sep):
+            raise ValueError(f"path outside of the folder: '{def_file}'")
+        return os.path.join(directory, os.path.basename(path))
+
+    def answer(self, def_request):
+        command = def_request["command"]
+        if command == "list":
+            file_stats = {}
+            _, size = create_file_dict(
+                self.server.folder,
+                def_request.get("exclude_files"),
+                def_request.get("exclude_extensions"),
+                def_file_stats=file_stats,
+            )
+            listing = {
+                file: [file_stat.st_size, file_stat.st_mtime_ns]
+                for file, file_stat in file_stats.items()
+            }
+            return {"files": listing, "size": size}
+        if command == "hash":
+            return {
+                "digest": sha_digest(
+                    self.resolve(def_request["file"]),
+                    def_request["algorithm"],
+                    def_request.get("block_size", AGENT_BLOCK_SIZE),
+                ).hex()
+            }
+        if command == "block_digests":
+            return {
+                "digests": [
+                    digest.hex()
+                    for digest in file_block_digests(
+                        self.resolve(def_request["file"]),
+                        def_request["algorithm"],
+                        def_request.get("block_size", AGENT_BLOCK_SIZE),
+                    )
+                ]
+            }
+        raise ValueError(f"unknown command: '{command}'")
+
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    """
+    Agent serving one folder, every connection is handled by its own thread
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(
+        self,
+        def_folder,
+        def_host="127.0.0.1",
+        def_port=AGENT_DEFAULT_PORT,
+    ):
+        self.folder = os.path.realpath(def_folder)
+        super().__init__(
+            (def_host, def_port),
+            AgentRequestHandler,
+        )
+
+
+def run_agent(
+    def_folder,
+    def_host="127.0.0.1",
+    def_port=AGENT_DEFAULT_PORT,
+):
+    """
+    Serves the folder until interrupted.
+    """
+    with AgentServer(def_folder, def_host, def_port) as server:
+        host, port = server.server_address[:2]
+        print_report(
+            f"{timestamp()}: "
+            f"AGENT:     Serving '{server.folder}' on '{AGENT_URL_PREFIX}{host}:{port}'"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class AgentClient:
+    """
+    Connection to an agent. Every thread uses its own connection, so requests of parallel comparisons do not
+    interleave. A request can be sent before the answer is needed (send, then receive) to overlap the work of
+    the agent with local work.
+    """
+
+    def __init__(
+        self,
+        def_host,
+        def_port=AGENT_DEFAULT_PORT,
+        def_timeout=AGENT_TIMEOUT,
+    ):
+        self.address = (def_host, def_port)
+        self.timeout = def_timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self.local.connection = (sock, sock.makefile("rb"))
+        return connection
+
+    def close(self):
+        """
+        Closes the connection of this thread, the next request opens a new one.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.connection = None
+            connection[1].close()
+            connection[0].close()
+
+    def send(self, def_request):
+        sock, _ = self._connection()
+        try:
+            sock.sendall(json.dumps(def_request).encode() + b"\n")
+        except OSError:
+            self.close()
+            raise
+
+    def receive(self):
+        _, reader = self._connection()
+        try:
+            line = reader.readline()
+        except OSError:
+            # A late answer would be taken for the answer of the next request
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError(f"agent {self.address} closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise OSError(response["error"])
+        return response
+
+    def call(self, def_request):
+        self.send(def_request)
+        return self.receive()
+
+
+class AgentTarget:
+    """
+    Target folder served by an agent. Provides the file index of the folder and a drop-in replacement of
+    compare_files which uses the metadata of the listing and the digests computed by the agent.
+    """
+
+    def __init__(
+        self,
+        def_url,
+        def_timeout=AGENT_TIMEOUT,
+    ):
+        """
+        :param def_url:         str, e.g. "agent://192.168.1.5:8765"
+        :param def_timeout:     float, seconds to wait for an answer of the agent
+        """
+        self.url = def_url.rstrip("/")
+        host, port = parse_agent_url(def_url)
+        self.client = AgentClient(
+            host,
+            port,
+            def_timeout,
+        )
+        self.metadata = {}
+
+    def create_file_dict(
+        self,
+        def_exclude_files=None,
+        def_exclude_extensions=None,
+        def_file_sizes=None,
+    ):
+        """
+        Same as create_file_dict for the folder of the agent, the paths are "agent://host:port/relative path".
+        """
+        response = self.client.call(
+            {
+                "command": "list",
+                "exclude_files": list(def_exclude_files or []),
+                "exclude_extensions": list(def_exclude_extensions or []),
+            }
+        )
+        self.metadata = response["files"]
+        if def_file_sizes is not None:
+            for file, (size, _) in self.metadata.items():
+                def_file_sizes[file] = size
+        files = {file: f"{self.url}/{file}" for file in self.metadata}
+        return files, response["size"]
+
+    def compare_files(
+        self,
+        def_file_source,
+        def_file_target,
+        def_hash_algorithm,
+        def_options,
+        def_block_size=4096,
+    ):
+        """
+        Same as compare_files with the target served by the agent. The bitwise check compares the digests of
+        the blocks of both files instead of the bytes, only the digests cross the network.
+        """
+        file = def_file_target[len(self.url) + 1 :]
+        target_size, target_mtime_ns = self.metadata[file]
+        file_source_stat = os.stat(def_file_source)
+        result = ComparisonResult(
+            def_source_size=file_source_stat.st_size,
+            def_target_size=target_size,
+            def_source_mtime_ns=file_source_stat.st_mtime_ns,
+            def_target_mtime_ns=target_mtime_ns,
+        )
+
+        if "S" in def_options:
+            result.checked |= CHECK_SIZE
+            if file_source_stat.st_size == target_size:
+                result.passed |= CHECK_SIZE
+
+        if "T" in def_options:
+            result.checked |= CHECK_MTIME
+            if file_source_stat.st_mtime_ns == target_mtime_ns:
+                result.passed |= CHECK_MTIME
+
+        # The agent hashes its file while the source is hashed here
+        if "H" in def_options:
+            result.checked |= CHECK_HASH
+            self.client.send(
+                {
+                    "command": "hash",
+                    "file": file,
+                    "algorithm": def_hash_algorithm,
+                    "block_size": max(def_block_size, AGENT_BLOCK_SIZE),
+                }
+            )
+            try:
+                result.source_digest = sha_digest(
+                    def_file_source,
+                    def_hash_algorithm,
+                    def_block_size,
+                )
+            finally:
+                # Always read the answer, the connection is reused for the next file
+                response = self.client.receive()
+            result.target_digest = bytes.fromhex(response["digest"])
+            if result.source_digest == result.target_digest:
+                result.passed |= CHECK_HASH
+
+        if "B" in def_options:
+            result.checked |= CHECK_BIT
+            self.client.send(
+                {
+                    "command": "block_digests",
+                    "file": file,
+                    "algorithm": def_hash_algorithm,
+                    "block_size": AGENT_BLOCK_SIZE,
+                }
+            )
+            try:
+                source_block_digests = file_block_digests(
+                    def_file_source,
+                    def_hash_algorithm,
+                )
+            finally:
+                response = self.client.receive()
+            target_block_digests = [
+                bytes.fromhex(digest) for digest in response["digests"]
+            ]
+            if source_block_digests == target_block_digests:
+                result.passed |= CHECK_BIT
+
+        return result
@@ -0,0 +1,308 @@
+"""
+Library interface of compare_two_folders. Nothing is printed, the per-file results are yielded while the
+comparison runs and a structured summary is available at the end:
+
+    comparison = FolderComparison("/data/source", "/backup/target", def_options="SH")
+    for file_result in comparison:
+        if file_result.category != "pass":
+            print(file_result.file, file_result.category)
+    print(comparison.summary.as_dict())
+
+Iterating can be stopped at any time (break or close()), the files not yet compared are not read. A missing
+folder raises FileNotFoundError (NotADirectoryError if it is a file) before anything is scanned.
+"""
+
+import errno
+import os
+
+from ctf_functions import (
+    CATEGORY_NAMES,
+    create_file_dict,
+    iter_comparison_data,
+)
+
+
+class FileResult:
+    """
+    Result of one file
+    """
+
+    __slots__ = (
+        "file",
+        "category",
+        "file_source",
+        "file_target",
+        "results",
+    )
+
+    def __init__(
+        self,
+        def_file,
+        def_category,
+        def_file_source=None,
+        def_file_target=None,
+        def_results=None,
+    ):
+        """
+        :param def_file:            str, path relative to the compared folders
+        :param def_category:        str, "pass", "only_mtime_difference", "any_difference_but_mtime",
+                                    "missing_in_source" or "missing_in_target"
+        :param def_file_source:     str, path in source (None if missing)
+        :param def_file_target:     str, path in target (None if missing)
+        :param def_results:         ComparisonResult, outcome of the checks (None if missing)
+        """
+        self.file = def_file
+        self.category = def_category
+        self.file_source = def_file_source
+        self.file_target = def_file_target
+        self.results = def_results
+
+    def as_dict(self):
+        return {
+            "file": self.file,
+            "category": self.category,
+            "file_source": self.file_source,
+            "file_target": self.file_target,
+            "checks": list(self.results) if self.results is not None else [],
+        }
+
+    def __repr__(self):
+        return f"FileResult({self.file!r}, {self.category!r})"
+
+
+class ComparisonSummary:
+    """
+    Counts of a comparison, the keys of as_dict() match the counts returned by compare_folders
+    """
+
+    def __init__(
+        self,
+        def_options,
+        def_files_source_size=0,
+        def_files_target_size=0,
+    ):
+        self.options = def_options
+        self.complete = False
+        self.files_source_size = def_files_source_size
+        self.files_target_size = def_files_target_size
+        self.counts = {
+            "pass": 0,
+            "missing_in_source": 0,
+            "missing_in_target": 0,
+            "only_mtime_difference": 0,
+            "any_difference_but_mtime": 0,
+        }
+
+    def add(self, def_category):
+        self.counts[def_category] += 1
+
+    def as_dict(self):
+        return {
+            "files_pass": self.counts["pass"],
+            "files_missing_in_source": self.counts["missing_in_source"],
+            "files_missing_in_target": self.counts["missing_in_target"],
+            "files_only_mtime_difference": self.counts["only_mtime_difference"],
+            "files_any_difference_but_mtime": self.counts["any_difference_but_mtime"],
+            "files_source_size": self.files_source_size,
+            "files_target_size": self.files_target_size,
+        }
+
+    def __repr__(self):
+        return f"ComparisonSummary({self.options!r}, complete={self.complete}, {self.as_dict()!r})"
+
+
+def check_folder(def_folder):
+    """
+    :param def_folder:  str, folder to compare
+    Raises FileNotFoundError if the folder does not exist, NotADirectoryError if it is not a directory.
+    """
+    if not os.path.exists(def_folder):
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), def_folder)
+    if not os.path.isdir(def_folder):
+        raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), def_folder)
+
+
+def iter_compare_folders(
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm="blake3",
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options="STHB",
+    def_workers=1,
+    def_block_size=4096,
+    def_summary=None,
+):
+    """
+    Compares two folders and yields a FileResult per file while the comparison runs: first the missing files,
+    then the compared files in the order they are finished. The folders are checked when called, not when
+    iterating.
+    :param def_summary:     ComparisonSummary, updated while the comparison runs (default: a new one)
+    :return:                generator of FileResult, its return value is the ComparisonSummary
+    """
+    # os.walk skips a missing folder silently, every file of the other side would be reported as missing
+    check_folder(def_folder_source)
+    check_folder(def_folder_target)
+    return _iter_compare_folders(
+        def_folder_source,
+        def_folder_target,
+        def_hash_algorithm,
+        def_exclude_files,
+        def_exclude_extensions,
+        def_options,
+        def_workers,
+        def_block_size,
+        def_summary if def_summary is not None else ComparisonSummary(def_options),
+    )
+
+
+def _iter_compare_folders(
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm,
+    def_exclude_files,
+    def_exclude_extensions,
+    def_options,
+    def_workers,
+    def_block_size,
+    def_summary,
+):
+    """
+    Generator of iter_compare_folders, the folders are checked already.
+    """
+    summary = def_summary
+    files_source, files_source_size = create_file_dict(
+        def_folder_source,
+        def_exclude_files,
+        def_exclude_extensions,
+    )
+    files_target, files_target_size = create_file_dict(
+        def_folder_target,
+        def_exclude_files,
+        def_exclude_extensions,
+    )
+    summary.files_source_size = files_source_size
+    summary.files_target_size = files_target_size
+
+    for file in files_target.keys() - files_source.keys():
+        summary.add("missing_in_source")
+        yield FileResult(
+            file,
+            "missing_in_source",
+            def_file_target=files_target[file],
+        )
+    for file in files_source.keys() - files_target.keys():
+        summary.add("missing_in_target")
+        yield FileResult(
+            file,
+            "missing_in_target",
+            def_file_source=files_source[file],
+        )
+
+    for file, results, category in iter_comparison_data(
+        files_source.keys() & files_target.keys(),
+        files_source,
+        files_target,
+        def_hash_algorithm,
+        def_options,
+        def_workers=def_workers,
+        def_block_size=def_block_size,
+    ):
+        category_name = CATEGORY_NAMES[category]
+        summary.add(category_name)
+        yield FileResult(
+            file,
+            category_name,
+            files_source[file],
+            files_target[file],
+            results,
+        )
+
+    summary.complete = True
+    return summary
+
+
+class FolderComparison:
+    """
+    Iterable comparison of two folders. Iterating yields a FileResult per file, afterwards "summary" holds the
+    ComparisonSummary. If the iteration is stopped early, the summary covers the files yielded so far and
+    "complete" is False.
+    """
+
+    def __init__(
+        self,
+        def_folder_source,
+        def_folder_target,
+        def_hash_algorithm="blake3",
+        def_exclude_files=None,
+        def_exclude_extensions=None,
+        def_options="STHB",
+        def_workers=1,
+        def_block_size=4096,
+    ):
+        self.summary = ComparisonSummary(def_options)
+        # Checks the folders, a missing folder is raised here already and not only when iterating
+        self._generator = iter_compare_folders(
+            def_folder_source,
+            def_folder_target,
+            def_hash_algorithm,
+            def_exclude_files,
+            def_exclude_extensions,
+            def_options,
+            def_workers,
+            def_block_size,
+            self.summary,
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._generator)
+
+    def close(self):
+        """
+        Stops the comparison, files not compared yet are not read.
+        """
+        self._generator.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *def_exc_info):
+        self.close()
+
+    def run(self):
+        """
+        Runs the comparison to the end without retaining the file results.
+        :return:    ComparisonSummary
+        """
+        for _ in self:
+            pass
+        return self.summary
+
+
+def compare_folders_summary(
+    def_folder_source,
+    def_folder_target,
+    def_hash_algorithm="blake3",
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options="STHB",
+    def_workers=1,
+    def_block_size=4096,
+):
+    """
+    Compares two folders without printing anything.
+    :return:    ComparisonSummary
+    """
+    return FolderComparison(
+        def_folder_source,
+        def_folder_target,
+        def_hash_algorithm,
+        def_exclude_files,
+        def_exclude_extensions,
+        def_options,
+        def_workers,
+        def_block_size,
+    ).run()
@@ -0,0 +1,251 @@
+"""
+Hash throughput calibration. The throughput of every hash algorithm is measured on the current CPU with
+in-memory buffers (no disk involved), cached per host and used to pick the fastest algorithm of a required
+security class ("--algorithm auto").
+
+Security classes are the collision resistance in bits: 128 (sha256, sha3_256, blake2s, blake3) or
+256 (sha512, sha3_512, blake2b).
+
+Calibrating and comparing with the fastest algorithm:
+./compare_two_folders.py calibrate [--block-size 1M] [--recalibrate]
+./compare_two_folders.py compare SOURCE TARGET --algorithm auto [--security-bits 256]
+"""
+
+import datetime
+import os
+import platform
+import socket
+import time
+
+from ctf_functions import (
+    HASHLIB_ALGORITHMS,
+    new_hash,
+)
+from ctf_report import (
+    print_report,
+    timestamp,
+)
+
+
+# Collision resistance of the algorithms in bits
+HASH_SECURITY_BITS = {
+    "sha256": 128,
+    "sha3_256": 128,
+    "blake2s": 128,
+    "blake3": 128,
+    "sha512": 256,
+    "sha3_512": 256,
+    "blake2b": 256,
+}
+
+SECURITY_CLASSES = (128, 256)
+
+CALIBRATION_VERSION = 1
+
+# Seconds every algorithm is measured
+CALIBRATION_DURATION = 0.25
+
+
+def default_cache_dir():
+    """
+    :return:    str, $XDG_CACHE_HOME/compare_two_folders (default: ~/.cache/compare_two_folders)
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "compare_two_folders")
+
+
+def host_signature():
+    """
+    :return:    dict, what the measured throughput depends on; a cached calibration of another signature is
+                measured again
+    """
+    return {
+        "host": socket.gethostname(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+    }
+
+
+def measure_throughput(
+    def_hash_algorithm,
+    def_block_size=4096,
+    def_duration=CALIBRATION_DURATION,
+):
+    """
+    Hashes an in-memory buffer block by block for a while.
+    :param def_block_size:  int, size of the blocks passed to update() (as read from the files)
+    :param def_duration:    float, seconds to measure
+    :return:                float, bytes per second
+    """
+    data = os.urandom(def_block_size)
+    sha = new_hash(def_hash_algorithm)
+    # Warm up (loads the backend, fills the caches)
+    sha.update(data)
+    number_of_bytes = 0
+    start_time = time.perf_counter()
+    elapsed_time = 0.0
+    while elapsed_time < def_duration:
+        # Several blocks per clock reading, small blocks would otherwise measure the clock
+        for _ in range(64):
+            sha.update(data)
+        number_of_bytes += 64 * def_block_size
+        elapsed_time = time.perf_counter() - start_time
+    sha.digest()
+    return number_of_bytes / elapsed_time
+
+
+def calibrate(
+    def_block_size=4096,
+    def_duration=CALIBRATION_DURATION,
+):
+    """
+    Measures every available algorithm.
+    :return:    dict, algorithm -> bytes per second (algorithms whose backend is not installed are left out)
+    """
+    throughputs = {}
+    for hash_algorithm in HASHLIB_ALGORITHMS + ("blake3",):
+        try:
+            throughputs[hash_algorithm] = measure_throughput(
+                hash_algorithm,
+                def_block_size,
+                def_duration,
+            )
+        except (ImportError, ValueError):
+            # Backend not installed (blake3) or algorithm not provided by the OpenSSL of this host
+            continue
+    return throughputs
+
+
+def cache_file(def_cache_dir=None):
+    """
+    :return:    str, calibration cache of this host
+    """
+    return os.path.join(
+        def_cache_dir or default_cache_dir(),
+        f"hash-calibration-{socket.gethostname()}.json",
+    )
+
+
+def load_calibration(def_cache_dir=None):
+    """
+    :return:    dict, block size (str) -> {algorithm: bytes per second}, empty if there is no valid cache
+    """
+    import json
+
+    try:
+        with open(cache_file(def_cache_dir), encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CALIBRATION_VERSION or cache.get("signature") != host_signature():
+        return {}
+    return cache.get("results", {})
+
+
+def save_calibration(
+    def_results,
+    def_cache_dir=None,
+):
+    """
+    :param def_results:     dict, block size (str) -> {algorithm: bytes per second}
+    """
+    import json
+
+    output = cache_file(def_cache_dir)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    # Written next to the cache and moved into place, parallel runs never read a partial file
+    output_temporary = f"{output}.{os.getpid()}"
+    with open(output_temporary, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": CALIBRATION_VERSION,
+                "signature": host_signature(),
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "results": def_results,
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+    os.replace(output_temporary, output)
+
+
+def get_throughputs(
+    def_block_size=4096,
+    def_cache_dir=None,
+    def_recalibrate=False,
+):
+    """
+    Returns the cached throughputs of this host for the block size, calibrating (and caching) them if needed.
+    :return:    dict, algorithm -> bytes per second
+    """
+    results = {} if def_recalibrate else load_calibration(def_cache_dir)
+    throughputs = results.get(str(def_block_size))
+    if throughputs is None:
+        throughputs = calibrate(def_block_size)
+        results[str(def_block_size)] = throughputs
+        try:
+            save_calibration(
+                results,
+                def_cache_dir,
+            )
+        except OSError as error:
+            print_report(
+                f"{timestamp()}: "
+                f"WARNING:   Hash calibration not cached: {error}"
+            )
+    return throughputs
+
+
+def select_algorithm(
+    def_security_bits=128,
+    def_block_size=4096,
+    def_cache_dir=None,
+):
+    """
+    :param def_security_bits:   int, required collision resistance in bits (128 or 256)
+    :return:                    str, fastest algorithm of at least the required security on this host
+    """
+    throughputs = get_throughputs(
+        def_block_size,
+        def_cache_dir,
+    )
+    candidates = {
+        hash_algorithm: throughput
+        for hash_algorithm, throughput in throughputs.items()
+        if HASH_SECURITY_BITS[hash_algorithm] >= def_security_bits
+    }
+    if not candidates:
+        raise ValueError(f"no hash algorithm with {def_security_bits} bits of security is available")
+    return max(candidates, key=candidates.get)
+
+
+def print_calibration(
+    def_throughputs,
+    def_block_size,
+):
+    """
+    Prints the throughputs, fastest first, and the algorithm "auto" selects per security class.
+    """
+    print_report(
+        f"{timestamp()}: "
+        f"CALIBRATE: Hash throughput on '{socket.gethostname()}' ({platform.machine()}, "
+        f"Python {platform.python_version()}), block size: '{def_block_size}' bytes"
+    )
+    for hash_algorithm, throughput in sorted(def_throughputs.items(), key=lambda item: -item[1]):
+        print_report(
+            f"                     -> {hash_algorithm:<10} '{throughput / 1048576:9.1f}' MB/s "
+            f"(security: '{HASH_SECURITY_BITS[hash_algorithm]}' bits)"
+        )
+    for security_bits in SECURITY_CLASSES:
+        candidates = [
+            hash_algorithm
+            for hash_algorithm in def_throughputs
+            if HASH_SECURITY_BITS[hash_algorithm] >= security_bits
+        ]
+        if candidates:
+            print_report(
+                f"{timestamp()}: "
+                f"AUTO:      '{max(candidates, key=def_throughputs.get)}' for '{security_bits}' bits of security"
+            )
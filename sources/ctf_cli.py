@@ -0,0 +1,1046 @@
+import argparse
+import configparser
+import datetime
+import os
+import sys
+
+from ctf_report import (
+    STRUCTURED_REPORT_FORMATS,
+    StructuredReportWriter,
+    ReportWriter,
+    print_report,
+    set_report_writer,
+    timestamp,
+)
+
+
+HASH_ALGORITHMS = (
+    "sha256",
+    "sha3_256",
+    "blake2s",
+    "sha512",
+    "sha3_512",
+    "blake2b",
+    "blake3",
+)
+
+VERBOSE_CATEGORIES = (
+    "general",
+    "files-pass",
+    "details",
+    "summary",
+)
+
+# Values used if neither the command line nor the config profile sets them
+COMPARE_DEFAULTS = {
+    "source": None,
+    "target": None,
+    "options": ["STHB"],
+    "algorithm": "blake3",
+    "exclude_files": [".DS_Store"],
+    "exclude_extensions": [],
+    "workers": 1,
+    "block_size": 4096,
+    "progress_interval": 10.0,
+    "output": None,
+    "output_format": "jsonl",
+    "log": None,
+    "log_compression": None,
+    "verbose": ["general", "details", "summary"],
+    "sync": False,
+    "verify": True,
+    "repair": False,
+    "repair_min_size": 67108864,
+    "shard": None,
+    "shard_method": "hash",
+    "shard_result": None,
+    "security_bits": 128,
+    "cache_dir": None,
+    "metrics_file": None,
+    "metrics_interval": 15.0,
+}
+
+
+def parse_list(def_value):
+    """
+    :param def_value:   str, comma separated values (e.g. "S, ST, STHB")
+    :return:            list, stripped values without empty entries
+    """
+    return [value.strip() for value in def_value.split(",") if value.strip()]
+
+
+def parse_size(def_value):
+    """
+    :param def_value:   str, size in bytes with an optional binary suffix (e.g. "4096", "64K", "1M")
+    :return:            int, size in bytes
+    """
+    value = def_value.strip().upper()
+    for suffix, factor in (("K", 1024), ("M", 1048576), ("G", 1073741824)):
+        if value.endswith(suffix):
+            return int(value[:-1]) * factor
+    return int(value)
+
+
+def parse_bool(def_value):
+    """
+    :param def_value:   str, e.g. "yes", "no", "true", "false", "1", "0"
+    :return:            bool
+    """
+    value = def_value.strip().lower()
+    if value in ("1", "yes", "true", "on"):
+        return True
+    if value in ("0", "no", "false", "off"):
+        return False
+    raise ValueError(def_value)
+
+
+# Conversion of the config profile values (strings) into the argument values
+COMPARE_CONVERTERS = {
+    "options": parse_list,
+    "exclude_files": parse_list,
+    "exclude_extensions": parse_list,
+    "workers": int,
+    "block_size": parse_size,
+    "progress_interval": float,
+    "verbose": parse_list,
+    "sync": parse_bool,
+    "verify": parse_bool,
+    "repair": parse_bool,
+    "repair_min_size": parse_size,
+    "security_bits": int,
+    "metrics_interval": float,
+}
+
+
+def subcommand_defaults(
+    *def_keys,
+    **def_overrides
+):
+    """
+    :param def_keys:        str, settings of the subcommand whose defaults are the ones of compare
+    :param def_overrides:   defaults of the subcommand which differ from compare
+    :return:                dict, setting -> default (filled in by apply_config_profile)
+    """
+    defaults = {key: COMPARE_DEFAULTS[key] for key in def_keys}
+    defaults.update(def_overrides)
+    return defaults
+
+
+MANIFEST_DEFAULTS = subcommand_defaults(
+    "algorithm",
+    "security_bits",
+    "cache_dir",
+    "exclude_files",
+    "exclude_extensions",
+    "workers",
+    "block_size",
+)
+
+REPLICAS_DEFAULTS = subcommand_defaults(
+    "algorithm",
+    "security_bits",
+    "cache_dir",
+    "exclude_files",
+    "exclude_extensions",
+    "workers",
+    "block_size",
+    "verbose",
+)
+
+WATCH_DEFAULTS = subcommand_defaults(
+    "algorithm",
+    "security_bits",
+    "cache_dir",
+    "exclude_files",
+    "exclude_extensions",
+    "workers",
+    "block_size",
+    "output",
+    "output_format",
+    verbose=["general", "summary"],
+)
+
+CALIBRATE_DEFAULTS = subcommand_defaults(
+    "cache_dir",
+    "block_size",
+)
+
+
+def add_config_arguments(def_parser):
+    """
+    Adds the config file and its profile, which set the settings not given on the command line.
+    """
+    def_parser.add_argument(
+        "--config",
+        help="config file (INI) with profiles as sections",
+    )
+    def_parser.add_argument(
+        "--config-profile",
+        help="profile (section) of the config file (default: the DEFAULT section)",
+    )
+
+
+def add_algorithm_arguments(
+    def_parser,
+    def_defaults,
+    def_help="hash algorithm",
+):
+    """
+    Adds the hash algorithm and the settings of its 'auto' selection to a subcommand.
+    :param def_defaults:    dict, defaults of the subcommand (shown in the help)
+    """
+    def_parser.add_argument(
+        "-a",
+        "--algorithm",
+        choices=HASH_ALGORITHMS + ("auto",),
+        help=f"{def_help}, 'auto' for the fastest on this host (default: {def_defaults['algorithm']})",
+    )
+    def_parser.add_argument(
+        "--security-bits",
+        type=int,
+        choices=(128, 256),
+        help=f"collision resistance the 'auto' algorithm needs at least (default: {def_defaults['security_bits']})",
+    )
+    add_cache_dir_argument(def_parser)
+
+
+def add_cache_dir_argument(def_parser):
+    def_parser.add_argument(
+        "--cache-dir",
+        help="folder of the hash calibration cache (default: ~/.cache/compare_two_folders)",
+    )
+
+
+def add_exclude_arguments(
+    def_parser,
+    def_defaults,
+):
+    """
+    Adds the exclusion of files by name and extension to a subcommand.
+    :param def_defaults:    dict, defaults of the subcommand (shown in the help)
+    """
+    def_parser.add_argument(
+        "--exclude-file",
+        dest="exclude_files",
+        action="append",
+        help=f"file name to exclude (repeatable; default: {', '.join(def_defaults['exclude_files']) or 'none'})",
+    )
+    def_parser.add_argument(
+        "--exclude-extension",
+        dest="exclude_extensions",
+        action="append",
+        help="file extension to exclude, e.g. '.log' (repeatable)",
+    )
+
+
+def add_workers_arguments(
+    def_parser,
+    def_defaults,
+    def_help_workers="number of files compared in parallel",
+    def_help_block_size="read block size for hashing and bitwise comparison",
+):
+    """
+    Adds the number of workers and the read block size to a subcommand.
+    :param def_defaults:    dict, defaults of the subcommand (shown in the help)
+    """
+    def_parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help=f"{def_help_workers} (default: {def_defaults['workers']})",
+    )
+    add_block_size_argument(
+        def_parser,
+        def_defaults,
+        def_help_block_size,
+    )
+
+
+def add_block_size_argument(
+    def_parser,
+    def_defaults,
+    def_help,
+):
+    def_parser.add_argument(
+        "--block-size",
+        type=parse_size,
+        help=f"{def_help}, e.g. '1M' (default: {def_defaults['block_size']})",
+    )
+
+
+def add_output_arguments(
+    def_parser,
+    def_defaults,
+    def_help,
+):
+    """
+    Adds the file and format of the structured records to a subcommand.
+    :param def_defaults:    dict, defaults of the subcommand (shown in the help)
+    """
+    def_parser.add_argument(
+        "--output",
+        help=f"{def_help} ('-' for stdout)",
+    )
+    def_parser.add_argument(
+        "--output-format",
+        choices=STRUCTURED_REPORT_FORMATS,
+        help=f"format of the structured records (default: {def_defaults['output_format']})",
+    )
+
+
+def add_verbose_arguments(
+    def_parser,
+    def_defaults,
+):
+    """
+    Adds the verbosity categories to a subcommand.
+    :param def_defaults:    dict, defaults of the subcommand (shown in the help)
+    """
+    def_parser.add_argument(
+        "-v",
+        "--verbose",
+        type=parse_list,
+        help=f"comma separated verbosity categories of {', '.join(VERBOSE_CATEGORIES)} "
+        f"(default: {','.join(def_defaults['verbose'])})",
+    )
+    def_parser.add_argument(
+        "-q",
+        "--quiet",
+        dest="verbose",
+        action="store_const",
+        const=[],
+        help="disable all verbosity categories",
+    )
+
+
+def add_profile_arguments(def_parser):
+    """
+    Adds the profiling switches to a subcommand (see ctf_profile).
+    """
+    def_parser.add_argument(
+        "--profiler",
+        choices=("cprofile", "sampling"),
+        help="profile the run: 'cprofile' (exact, main thread) or 'sampling' (all threads, low overhead)",
+    )
+    def_parser.add_argument(
+        "--profile-output",
+        default="ctf-profile",
+        help="prefix of the profile files PREFIX.pstats and PREFIX.collapsed (default: ctf-profile)",
+    )
+    def_parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=0.005,
+        help="seconds between two stack samples (default: 0.005)",
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="compare_two_folders",
+        description="Compares the files of two folders by size, modification time, hash and content.",
+    )
+    subparsers = parser.add_subparsers(
+        dest="command",
+        required=True,
+    )
+
+    compare = subparsers.add_parser(
+        "compare",
+        help="compare a source and a target folder",
+        description="Compares a source and a target folder. Settings not given on the command line are taken "
+        "from the config profile, if any.",
+    )
+    compare.add_argument("source", nargs="?", help="source folder or manifest file")
+    compare.add_argument(
+        "target",
+        nargs="?",
+        help="target folder, manifest file or agent serving the folder, e.g. 'agent://192.168.1.5:8765'",
+    )
+    add_config_arguments(compare)
+    compare.add_argument(
+        "-o",
+        "--options",
+        type=parse_list,
+        help="comma separated option strings of S (size), T (mtime), H (hash), B (bitwise), e.g. 'S,STHB' "
+        "(all option strings are evaluated from one comparison pass; default: STHB)",
+    )
+    add_algorithm_arguments(compare, COMPARE_DEFAULTS)
+    add_exclude_arguments(compare, COMPARE_DEFAULTS)
+    add_workers_arguments(compare, COMPARE_DEFAULTS)
+    compare.add_argument(
+        "--progress-interval",
+        type=float,
+        help="seconds between two progress reports, 0 disables them (default: 10)",
+    )
+    add_output_arguments(
+        compare,
+        COMPARE_DEFAULTS,
+        "write structured records to this file",
+    )
+    compare.add_argument(
+        "--log",
+        help="write the report to this log file instead of stdout",
+    )
+    compare.add_argument(
+        "--log-compression",
+        choices=("gzip", "lzma"),
+        help="compression of the log file",
+    )
+    compare.add_argument(
+        "--sync",
+        action="store_const",
+        const=True,
+        help="copy the files missing in target and the differing files to target after the comparison",
+    )
+    compare.add_argument(
+        "--no-verify",
+        dest="verify",
+        action="store_const",
+        const=False,
+        help="copy without hashing the copied data (allows copy_file_range/sendfile)",
+    )
+    compare.add_argument(
+        "--repair",
+        action="store_const",
+        const=True,
+        help="when syncing, write only the differing blocks of large differing files (delta repair)",
+    )
+    compare.add_argument(
+        "--repair-min-size",
+        type=parse_size,
+        help="smallest file repaired instead of copied, e.g. '16M' (default: 64M)",
+    )
+    compare.add_argument(
+        "--shard",
+        help="compare only one shard of the files, INDEX/COUNT with INDEX from 0, e.g. '2/8'",
+    )
+    compare.add_argument(
+        "--shard-method",
+        choices=("hash", "top"),
+        help="split by the hash of the path or by top-level directory (default: hash)",
+    )
+    compare.add_argument(
+        "--shard-result",
+        help="write the counts of the shard to this file (merged with 'merge-shards')",
+    )
+    compare.add_argument(
+        "--metrics-file",
+        help="write Prometheus metrics to this file during and after the run (node_exporter textfile collector)",
+    )
+    compare.add_argument(
+        "--metrics-interval",
+        type=float,
+        help="seconds between two updates of the metrics file, 0 writes it only at start and end (default: 15)",
+    )
+    add_verbose_arguments(compare, COMPARE_DEFAULTS)
+    add_profile_arguments(compare)
+    compare.set_defaults(
+        function=run_compare,
+        defaults=COMPARE_DEFAULTS,
+        converters=COMPARE_CONVERTERS,
+    )
+
+    agent = subparsers.add_parser(
+        "agent",
+        help="serve a folder for comparisons from another machine",
+        description="Serves a folder to comparisons against 'agent://HOST:PORT': the folder is listed and hashed "
+        "here, only metadata and digests are sent. Clients are not authenticated.",
+    )
+    agent.add_argument("folder", help="folder to serve")
+    agent.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1, use 0.0.0.0 for all interfaces)",
+    )
+    agent.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="port to listen on (default: 8765)",
+    )
+    agent.set_defaults(function=run_agent_command)
+
+    manifest = subparsers.add_parser(
+        "manifest",
+        help="write the manifest of a folder for later comparisons",
+        description="Scans and hashes a folder and writes its manifest (relative path, size, mtime, digest of "
+        "every file). A manifest can be given instead of the source or target folder of 'compare'.",
+    )
+    manifest.add_argument("folder", help="folder to scan")
+    manifest.add_argument("output", help="manifest file to write")
+    add_algorithm_arguments(
+        manifest,
+        MANIFEST_DEFAULTS,
+        "hash algorithm of the digests",
+    )
+    manifest.add_argument(
+        "--no-hash",
+        action="store_true",
+        help="only record size and mtime",
+    )
+    add_exclude_arguments(manifest, MANIFEST_DEFAULTS)
+    add_config_arguments(manifest)
+    add_workers_arguments(
+        manifest,
+        MANIFEST_DEFAULTS,
+        "number of files hashed in parallel",
+        "read block size for hashing",
+    )
+    manifest.add_argument(
+        "--format",
+        choices=("text", "binary"),
+        default="text",
+        help="manifest format, binary manifests are memory-mapped and searched in place (default: text)",
+    )
+    manifest.add_argument(
+        "--compression",
+        choices=("gzip", "lzma"),
+        help="compress a binary manifest for archival (it is decompressed into memory when opened)",
+    )
+    manifest.set_defaults(
+        function=run_manifest,
+        defaults=MANIFEST_DEFAULTS,
+        converters=COMPARE_CONVERTERS,
+    )
+
+    merge_shards = subparsers.add_parser(
+        "merge-shards",
+        help="merge the shard results of a sharded comparison",
+        description="Adds up the counts written by 'compare --shard INDEX/COUNT --shard-result FILE' of all "
+        "shards and prints the summary of the whole comparison.",
+    )
+    merge_shards.add_argument("inputs", nargs="+", help="shard result files, one per shard")
+    merge_shards.set_defaults(function=run_merge_shards)
+
+    replicas = subparsers.add_parser(
+        "replicas",
+        help="compare a source folder with several replicas",
+        description="Compares a source folder with every replica, reading and hashing every source file once. "
+        "Every replica is read by its own threads. Prints a summary per replica and a matrix of the files which "
+        "are missing or differ on any replica.",
+    )
+    replicas.add_argument("source", help="source folder")
+    replicas.add_argument("replicas", nargs="+", help="replica folders")
+    replicas.add_argument(
+        "-o",
+        "--options",
+        default="STHB",
+        help="option string of S (size), T (mtime), H (hash), B (bitwise, by block digests) (default: STHB)",
+    )
+    add_algorithm_arguments(replicas, REPLICAS_DEFAULTS)
+    add_exclude_arguments(replicas, REPLICAS_DEFAULTS)
+    add_config_arguments(replicas)
+    add_workers_arguments(
+        replicas,
+        REPLICAS_DEFAULTS,
+        "number of files read in parallel from the source and from every replica",
+        "read block size for hashing",
+    )
+    add_verbose_arguments(replicas, REPLICAS_DEFAULTS)
+    add_profile_arguments(replicas)
+    replicas.set_defaults(
+        function=run_replicas,
+        defaults=REPLICAS_DEFAULTS,
+        converters=COMPARE_CONVERTERS,
+    )
+
+    watch = subparsers.add_parser(
+        "watch",
+        help="compare two folders and keep the result up to date (Linux)",
+        description="Compares two folders once and then keeps the classification of every file up to date from "
+        "inotify events of both trees: only the touched files and directories are compared again. Runs until "
+        "interrupted (or for --duration seconds).",
+    )
+    watch.add_argument("source", help="source folder")
+    watch.add_argument("target", help="target folder")
+    watch.add_argument(
+        "-o",
+        "--options",
+        default="STHB",
+        help="option string of S (size), T (mtime), H (hash), B (bitwise) (default: STHB)",
+    )
+    add_algorithm_arguments(watch, WATCH_DEFAULTS)
+    add_exclude_arguments(watch, WATCH_DEFAULTS)
+    add_config_arguments(watch)
+    add_workers_arguments(watch, WATCH_DEFAULTS)
+    watch.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="seconds without events before the touched files are compared (default: 2)",
+    )
+    watch.add_argument(
+        "--duration",
+        type=float,
+        help="stop after this many seconds (default: run until interrupted)",
+    )
+    add_output_arguments(
+        watch,
+        WATCH_DEFAULTS,
+        "write a structured record for every changed classification to this file",
+    )
+    add_verbose_arguments(watch, WATCH_DEFAULTS)
+    watch.set_defaults(
+        function=run_watch,
+        defaults=WATCH_DEFAULTS,
+        converters=COMPARE_CONVERTERS,
+    )
+
+    calibrate = subparsers.add_parser(
+        "calibrate",
+        help="measure the hash throughput of this host",
+        description="Measures the throughput of every hash algorithm on this CPU with in-memory buffers and caches "
+        "it per host. '--algorithm auto' picks the fastest algorithm of the required security from the cache.",
+    )
+    add_block_size_argument(
+        calibrate,
+        CALIBRATE_DEFAULTS,
+        "size of the hashed blocks, as used for the comparison",
+    )
+    add_cache_dir_argument(calibrate)
+    add_config_arguments(calibrate)
+    calibrate.add_argument(
+        "--recalibrate",
+        action="store_true",
+        help="measure again even if the cache holds results for the block size",
+    )
+    calibrate.set_defaults(
+        function=run_calibrate,
+        defaults=CALIBRATE_DEFAULTS,
+        converters=COMPARE_CONVERTERS,
+    )
+    return parser
+
+
+def apply_config_profile(
+    def_parser,
+    def_args,
+):
+    """
+    Fills every setting not given on the command line from the config profile and then from the defaults.
+    :param def_parser:      ArgumentParser, used for reporting errors
+    :param def_args:        Namespace, parsed arguments (modified in place)
+    """
+    profile = {}
+    if getattr(def_args, "config", None):
+        config = configparser.ConfigParser(interpolation=None)
+        if not config.read(def_args.config):
+            def_parser.error(f"config file '{def_args.config}' can not be read")
+        if def_args.config_profile:
+            if not config.has_section(def_args.config_profile):
+                def_parser.error(
+                    f"profile '{def_args.config_profile}' not found in '{def_args.config}'"
+                )
+            profile = dict(config.items(def_args.config_profile))
+        else:
+            profile = dict(config.defaults())
+    for key, default in getattr(def_args, "defaults", {}).items():
+        if getattr(def_args, key, None) is not None:
+            continue
+        if key in profile:
+            converter = def_args.converters.get(key, str)
+            try:
+                value = converter(profile[key])
+            except ValueError:
+                def_parser.error(f"invalid value for '{key}' in profile: '{profile[key]}'")
+        else:
+            value = default
+        setattr(def_args, key, value)
+
+
+def resolve_hash_algorithm(def_args):
+    """
+    Replaces the algorithm "auto" by the fastest algorithm of the required security on this host (see
+    ctf_calibration, calibrated on first use).
+    :param def_args:    Namespace, parsed arguments (modified in place)
+    """
+    if def_args.algorithm != "auto":
+        return
+    from ctf_calibration import select_algorithm
+
+    def_args.algorithm = select_algorithm(
+        def_args.security_bits,
+        def_args.block_size,
+        def_args.cache_dir,
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"OPTIONS:   Algorithm 'auto' is '{def_args.algorithm}' on this host "
+        f"(at least '{def_args.security_bits}' bits of security)"
+    )
+
+
+def run_compare(
+    def_parser,
+    def_args,
+):
+    if def_args.source is None or def_args.target is None:
+        def_parser.error("source and target folder are required (as arguments or in the profile)")
+    for options in def_args.options:
+        if not options or set(options) - set("STHB"):
+            def_parser.error(f"invalid option string: '{options}' (use S, T, H and B)")
+    unknown_categories = set(def_args.verbose) - set(VERBOSE_CATEGORIES)
+    if unknown_categories:
+        def_parser.error(f"unknown verbosity categories: {', '.join(sorted(unknown_categories))}")
+    if def_args.algorithm not in HASH_ALGORITHMS + ("auto",):
+        def_parser.error(f"unknown hash algorithm: '{def_args.algorithm}'")
+    if def_args.security_bits not in (128, 256):
+        def_parser.error(f"unknown security class: '{def_args.security_bits}' bits (use 128 or 256)")
+    if def_args.output_format not in STRUCTURED_REPORT_FORMATS:
+        def_parser.error(f"unknown output format: '{def_args.output_format}'")
+    if def_args.log_compression not in (None, "gzip", "lzma"):
+        def_parser.error(f"unknown log compression: '{def_args.log_compression}'")
+    if def_args.workers < 1:
+        def_parser.error("the number of workers has to be at least 1")
+    if def_args.sync and def_args.target.startswith("agent://"):
+        def_parser.error("--sync is not supported for a target served by an agent")
+    if def_args.sync and (os.path.isfile(def_args.source) or os.path.isfile(def_args.target)):
+        def_parser.error("--sync needs a source and a target folder, not a manifest")
+    for folder in (def_args.source, def_args.target):
+        if os.path.isfile(folder):
+            from ctf_manifest import check_manifest
+
+            try:
+                check_manifest(folder)
+            except (OSError, ValueError) as error:
+                def_parser.error(str(error))
+    verbose = {category: category in def_args.verbose for category in VERBOSE_CATEGORIES}
+    shard = None
+    if def_args.shard is not None:
+        from ctf_shard import parse_shard
+
+        try:
+            shard = parse_shard(
+                def_args.shard,
+                def_args.shard_method,
+            )
+        except ValueError as error:
+            def_parser.error(str(error))
+    elif def_args.shard_result is not None:
+        def_parser.error("--shard-result needs --shard")
+    if def_args.metrics_interval < 0:
+        def_parser.error("the metrics interval can not be negative")
+
+    # Imported here so that parsing the command line (and --help) does not load the comparison engine
+    from compare_two_folders import (
+        compare_folders_multi_options,
+        print_summary,
+    )
+
+    start_time = datetime.datetime.now()
+
+    # All report lines are buffered and written by a background thread, flushed on exit or signal
+    report_writer = ReportWriter(
+        def_args.log,
+        def_args.log_compression if def_args.log else None,
+    )
+    report_writer.install_signal_handlers()
+    set_report_writer(report_writer)
+
+    structured_writer = None
+    if def_args.output is not None:
+        structured_writer = StructuredReportWriter(
+            def_args.output,
+            def_args.output_format,
+        )
+
+    metrics = None
+    if def_args.metrics_file is not None:
+        from ctf_metrics import ComparisonMetrics
+
+        labels = {
+            "source": def_args.source,
+            "target": def_args.target,
+        }
+        if def_args.config_profile:
+            labels["profile"] = def_args.config_profile
+        metrics = ComparisonMetrics(
+            def_args.metrics_file,
+            labels,
+            def_args.metrics_interval,
+        )
+        metrics.start()
+
+    try:
+        resolve_hash_algorithm(def_args)
+        # All options are evaluated from one scan and one comparison pass
+        return_data_per_options = compare_folders_multi_options(
+            def_args.source,
+            def_args.target,
+            def_args.algorithm,
+            def_args.exclude_files,
+            [extension.lower() for extension in def_args.exclude_extensions],
+            def_args.options,
+            verbose,
+            structured_writer,
+            def_args.progress_interval,
+            def_args.workers,
+            def_args.block_size,
+            def_args.sync,
+            def_args.verify,
+            def_args.repair,
+            def_args.repair_min_size,
+            shard,
+            metrics,
+        )
+        if def_args.shard_result is not None:
+            from ctf_shard import write_shard_result
+
+            write_shard_result(
+                def_args.shard_result,
+                shard,
+                def_args.source,
+                def_args.target,
+                return_data_per_options,
+            )
+        for options in def_args.options:
+            print_summary(
+                return_data_per_options[options],
+                verbose,
+                start_time,
+                options if len(def_args.options) > 1 else None,
+            )
+    finally:
+        if metrics is not None:
+            # Without results (error, interrupt) the run is written as failed
+            metrics.close()
+        if structured_writer is not None:
+            structured_writer.close()
+        set_report_writer(None)
+        report_writer.close()
+    return 0
+
+
+def run_agent_command(
+    def_parser,
+    def_args,
+):
+    if not os.path.isdir(def_args.folder):
+        def_parser.error(f"folder '{def_args.folder}' does not exist")
+
+    from ctf_agent import run_agent
+
+    run_agent(
+        def_args.folder,
+        def_args.host,
+        def_args.port,
+    )
+    return 0
+
+
+def run_manifest(
+    def_parser,
+    def_args,
+):
+    if not os.path.isdir(def_args.folder):
+        def_parser.error(f"folder '{def_args.folder}' does not exist")
+    if def_args.workers < 1:
+        def_parser.error("the number of workers has to be at least 1")
+    if def_args.compression is not None and def_args.format != "binary":
+        def_parser.error("--compression is only supported for binary manifests")
+
+    from ctf_manifest import export_manifest
+
+    if def_args.no_hash:
+        def_args.algorithm = None
+    else:
+        resolve_hash_algorithm(def_args)
+    export_manifest(
+        def_args.folder,
+        def_args.output,
+        def_args.algorithm,
+        def_args.exclude_files,
+        [extension.lower() for extension in def_args.exclude_extensions],
+        def_args.workers,
+        def_args.block_size,
+        def_args.format,
+        def_args.compression,
+    )
+    return 0
+
+
+def run_calibrate(
+    def_parser,
+    def_args,
+):
+    if def_args.block_size < 1:
+        def_parser.error("the block size has to be at least 1 byte")
+
+    from ctf_calibration import (
+        get_throughputs,
+        print_calibration,
+    )
+
+    throughputs = get_throughputs(
+        def_args.block_size,
+        def_args.cache_dir,
+        def_args.recalibrate,
+    )
+    print_calibration(
+        throughputs,
+        def_args.block_size,
+    )
+    return 0
+
+
+def run_merge_shards(
+    def_parser,
+    def_args,
+):
+    from ctf_shard import merge_shard_results
+    from compare_two_folders import print_summary
+
+    start_time = datetime.datetime.now()
+    try:
+        return_data_per_options, settings = merge_shard_results(def_args.inputs)
+    except (OSError, ValueError, KeyError) as error:
+        def_parser.error(f"shard results can not be merged: {error}")
+    print_report(
+        f"{timestamp()}: "
+        f"SHARD:     Merged '{settings['shards']}' shards (split by '{settings['method']}')"
+    )
+    verbose = {category: True for category in VERBOSE_CATEGORIES}
+    for options, return_data in return_data_per_options.items():
+        print_summary(
+            return_data,
+            verbose,
+            start_time,
+            options,
+        )
+    return 0
+
+
+def run_replicas(
+    def_parser,
+    def_args,
+):
+    if not def_args.options or set(def_args.options) - set("STHB"):
+        def_parser.error(f"invalid option string: '{def_args.options}' (use S, T, H and B)")
+    for folder in [def_args.source] + def_args.replicas:
+        if not os.path.isdir(folder):
+            def_parser.error(f"folder '{folder}' does not exist")
+    replicas = set()
+    for folder in def_args.replicas:
+        if os.path.realpath(folder) in replicas:
+            def_parser.error(f"replica '{folder}' is given more than once")
+        replicas.add(os.path.realpath(folder))
+    if def_args.workers < 1:
+        def_parser.error("the number of workers has to be at least 1")
+    unknown_categories = set(def_args.verbose) - set(VERBOSE_CATEGORIES)
+    if unknown_categories:
+        def_parser.error(f"unknown verbosity categories: {', '.join(sorted(unknown_categories))}")
+    verbose = {category: category in def_args.verbose for category in VERBOSE_CATEGORIES}
+
+    from ctf_replicas import compare_replicas
+    from compare_two_folders import print_summary
+
+    start_time = datetime.datetime.now()
+    resolve_hash_algorithm(def_args)
+    return_data_per_replica, _ = compare_replicas(
+        def_args.source,
+        def_args.replicas,
+        def_args.algorithm,
+        def_args.exclude_files,
+        [extension.lower() for extension in def_args.exclude_extensions],
+        def_args.options,
+        verbose,
+        def_args.workers,
+        def_args.block_size,
+    )
+    for replica, return_data in return_data_per_replica.items():
+        print_summary(
+            return_data,
+            verbose,
+            start_time,
+            replica,
+        )
+    return 0
+
+
+def run_watch(
+    def_parser,
+    def_args,
+):
+    if not sys.platform.startswith("linux"):
+        def_parser.error("watch mode needs inotify (Linux)")
+    if not def_args.options or set(def_args.options) - set("STHB"):
+        def_parser.error(f"invalid option string: '{def_args.options}' (use S, T, H and B)")
+    for folder in (def_args.source, def_args.target):
+        if not os.path.isdir(folder):
+            def_parser.error(f"folder '{folder}' does not exist")
+    if def_args.workers < 1:
+        def_parser.error("the number of workers has to be at least 1")
+    if def_args.settle <= 0:
+        def_parser.error("the settle time has to be positive")
+    unknown_categories = set(def_args.verbose) - set(VERBOSE_CATEGORIES)
+    if unknown_categories:
+        def_parser.error(f"unknown verbosity categories: {', '.join(sorted(unknown_categories))}")
+    verbose = {category: category in def_args.verbose for category in VERBOSE_CATEGORIES}
+
+    from ctf_watch import FolderWatch
+
+    resolve_hash_algorithm(def_args)
+    structured_writer = None
+    if def_args.output is not None:
+        structured_writer = StructuredReportWriter(
+            def_args.output,
+            def_args.output_format,
+        )
+    try:
+        try:
+            folder_watch = FolderWatch(
+                def_args.source,
+                def_args.target,
+                def_args.algorithm,
+                def_args.exclude_files,
+                [extension.lower() for extension in def_args.exclude_extensions],
+                def_args.options,
+                verbose,
+                def_args.workers,
+                def_args.block_size,
+                def_args.settle,
+                structured_writer,
+            )
+            folder_watch.start()
+        except OSError as error:
+            print_report(
+                f"{timestamp()}: "
+                f"ERROR:     {error}"
+            )
+            return 1
+        folder_watch.run(def_args.duration)
+    finally:
+        if structured_writer is not None:
+            structured_writer.close()
+    return 0
+
+
+def main(def_argv=None):
+    """
+    Command line entry point.
+    :param def_argv:    list, command line arguments (default: sys.argv[1:])
+    :return:            int, exit status
+    """
+    parser = build_parser()
+    args = parser.parse_args(def_argv)
+    apply_config_profile(
+        parser,
+        args,
+    )
+    if getattr(args, "profiler", None) is not None:
+        if args.profile_interval <= 0:
+            parser.error("the profile interval has to be positive")
+        from ctf_profile import run_profiled
+
+        return run_profiled(
+            args.function,
+            (parser, args),
+            args.profiler,
+            args.profile_output,
+            args.profile_interval,
+        )
+    return args.function(
+        parser,
+        args,
+    )
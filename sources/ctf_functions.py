@@ -1,12 +1,21 @@
-import hashlib
-import blake3
 import os
 import datetime
+import enum
+import collections
+import functools
 
 # Module "string": Common string operations
 # (https://docs.python.org/3.11/library/sys.html#module-sys)
 from string import Template
 
+from ctf_phases import PhaseTimings
+from ctf_progress import ComparisonProgress
+from ctf_report import (
+    ReportLogger,
+    print_report,
+    timestamp,
+)
+
 
 class DeltaTemplate(Template):
     """
@@ -45,157 +54,355 @@ def strfdelta(
 def get_file_hash(def_file_path):
     with open(def_file_path, "rb") as f:
         file_data = f.read()
-        return hashlib.sha512(file_data).hexdigest()
+        return new_hash("sha512", file_data).hexdigest()
 
 
-def sha_hash(
+# Hash algorithms provided by hashlib, the others have their own backend module
+HASHLIB_ALGORITHMS = (
+    "sha256",
+    "sha3_256",
+    "blake2s",
+    "sha512",
+    "sha3_512",
+    "blake2b",
+)
+
+# Hash object constructors by algorithm, filled on first use
+_hash_constructors = {}
+
+
+def new_hash(
+    def_hash_algorithm,
+    def_data=b"",
+):
+    """
+    Creates a hash object. The backend (hashlib or blake3) is only imported when an algorithm of it is used
+    for the first time, so runs without hash checks do not pay for loading it.
+    :param def_hash_algorithm:  str, e.g. "sha256" or "blake3"
+    :param def_data:            bytes, initial data
+    :return:                    hash object
+    """
+    constructor = _hash_constructors.get(def_hash_algorithm)
+    if constructor is None:
+        if def_hash_algorithm in HASHLIB_ALGORITHMS:
+            import hashlib
+
+            constructor = getattr(hashlib, def_hash_algorithm)
+        elif def_hash_algorithm == "blake3":
+            import blake3
+
+            constructor = blake3.blake3
+        else:
+            raise NotImplementedError(f"No hash algorithm: '{def_hash_algorithm}'")
+        _hash_constructors[def_hash_algorithm] = constructor
+    return constructor(def_data)
+
+
+def sha_digest(
     def_filename,
     def_hash_algorithm,
+    def_block_size=4096,
 ):
-    """Calculate the SHA512 hash of a file."""
-    if def_hash_algorithm == "sha256":
-        sha = hashlib.sha256()
-    elif def_hash_algorithm == "sha3_256":
-        sha = hashlib.sha3_256()
-    elif def_hash_algorithm == "blake2s":
-        sha = hashlib.blake2s()
-    elif def_hash_algorithm == "sha512":
-        sha = hashlib.sha512()
-    elif def_hash_algorithm == "sha3_512":
-        sha = hashlib.sha3_512()
-    elif def_hash_algorithm == "blake2b":
-        sha = hashlib.blake2b()
-    elif def_hash_algorithm == "blake3":
-        sha = blake3.blake3()
-    else:
-        raise NotImplementedError(f"No hash algorithm: '{def_hash_algorithm}'")
+    """Calculate the raw digest of a file."""
+    sha = new_hash(def_hash_algorithm)
     with open(def_filename, "rb") as f:
         while True:
-            if data := f.read(4096):
+            if data := f.read(def_block_size):
                 sha.update(data)
             else:
                 break
-    return sha.hexdigest()
+    return sha.digest()
 
 
-def print_verbose(
-    def_message,
-    def_verbose,
+def sha_hash(
+    def_filename,
+    def_hash_algorithm,
+    def_block_size=4096,
 ):
-    if def_verbose:
-        print(def_message)
+    """Calculate the hex digest of a file."""
+    return sha_digest(
+        def_filename,
+        def_hash_algorithm,
+        def_block_size,
+    ).hex()
 
 
-def search_file(filename, search_path="."):
+def search_file(filename, search_path=".", def_call_counter=None):
     """
     Search for a file in a folder and its sub folders recursively.
+    :param def_call_counter:    CallCounter, counts the directory listings (see ctf_phases)
     """
     # Iterate through all files and sub folders in the search path
     for root, dirnames, filenames in os.walk(search_path):
+        if def_call_counter is not None:
+            def_call_counter.listings += 1
         # Check if the file is in the current directory
         if filename in filenames:
             return os.path.join(root, filename)
     # File not found
     return None
 
+# Bits of the per-check outcome masks
+CHECK_SIZE = 1
+CHECK_MTIME = 2
+CHECK_HASH = 4
+CHECK_BIT = 8
+
+ALL_CHECKS = CHECK_SIZE | CHECK_MTIME | CHECK_HASH | CHECK_BIT
+
+# Check bit, option letter and details name of every check, in report order
+CHECKS = (
+    (CHECK_SIZE, "S", "file_size"),
+    (CHECK_MTIME, "T", "file_mtime"),
+    (CHECK_HASH, "H", "file_hash"),
+    (CHECK_BIT, "B", "file_bit"),
+)
+
+
+def options_to_mask(def_options):
+    """
+    Converts an options string (e.g. "STHB") into a check mask.
+    :param def_options:     str, options of the comparison
+    :return:                int, mask of the requested checks
+    """
+    mask = 0
+    for check, option, _ in CHECKS:
+        if option in def_options:
+            mask |= check
+    return mask
+
+
+def format_mtime_ns(def_mtime_ns):
+    return datetime.datetime.fromtimestamp(def_mtime_ns / 1e9).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+
+
+class ComparisonResult:
+    """
+    Compact comparison result of a source and a target file. The outcome of every check is kept as a bit in
+    "checked" and "passed", the data as raw integers and digest bytes. The details dicts are only built when
+    iterating the result, e.g. for printing.
+    """
+
+    __slots__ = (
+        "checked",
+        "passed",
+        "source_size",
+        "target_size",
+        "source_mtime_ns",
+        "target_mtime_ns",
+        "source_digest",
+        "target_digest",
+    )
+
+    def __init__(
+        self,
+        def_checked=0,
+        def_passed=0,
+        def_source_size=0,
+        def_target_size=0,
+        def_source_mtime_ns=0,
+        def_target_mtime_ns=0,
+        def_source_digest=None,
+        def_target_digest=None,
+    ):
+        self.checked = def_checked
+        self.passed = def_passed
+        self.source_size = def_source_size
+        self.target_size = def_target_size
+        self.source_mtime_ns = def_source_mtime_ns
+        self.target_mtime_ns = def_target_mtime_ns
+        self.source_digest = def_source_digest
+        self.target_digest = def_target_digest
+
+    @property
+    def failed(self):
+        return self.checked & ~self.passed
+
+    def detail(self, def_check):
+        """
+        Formats the details dict of one check.
+        :param def_check:   int, check bit, e.g. CHECK_SIZE
+        :return:            dict, details of the check as printed in the report
+        """
+        if def_check == CHECK_SIZE:
+            details = "file_size"
+            file_source_data = str(self.source_size)
+            file_target_data = str(self.target_size)
+        elif def_check == CHECK_MTIME:
+            details = "file_mtime"
+            file_source_data = format_mtime_ns(self.source_mtime_ns)
+            file_target_data = format_mtime_ns(self.target_mtime_ns)
+        elif def_check == CHECK_HASH:
+            details = "file_hash"
+            file_source_data = self.source_digest.hex()
+            file_target_data = self.target_digest.hex()
+        else:
+            details = "file_bit"
+            file_source_data = ""
+            file_target_data = ""
+        return {
+            "details": details,
+            "result": bool(self.passed & def_check),
+            "file_source_data": file_source_data,
+            "file_target_data": file_target_data,
+        }
+
+    def restricted(self, def_mask):
+        """
+        :param def_mask:    int, mask of the checks to keep
+        :return:            ComparisonResult, result limited to the checks of the mask (data is shared)
+        """
+        if self.checked & ~def_mask == 0:
+            return self
+        return ComparisonResult(
+            self.checked & def_mask,
+            self.passed & def_mask,
+            self.source_size,
+            self.target_size,
+            self.source_mtime_ns,
+            self.target_mtime_ns,
+            self.source_digest,
+            self.target_digest,
+        )
+
+    def __iter__(self):
+        for check, _, _ in CHECKS:
+            if self.checked & check:
+                yield self.detail(check)
+
+    def __len__(self):
+        return bin(self.checked).count("1")
+
+
 def compare_files(
     def_file_source,
     def_file_target,
     def_hash_algorithm,
     def_options,
+    def_block_size=4096,
+    def_call_counter=None,
 ):
     # Get file status
     file_source_stat = os.stat(def_file_source)
     file_target_stat = os.stat(def_file_target)
+    if def_call_counter is not None:
+        def_call_counter.stats += 2
+
+    result = ComparisonResult(
+        def_source_size=file_source_stat.st_size,
+        def_target_size=file_target_stat.st_size,
+        def_source_mtime_ns=file_source_stat.st_mtime_ns,
+        def_target_mtime_ns=file_target_stat.st_mtime_ns,
+    )
 
     # Check file size
-    file_size = None
     if "S" in def_options:
-        file_source_size = file_source_stat.st_size
-        file_target_size = file_target_stat.st_size
-        file_size = {
-            "details": "file_size",
-            "result": file_source_stat.st_size == file_target_stat.st_size,
-            "file_source_data": str(file_source_size),
-            "file_target_data": str(file_target_size),
-        }
+        result.checked |= CHECK_SIZE
+        if file_source_stat.st_size == file_target_stat.st_size:
+            result.passed |= CHECK_SIZE
 
     # Check modification time
-    file_mtime = None
     if "T" in def_options:
-        file_mtime = {
-            "details": "file_mtime",
-            "result": file_source_stat.st_mtime == file_target_stat.st_mtime,
-            "file_source_data": str(
-                datetime.datetime.fromtimestamp(file_source_stat.st_mtime).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                )
-            ),
-            "file_target_data": str(
-                datetime.datetime.fromtimestamp(file_target_stat.st_mtime).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                )
-            ),
-        }
+        result.checked |= CHECK_MTIME
+        if file_source_stat.st_mtime_ns == file_target_stat.st_mtime_ns:
+            result.passed |= CHECK_MTIME
 
     # Check file hash
-    file_hash = None
     if "H" in def_options:
-        file_source_hash = sha_hash(
+        result.checked |= CHECK_HASH
+        result.source_digest = sha_digest(
             def_file_source,
             def_hash_algorithm=def_hash_algorithm,
+            def_block_size=def_block_size,
         )
-        file_target_hash = sha_hash(
+        result.target_digest = sha_digest(
             def_file_target,
             def_hash_algorithm=def_hash_algorithm,
+            def_block_size=def_block_size,
         )
-        file_hash = {
-            "details": "file_hash",
-            "result": file_source_hash == file_target_hash,
-            "file_source_data": str(file_source_hash),
-            "file_target_data": str(file_target_hash),
-        }
+        if result.source_digest == result.target_digest:
+            result.passed |= CHECK_HASH
 
     # Check bitwise comparison
-    file_bit = None
     if "B" in def_options:
-        file_bit = {
-            "details": "file_bit",
-            "result": True,
-            "file_source_data": "",
-            "file_target_data": "",
-        }
+        result.checked |= CHECK_BIT
+        file_bit = True
         with open(def_file_source, "rb") as f1, open(def_file_target, "rb") as f2:
             for b1, b2 in zip(
-                iter(lambda: f1.read(4096), b""),
-                iter(lambda: f2.read(4096), b""),
+                iter(lambda: f1.read(def_block_size), b""),
+                iter(lambda: f2.read(def_block_size), b""),
             ):
                 if b1 != b2:
-                    file_bit["result"] = False
+                    file_bit = False
                     break
+        if file_bit:
+            result.passed |= CHECK_BIT
+
+    return result
+
+
+def map_in_parallel(
+    def_function,
+    def_items,
+    def_workers=1,
+):
+    """
+    Applies a function to every item, in a thread pool if more than one worker is requested. The results are
+    returned in the order of the items and only a bounded number of items is in flight at any time.
+    :param def_function:    function, applied to every item
+    :param def_items:       iterable, items
+    :param def_workers:     int, number of worker threads
+    :return:                generator of the function results
+    """
+    if def_workers <= 1:
+        yield from map(def_function, def_items)
+        return
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=def_workers) as executor:
+        futures = collections.deque()
+        try:
+            for item in def_items:
+                futures.append(executor.submit(def_function, item))
+                if len(futures) >= 4 * def_workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            # Stopped early (or failed): do not start the items which are still queued
+            for future in futures:
+                future.cancel()
 
-    results = []
-    if file_size is not None:
-        results.append(file_size)
-    if file_mtime is not None:
-        results.append(file_mtime)
-    if file_hash is not None:
-        results.append(file_hash)
-    if file_bit is not None:
-        results.append(file_bit)
-    return results
 
 def create_file_dict(
     def_folder,
     def_exclude_files=None,
     def_exclude_extensions=None,
+    def_file_sizes=None,
+    def_call_counter=None,
+    def_file_stats=None,
 ):
+    """
+    Collects the files of a folder.
+    :param def_folder:                  str, folder to scan
+    :param def_exclude_files:           list, file names to skip
+    :param def_exclude_extensions:      list, file extensions to skip (lower case, e.g. ".log")
+    :param def_file_sizes:              dict, if given, filled with the size of every file (by relative path)
+    :param def_call_counter:            CallCounter, counts the stat calls and directory listings (see
+                                        ctf_phases)
+    :param def_file_stats:              dict, if given, filled with the stat result of every file (by relative path)
+    :return:                            dict (relative path -> path), int (total size of the files)
+    """
     files_dict = {}
     file_size = 0
     for root, dirs, files in os.walk(
         def_folder,
         topdown=False,
     ):
+        if def_call_counter is not None:
+            def_call_counter.listings += 1
         for file in files:
             # Skip excluded files
             if def_exclude_files and file in def_exclude_files:
@@ -209,26 +416,83 @@ def create_file_dict(
             file_path = os.path.join(root, file)
             number_of_characters_def_folder = len(def_folder) + 1
             files_dict[file_path[number_of_characters_def_folder:]] = file_path
-            file_size += os.stat(file_path).st_size
+            file_stat = os.stat(file_path)
+            if def_call_counter is not None:
+                def_call_counter.stats += 1
+            file_size += file_stat.st_size
+            if def_file_sizes is not None:
+                def_file_sizes[file_path[number_of_characters_def_folder:]] = file_stat.st_size
+            if def_file_stats is not None:
+                def_file_stats[file_path[number_of_characters_def_folder:]] = file_stat
     return files_dict, file_size
 
 
-def identify_files_identical(def_results):
-    return all((item["result"] for item in def_results))
+class FileCategory(enum.IntEnum):
+    """
+    Classification of a compared file
+    """
 
+    PASS = 0
+    ONLY_MTIME_DIFFERENCE = 1
+    ANY_DIFFERENCE_BUT_MTIME = 2
 
-def identify_files_only_mtime_difference(def_results):
-    return not any(
-        (item["details"] != "file_mtime" and not item["result"])
-        or (item["details"] == "file_mtime" and item["result"])
-        for item in def_results
-    )
 
+# Names of the categories as used in the structured output
+CATEGORY_NAMES = {
+    FileCategory.PASS: "pass",
+    FileCategory.ONLY_MTIME_DIFFERENCE: "only_mtime_difference",
+    FileCategory.ANY_DIFFERENCE_BUT_MTIME: "any_difference_but_mtime",
+}
+
+
+def classify_outcome(
+    def_checked,
+    def_passed,
+):
+    """
+    Classifies a file from its outcome masks in a single pass.
+    :param def_checked:     int, mask of the checks which were run
+    :param def_passed:      int, mask of the checks which passed
+    :return:                FileCategory, category of the file
+    """
+    failed = def_checked & ~def_passed
+    if failed & (ALL_CHECKS & ~CHECK_MTIME):
+        return FileCategory.ANY_DIFFERENCE_BUT_MTIME
+    if failed:
+        return FileCategory.ONLY_MTIME_DIFFERENCE
+    return FileCategory.PASS
 
-def identify_files_any_difference_but_mtime(def_results):
-    return any(
-        item["details"] != "file_mtime" and not item["result"] for item in def_results
+
+def classify_outcomes(
+    def_checked,
+    def_passed,
+):
+    """
+    Classifies many files at once, e.g. for reclassifying stored results. Uses NumPy if it is installed.
+    :param def_checked:     sequence or array of int, masks of the checks which were run
+    :param def_passed:      sequence or array of int, masks of the checks which passed
+    :return:                array (NumPy) or list of int, FileCategory value per file
+    """
+    try:
+        import numpy
+    except ImportError:
+        return [
+            classify_outcome(checked, passed)
+            for checked, passed in zip(def_checked, def_passed)
+        ]
+    failed = numpy.asarray(def_checked, dtype=numpy.uint8) & ~numpy.asarray(
+        def_passed, dtype=numpy.uint8
+    )
+    categories = numpy.full(
+        failed.shape,
+        FileCategory.PASS,
+        dtype=numpy.uint8,
     )
+    categories[(failed & CHECK_MTIME) != 0] = FileCategory.ONLY_MTIME_DIFFERENCE
+    categories[
+        (failed & (ALL_CHECKS & ~CHECK_MTIME)) != 0
+    ] = FileCategory.ANY_DIFFERENCE_BUT_MTIME
+    return categories
 
 
 def print_initial_information(
@@ -241,156 +505,303 @@ def print_initial_information(
     def_files_source_size,
     def_files_target_size,
 ):
-    print()
-    print(">>>>>>>>> Comparing two folders <<<<<<<<<")
-    print()
-    print()
+    print_report()
+    print_report(">>>>>>>>> Comparing two folders <<<<<<<<<")
+    print_report()
+    print_report()
 
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"OPTIONS:  '{def_options}' is requested"
     )
     if "S" in def_options:
-        print("                     -> S: Comparing the files for their size")
+        print_report("                     -> S: Comparing the files for their size")
     if "T" in def_options:
-        print(
+        print_report(
             "                     -> T: Comparing the files for their modification time"
         )
     if "H" in def_options:
-        print(
+        print_report(
             f"                     -> H: Comparing the files for their hashes (algorithm: '{def_hash_algorithm}')"
         )
     if "B" in def_options:
-        print("                     -> B: Comparing the files bitwise")
+        print_report("                     -> B: Comparing the files bitwise")
 
-    print()
+    print_report()
 
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"SOURCE:   '{def_folder_source}' (number of files in source: '{def_number_of_files_in_source}')"
     )
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"TARGET:   '{def_folder_target}' (number of files in target: '{def_number_of_files_in_target}')"
     )
-    print()
+    print_report()
 
     if def_number_of_files_in_source != def_number_of_files_in_target:
         delta = abs(def_number_of_files_in_source - def_number_of_files_in_target)
         files_count = "file" if delta == 1 else "files"
-        print(
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+        print_report(
+            f"{timestamp()}: "
             f"WARNING:   Number of files in source and target are different\n"
-            f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+            f"{timestamp()}: "
             f"DELTA:     -> '{delta}' {files_count}"
         )
-        print()
+        print_report()
 
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"SOURCE:   Total size of files: '{def_files_source_size}' bytes"
     )
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"TARGET:   Total size of files: '{def_files_target_size}' bytes"
     )
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"DELTA:    "
         f"'{abs(def_files_target_size - def_files_source_size)}' bytes"
     )
-    print()
+    print_report()
+
+
+def iter_comparison_data(
+    def_files_to_be_compared,
+    def_files_source,
+    def_files_target,
+    def_hash_algorithm,
+    def_options,
+    def_file_sizes=None,
+    def_progress=None,
+    def_workers=1,
+    def_block_size=4096,
+    def_compare_files=None,
+    def_call_counter=None,
+):
+    """
+    Compares the files present in both folders and yields the result of every file as soon as it is available.
+    Nothing is printed or retained.
+    :param def_files_to_be_compared:    iterable, relative paths of the files to compare
+    :param def_files_source:            dict, relative path -> path in source
+    :param def_files_target:            dict, relative path -> path in target
+    :param def_file_sizes:              dict, relative path -> size (required if def_progress is given)
+    :param def_progress:                ComparisonProgress, notified when a file starts and finishes
+    :param def_compare_files:           function, replacement of compare_files with the same arguments
+                                        (e.g. AgentTarget.compare_files for a target served by an agent)
+    :param def_call_counter:            CallCounter, counts the stat calls of compare_files (see ctf_phases)
+    :return:                            generator of (relative path, ComparisonResult, FileCategory)
+    """
+    if def_compare_files is None:
+        def_compare_files = functools.partial(
+            compare_files,
+            def_call_counter=def_call_counter,
+        )
+
+    def compare_file(def_file):
+        if def_progress is not None:
+            def_progress.start_file(
+                def_file,
+                def_file_sizes[def_file],
+            )
+        results = def_compare_files(
+            def_files_source[def_file],
+            def_files_target[def_file],
+            def_hash_algorithm,
+            def_options,
+            def_block_size,
+        )
+        if def_progress is not None:
+            def_progress.finish_file(
+                def_file,
+                def_file_sizes[def_file],
+                results.checked,
+            )
+        return def_file, results
+
+    for file, results in map_in_parallel(
+        compare_file,
+        def_files_to_be_compared,
+        def_workers,
+    ):
+        yield file, results, classify_outcome(
+            results.checked,
+            results.passed,
+        )
+
+
+def write_file_records(
+    def_structured_writer,
+    def_record_options,
+    def_file,
+    def_file_source=None,
+    def_file_target=None,
+    def_results=None,
+    def_classification=None,
+):
+    """
+    Writes the record of one file for every requested option string, tagged with the option string and with the
+    result restricted to its checks (the comparison runs with the union of the option strings).
+    :param def_record_options:      list, option strings of the records
+    :param def_results:             ComparisonResult, result of the comparison (None: missing file)
+    :param def_classification:      str, classification of a missing file
+    """
+    for options in def_record_options:
+        results = def_results
+        classification = def_classification
+        if results is not None:
+            results = results.restricted(options_to_mask(options))
+            classification = CATEGORY_NAMES[
+                classify_outcome(
+                    results.checked,
+                    results.passed,
+                )
+            ]
+        def_structured_writer.write_file_record(
+            options,
+            classification,
+            def_file,
+            def_file_source,
+            def_file_target,
+            results,
+        )
 
 
 def collect_comparison_data(
-    def_number_of_files_in_source,
-    def_number_of_files_in_target,
     def_files_source,
     def_files_target,
     def_hash_algorithm,
     def_options,
-    def_count_tick,
     def_verbose,
-    def_minimum_number_of_files,
+    def_file_sizes,
+    def_structured_writer=None,
+    def_progress_interval=10.0,
+    def_workers=1,
+    def_block_size=4096,
+    def_compare_files=None,
+    def_metrics=None,
+    def_latencies=None,
+    def_call_counter=None,
+    def_record_options=None,
 ):
+    """
+    :param def_record_options:  list, option strings of the structured records (default: def_options)
+    """
+    logger = ReportLogger(def_verbose)
+    record_options = def_record_options or [def_options]
     files_identical = {}
+    count_files_identical = 0
     files_only_mtime_difference = {}
     files_any_difference_but_mtime = {}
-    digits_number_of_files = f"0{len(str(min(def_number_of_files_in_source, def_number_of_files_in_target)))}d"
-    time_old = datetime.datetime.now()
-    file_count_old = 0
     files_to_be_compared = set(def_files_source.keys()).intersection(
         set(def_files_target.keys())
     )
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"-> Number of files to be compared: '{len(files_to_be_compared)}'"
     )
-    print("")
+    print_report("")
+
+    progress = ComparisonProgress(
+        logger,
+        len(files_to_be_compared),
+        sum(def_file_sizes[file] for file in files_to_be_compared),
+        def_progress_interval,
+        def_latencies=def_latencies,
+    )
+    progress.start()
+    if def_metrics is not None:
+        # Read by the metrics thread, the per-file loop is not touched
+        def_metrics.watch(progress)
 
-    for idx, file in enumerate(
+    for file, results, category in iter_comparison_data(
         files_to_be_compared,
-        1,
+        def_files_source,
+        def_files_target,
+        def_hash_algorithm,
+        def_options,
+        def_file_sizes,
+        progress,
+        def_workers,
+        def_block_size,
+        def_compare_files,
+        def_call_counter,
     ):
-        file_source = def_files_source[file]
-        file_target = def_files_target[file]
-        results = compare_files(
-            file_source,
-            file_target,
-            def_hash_algorithm,
-            def_options,
-        )
-        if idx % def_count_tick == 0:
-            time_new = datetime.datetime.now()
-            file_count_new = idx
-            if file_count_new - file_count_old > 0:
-                number_of_seconds = (time_new - time_old).total_seconds()
-                number_of_files_compared = file_count_new - file_count_old
-                comparisons_per_second = number_of_files_compared / number_of_seconds
-                print_verbose(
-                    f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
-                    f"Number of files compared so far: '{file_count_new:{digits_number_of_files}}'",
-                    def_verbose["general"],
-                )
-                print_verbose(
-                    f"                     -> '{int(round(comparisons_per_second, 0))}' "
-                    f"comparisons per second ",
-                    def_verbose["general"],
-                )
-                comparison_eta = datetime.timedelta(
-                    seconds=(def_minimum_number_of_files - idx) / comparisons_per_second
-                )
-                print_verbose(
-                    f"                     -> ETA: '{comparison_eta}'",
-                    def_verbose["general"],
-                )
-                print_verbose(
-                    f"                     -> Current file: '{file}'",
-                    def_verbose["general"],
-                )
-                print_verbose(
-                    "",
-                    def_verbose["general"],
-                )
-            time_old = time_new
-            file_count_old = file_count_new
+        if category == FileCategory.PASS:
+            # Identical files are only counted if passing files are not reported
+            count_files_identical += 1
+            if def_verbose["files-pass"]:
+                files_identical[file] = results
+        elif category == FileCategory.ONLY_MTIME_DIFFERENCE:
+            files_only_mtime_difference[file] = results
+        else:
+            files_any_difference_but_mtime[file] = results
 
-        # Collect comparison data for files which are identical
-        if identify_files_identical(results):
-            files_identical[file] = results
+        if def_structured_writer is not None:
+            write_file_records(
+                def_structured_writer,
+                record_options,
+                file,
+                def_files_source[file],
+                def_files_target[file],
+                results,
+            )
 
-        # Collect comparison data for files which are identical but where the modification time maybe different
-        details_mtime_found = any(
-            "file_mtime" in test_for_mtime["details"] for test_for_mtime in results
-        )
-        if identify_files_only_mtime_difference(results) and details_mtime_found:
-            files_only_mtime_difference[file] = results
+    progress.stop()
+
+    return (
+        files_identical,
+        count_files_identical,
+        files_only_mtime_difference,
+        files_any_difference_but_mtime,
+    )
 
-        # Collect comparison data for files which are different without considering the modification time
-        if identify_files_any_difference_but_mtime(results):
-            files_any_difference_but_mtime[file] = results
 
-    return files_identical, files_only_mtime_difference, files_any_difference_but_mtime
+def derive_comparison_data(
+    def_files_identical,
+    def_count_files_identical,
+    def_files_only_mtime_difference,
+    def_files_any_difference_but_mtime,
+    def_options,
+    def_retain_passing=True,
+):
+    """
+    Derives the comparison data for a subset of the options from the comparison data of a comparison run with
+    all options. Files which pass all checks pass any subset, only the differing files are reclassified.
+    :param def_options:             str, options to derive the comparison data for
+    :param def_retain_passing:      bool, keep the files which become identical (otherwise they are only counted)
+    :return:                        same as collect_comparison_data
+    """
+    option_mask = options_to_mask(def_options)
+    # Only the checks of the derived options are reported, also for the files identical under all options
+    files_identical = {
+        file: results.restricted(option_mask)
+        for file, results in def_files_identical.items()
+    }
+    count_files_identical = def_count_files_identical
+    files_only_mtime_difference = {}
+    files_any_difference_but_mtime = {}
+    for files in (def_files_only_mtime_difference, def_files_any_difference_but_mtime):
+        for file, results in files.items():
+            results = results.restricted(option_mask)
+            category = classify_outcome(
+                results.checked,
+                results.passed,
+            )
+            if category == FileCategory.PASS:
+                count_files_identical += 1
+                if def_retain_passing:
+                    files_identical[file] = results
+            elif category == FileCategory.ONLY_MTIME_DIFFERENCE:
+                files_only_mtime_difference[file] = results
+            else:
+                files_any_difference_but_mtime[file] = results
+    return (
+        files_identical,
+        count_files_identical,
+        files_only_mtime_difference,
+        files_any_difference_but_mtime,
+    )
 
 
 def evaluate_file_comparison_state(
@@ -401,25 +812,152 @@ def evaluate_file_comparison_state(
     def_exclude_extensions=None,
     def_options="STHB",
     def_verbose=None,
+    def_structured_writer=None,
+    def_progress_interval=10.0,
+    def_workers=1,
+    def_block_size=4096,
+    def_shard=None,
+    def_phase_timings=None,
+    def_metrics=None,
+    def_latencies=None,
+    def_record_options=None,
 ):
+    """
+    Scans both folders, compares the files present in both and collects the files by outcome.
+    :param def_shard:           tuple, (index, count, method) to compare only the files of one shard (see ctf_shard)
+    :param def_phase_timings:   PhaseTimings, records the phases "scan_source", "scan_target", "sets" and "compare"
+    :param def_metrics:         ComparisonMetrics, reads the progress of the comparison (see ctf_metrics)
+    :param def_latencies:       LatencyRecorder, records the latency of every compared file (see ctf_latency)
+    :param def_record_options:  list, option strings of the structured records, every file is written once per
+                                option string (default: def_options)
+    """
+    record_options = def_record_options or [def_options]
+    if def_phase_timings is None:
+        def_phase_timings = PhaseTimings()
     if def_verbose is None:
         def_verbose = {
             "general": True,
             "files-pass": True,
             "summary": True,
         }
+    if def_shard is not None:
+        from ctf_shard import (
+            create_shard_file_dict,
+            filter_shard,
+        )
+
+    # Either side can be a manifest file instead of a folder (see ctf_manifest)
+    manifest_source = None
+    manifest_target = None
+    if os.path.isfile(def_folder_source) or os.path.isfile(def_folder_target):
+        from ctf_manifest import (
+            evaluate_manifest_comparison_state,
+            make_compare_files,
+            open_manifest,
+            warn_about_manifest_checks,
+        )
+
+        if os.path.isfile(def_folder_source):
+            manifest_source = open_manifest(def_folder_source)
+        if os.path.isfile(def_folder_target):
+            manifest_target = open_manifest(def_folder_target)
+        if manifest_source is not None and manifest_target is not None:
+            # Two manifests are compared by a merge of their sorted entries
+            with def_phase_timings.phase("compare"):
+                return evaluate_manifest_comparison_state(
+                    manifest_source,
+                    manifest_target,
+                    def_exclude_files,
+                    def_exclude_extensions,
+                    def_options,
+                    def_verbose,
+                    def_structured_writer,
+                    def_shard,
+                    record_options,
+                )
+        if manifest_source is not None and def_folder_target.startswith("agent://"):
+            print_report(
+                f"ERROR: A manifest can not be compared with a target served by an agent"
+            )
+            exit()
 
     # Store the files in each folder
-    files_source, files_source_size = create_file_dict(
-        def_folder_source,
-        def_exclude_files,
-        def_exclude_extensions,
-    )
-    files_target, files_target_size = create_file_dict(
-        def_folder_target,
-        def_exclude_files,
-        def_exclude_extensions,
-    )
+    file_sizes_source = {}
+    file_sizes_target = {}
+    with def_phase_timings.phase("scan_source"):
+        if manifest_source is not None:
+            files_source, files_source_size = manifest_source.create_file_dict(
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes_source,
+            )
+        elif def_shard is not None:
+            files_source, files_source_size = create_shard_file_dict(
+                def_folder_source,
+                def_shard,
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes_source,
+                def_phase_timings.calls,
+            )
+        else:
+            files_source, files_source_size = create_file_dict(
+                def_folder_source,
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes_source,
+                def_phase_timings.calls,
+            )
+        # Manifests list everything, only the files of the shard are kept
+        if def_shard is not None and manifest_source is not None:
+            files_source, files_source_size = filter_shard(
+                files_source,
+                def_shard,
+                file_sizes_source,
+            )
+    compare_function = None
+    with def_phase_timings.phase("scan_target"):
+        if manifest_target is not None:
+            files_target, files_target_size = manifest_target.create_file_dict(
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes_target,
+            )
+        elif def_folder_target.startswith("agent://"):
+            # Target served by an agent: only the listing and the digests are transferred
+            from ctf_agent import AgentTarget
+
+            agent_target = AgentTarget(def_folder_target)
+            files_target, files_target_size = agent_target.create_file_dict(
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes_target,
+            )
+            compare_function = agent_target.compare_files
+        elif def_shard is not None:
+            files_target, files_target_size = create_shard_file_dict(
+                def_folder_target,
+                def_shard,
+                def_exclude_files,
+                def_exclude_extensions,
+                def_call_counter=def_phase_timings.calls,
+            )
+        else:
+            files_target, files_target_size = create_file_dict(
+                def_folder_target,
+                def_exclude_files,
+                def_exclude_extensions,
+                def_call_counter=def_phase_timings.calls,
+            )
+        # Manifests and agents list everything, only the files of the shard are kept
+        if def_shard is not None and (
+            manifest_target is not None or def_folder_target.startswith("agent://")
+        ):
+            files_target, files_target_size = filter_shard(
+                files_target,
+                def_shard,
+                file_sizes_target,
+            )
 
     number_of_files_in_source = len(files_source)
     number_of_files_in_target = len(files_target)
@@ -434,76 +972,105 @@ def evaluate_file_comparison_state(
         files_source_size,
         files_target_size,
     )
-
-    minimum_number_of_files = min(
-        number_of_files_in_source,
-        number_of_files_in_target,
-    )
-    maximum_number_of_files = max(
-        number_of_files_in_source,
-        number_of_files_in_target,
-    )
-
-    count_tick = round(
-        0.1 * maximum_number_of_files,
-        0,
-    )
+    if def_shard is not None:
+        print_report(
+            f"{timestamp()}: "
+            f"SHARD:     '{def_shard[0]}' of '{def_shard[1]}' (split by '{def_shard[2]}')"
+        )
+        print_report()
+    if manifest_source is not None or manifest_target is not None:
+        warn_about_manifest_checks(
+            def_options,
+            manifest_source,
+            manifest_target,
+        )
+        compare_function = make_compare_files(
+            manifest_source,
+            manifest_target,
+        )
 
     # Check for missing files in source and target
-    missing_files_source = set(files_source.keys()).difference(set(files_target.keys()))
-    missing_files_target = set(files_target.keys()).difference(set(files_source.keys()))
-    files_missing_target = {
-        missing_file_target: f"{def_folder_target}/{missing_file_target}"
-        for missing_file_target in missing_files_source
-    }
-    files_missing_source = {
-        missing_file_source: f"{def_folder_target}/{missing_file_source}"
-        for missing_file_source in missing_files_target
-    }
+    with def_phase_timings.phase("sets"):
+        missing_files_source = set(files_source.keys()).difference(set(files_target.keys()))
+        missing_files_target = set(files_target.keys()).difference(set(files_source.keys()))
+        files_missing_target = {
+            missing_file_target: f"{def_folder_target}/{missing_file_target}"
+            for missing_file_target in missing_files_source
+        }
+        files_missing_source = {
+            missing_file_source: f"{def_folder_target}/{missing_file_source}"
+            for missing_file_source in missing_files_target
+        }
+    if def_structured_writer is not None:
+        for missing_file in files_missing_source:
+            write_file_records(
+                def_structured_writer,
+                record_options,
+                missing_file,
+                def_file_target=files_target[missing_file],
+                def_classification="missing_in_source",
+            )
+        for missing_file in files_missing_target:
+            write_file_records(
+                def_structured_writer,
+                record_options,
+                missing_file,
+                def_file_source=files_source[missing_file],
+                def_classification="missing_in_target",
+            )
 
     # Compare files
     comparison_start_time = datetime.datetime.now()
-    print("")
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report("")
+    print_report(
+        f"{timestamp()}: "
         f"BEGIN:     Comparison of files"
     )
 
-    (
-        files_identical,
-        files_only_mtime_difference,
-        files_any_difference_but_mtime,
-    ) = collect_comparison_data(
-        number_of_files_in_source,
-        number_of_files_in_target,
-        files_source,
-        files_target,
-        def_hash_algorithm,
-        def_options,
-        count_tick,
-        def_verbose,
-        minimum_number_of_files,
-    )
+    with def_phase_timings.phase("compare"):
+        (
+            files_identical,
+            count_files_identical,
+            files_only_mtime_difference,
+            files_any_difference_but_mtime,
+        ) = collect_comparison_data(
+            files_source,
+            files_target,
+            def_hash_algorithm,
+            def_options,
+            def_verbose,
+            file_sizes_source,
+            def_structured_writer,
+            def_progress_interval,
+            def_workers,
+            def_block_size,
+            compare_function,
+            def_metrics,
+            def_latencies,
+            def_phase_timings.calls,
+            record_options,
+        )
 
     comparison_end_time = datetime.datetime.now()
     elapsed_compare_time = comparison_end_time - comparison_start_time
 
     elapsed_run_time_format: str = "%H:%M:%S"
     elapsed_run_time_string = strfdelta(elapsed_compare_time, elapsed_run_time_format)
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"TIME:      '{elapsed_run_time_string}'\n"
     )
-    print(
-        f"{str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}: "
+    print_report(
+        f"{timestamp()}: "
         f"END:       Comparison of files"
     )
-    print()
+    print_report()
 
     return (
         files_missing_source,
         files_missing_target,
         files_identical,
+        count_files_identical,
         files_only_mtime_difference,
         files_any_difference_but_mtime,
         files_source_size,
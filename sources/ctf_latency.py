@@ -0,0 +1,193 @@
+"""
+Per-file comparison latency. Every compared file is counted in a histogram with logarithmic (power of two)
+buckets, the slowest files are kept in a bounded heap and the latency is added up per directory, so that the few
+pathological files or directories of a slow run (a stalled network file, a huge image, a directory with very
+many entries) can be named in the summary and in the structured output.
+
+The latency of a file is the wall time from the start of its comparison to its end (as seen by the worker that
+compares it), recorded by ComparisonProgress under the lock it holds anyway.
+"""
+
+import heapq
+import math
+import os
+
+
+# Upper bounds of the buckets: 2^-17 s (about 7.6 us) to 2^12 s (about 68 minutes), slower files fall into "+Inf"
+LATENCY_MIN_EXPONENT = -17
+LATENCY_MAX_EXPONENT = 12
+
+# Number of slowest files and directories kept
+LATENCY_TOP = 10
+
+
+def bucket_bound(def_index):
+    """
+    :return:    str, upper bound of the bucket in seconds (as used as key of the histogram)
+    """
+    if def_index > LATENCY_MAX_EXPONENT - LATENCY_MIN_EXPONENT:
+        return "+Inf"
+    return f"{2.0 ** (LATENCY_MIN_EXPONENT + def_index):.3g}"
+
+
+def checks_of_mask(def_checked):
+    """
+    :param def_checked:     int, mask of the checks run (see ComparisonResult.checked)
+    :return:                str, option letters of the checks, e.g. "STHB"
+    """
+    from ctf_functions import CHECKS
+
+    return "".join(option for check, option, _ in CHECKS if def_checked & check)
+
+
+class LatencyRecorder:
+    """
+    Latency histogram, slowest files and latency per directory of one comparison pass. Not locked, the caller
+    serialises the calls of add().
+    """
+
+    def __init__(self, def_top=LATENCY_TOP):
+        """
+        :param def_top:     int, number of slowest files and directories reported
+        """
+        self.top = def_top
+        self.buckets = [0] * (LATENCY_MAX_EXPONENT - LATENCY_MIN_EXPONENT + 2)
+        self.files = 0
+        self.total_seconds = 0.0
+        # Min-heap of (seconds, file, size, checked), the fastest of the slowest files on top
+        self.slowest_files = []
+        # Directory -> [seconds, files, bytes]
+        self.directories = {}
+
+    def add(
+        self,
+        def_seconds,
+        def_file,
+        def_size,
+        def_checked=0,
+    ):
+        """
+        :param def_seconds:     float, latency of the file
+        :param def_file:        str, relative path of the file
+        :param def_size:        int, size of the file (source)
+        :param def_checked:     int, mask of the checks run
+        """
+        self.files += 1
+        self.total_seconds += def_seconds
+        if def_seconds > 0:
+            # def_seconds < 2^exponent
+            index = math.frexp(def_seconds)[1] - LATENCY_MIN_EXPONENT
+            self.buckets[min(max(index, 0), len(self.buckets) - 1)] += 1
+        else:
+            self.buckets[0] += 1
+
+        if len(self.slowest_files) < self.top:
+            heapq.heappush(self.slowest_files, (def_seconds, def_file, def_size, def_checked))
+        elif def_seconds > self.slowest_files[0][0]:
+            heapq.heapreplace(self.slowest_files, (def_seconds, def_file, def_size, def_checked))
+
+        directory = def_file.rpartition(os.sep)[0]
+        totals = self.directories.get(directory)
+        if totals is None:
+            self.directories[directory] = [def_seconds, 1, def_size]
+        else:
+            totals[0] += def_seconds
+            totals[1] += 1
+            totals[2] += def_size
+
+    def as_dict(self):
+        """
+        :return:    dict, "files", "total_s", "buckets" (upper bound in seconds -> number of files, empty buckets
+                    left out), "slowest_files" and "slowest_directories" (slowest first)
+        """
+        return {
+            "files": self.files,
+            "total_s": round(self.total_seconds, 6),
+            "buckets": {
+                bucket_bound(index): count
+                for index, count in enumerate(self.buckets)
+                if count
+            },
+            "slowest_files": [
+                {
+                    "file": file,
+                    "seconds": round(seconds, 6),
+                    "size": size,
+                    "checks": checks_of_mask(checked),
+                }
+                for seconds, file, size, checked in sorted(self.slowest_files, reverse=True)
+            ],
+            "slowest_directories": [
+                {
+                    "directory": directory,
+                    "seconds": round(seconds, 6),
+                    "files": files,
+                    "size": size,
+                }
+                for directory, (seconds, files, size) in heapq.nlargest(
+                    self.top,
+                    self.directories.items(),
+                    key=lambda item: item[1][0],
+                )
+            ],
+        }
+
+
+def merge_latency(
+    def_totals,
+    def_latency,
+    def_top=LATENCY_TOP,
+):
+    """
+    Adds the latency of one shard (as_dict) to the totals. The slowest directories are merged from the slowest
+    directories of every shard, a directory split across shards may be missing.
+    :param def_totals:  dict, totals in the format of as_dict (modified in place)
+    :param def_latency: dict, latency of one shard
+    """
+    def_totals["files"] = def_totals.get("files", 0) + def_latency["files"]
+    def_totals["total_s"] = round(def_totals.get("total_s", 0.0) + def_latency["total_s"], 6)
+    buckets = def_totals.setdefault("buckets", {})
+    for bound, count in def_latency["buckets"].items():
+        buckets[bound] = buckets.get(bound, 0) + count
+    def_totals["buckets"] = dict(sorted(buckets.items(), key=lambda item: float(item[0])))
+    def_totals["slowest_files"] = heapq.nlargest(
+        def_top,
+        def_totals.get("slowest_files", []) + def_latency["slowest_files"],
+        key=lambda item: item["seconds"],
+    )
+    directories = {}
+    for item in def_totals.get("slowest_directories", []) + def_latency["slowest_directories"]:
+        totals = directories.setdefault(
+            item["directory"],
+            {"directory": item["directory"], "seconds": 0.0, "files": 0, "size": 0},
+        )
+        totals["seconds"] = round(totals["seconds"] + item["seconds"], 6)
+        totals["files"] += item["files"]
+        totals["size"] += item["size"]
+    def_totals["slowest_directories"] = heapq.nlargest(
+        def_top,
+        directories.values(),
+        key=lambda item: item["seconds"],
+    )
+
+
+def latency_quantile(
+    def_buckets,
+    def_quantile,
+):
+    """
+    :param def_buckets:     dict, upper bound -> number of files (as in as_dict)
+    :param def_quantile:    float, e.g. 0.5 or 0.99
+    :return:                str, upper bound of the bucket holding the quantile (None: no files)
+    """
+    buckets = sorted(def_buckets.items(), key=lambda item: float(item[0]))
+    files = sum(count for _, count in buckets)
+    if not files:
+        return None
+    rank = def_quantile * files
+    seen = 0
+    for bound, count in buckets:
+        seen += count
+        if seen >= rank:
+            return bound
+    return buckets[-1][0]
@@ -0,0 +1,879 @@
+"""
+Manifests: the state of a folder (relative path, size, mtime_ns and digest of every file) written to a file, so
+a folder can be compared while it is offline (a disk in a safe, an old state).
+
+Either side of a comparison, or both, can be a manifest instead of a folder. Against a live folder the size and
+mtime come from the manifest and the live files are hashed with the algorithm of the manifest; two manifests
+are compared by a merge of their sorted entries without any filesystem access. The bitwise check needs the
+data of both files and is skipped if one side is a manifest.
+
+Text format (entries sorted by the UTF-8 bytes of the path, "\\", tab, newline and carriage return in paths
+escaped as "\\\\", "\\t", "\\n" and "\\r", a leading "#" as "\\#"):
+    # ctf-manifest 1
+    # algorithm: blake3
+    # folder: /path/of/the/folder
+    # files: 2
+    # size: 1234
+    a.txt<TAB>1000<TAB>1678900000000000000<TAB>4f2c...
+    sub/b.txt<TAB>234<TAB>1678900000000000000<TAB>-        (digest "-": not hashed)
+
+Binary format (little endian), opened with mmap and searched in place without loading the entries:
+    header          magic "CTFMANIF", version, digest size, record size, number of files, total size, offsets
+                    and lengths of the records and the path table, algorithm, length of the folder
+    folder          UTF-8
+    records         fixed width, sorted by the UTF-8 bytes of the path: path offset and length in the path
+                    table, digest flag, size, mtime_ns, raw digest
+    path table      UTF-8 paths, concatenated
+A binary manifest can be compressed as a whole (gzip or lzma) for archival copies, it is then decompressed
+into memory when opened.
+
+In both formats a path which is not valid UTF-8 is kept with its original bytes (surrogateescape).
+"""
+
+import datetime
+import mmap
+import os
+import struct
+
+from ctf_functions import (
+    CHECK_HASH,
+    CHECK_MTIME,
+    CHECK_SIZE,
+    ComparisonResult,
+    FileCategory,
+    classify_outcome,
+    create_file_dict,
+    map_in_parallel,
+    print_initial_information,
+    sha_digest,
+    strfdelta,
+    write_file_records,
+)
+from ctf_report import (
+    print_report,
+    timestamp,
+)
+
+
+MANIFEST_MAGIC = "# ctf-manifest"
+MANIFEST_VERSION = 1
+
+MANIFEST_FORMATS = ("text", "binary")
+
+BINARY_MANIFEST_MAGIC = b"CTFMANIF"
+BINARY_MANIFEST_VERSION = 1
+
+# magic, version, digest size, record size, (reserved), number of files, total size, records offset, paths offset,
+# paths length, algorithm (ASCII, zero padded), folder length
+_BINARY_HEADER = struct.Struct("<8sHHHHQQQQQ16sQ")
+
+# path offset, path length, digest flag, size, mtime_ns (the raw digest follows)
+_BINARY_RECORD = struct.Struct("<QIIQq")
+
+# Leading bytes of compressed binary manifests
+_COMPRESSION_MAGICS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "lzma"),
+)
+
+_ESCAPES = (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"))
+
+
+def escape_path(def_path):
+    for character, escaped in _ESCAPES:
+        def_path = def_path.replace(character, escaped)
+    # An entry never starts with "#", so it can not be taken for a header line
+    if def_path.startswith("#"):
+        def_path = "\\" + def_path
+    return def_path
+
+
+def unescape_path(def_path):
+    if "\\" not in def_path:
+        return def_path
+    characters = []
+    escaped = False
+    for character in def_path:
+        if escaped:
+            characters.append({"t": "\t", "n": "\n", "r": "\r"}.get(character, character))
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        else:
+            characters.append(character)
+    return "".join(characters)
+
+
+def path_key(def_path):
+    """
+    Sort key of the entries of both formats: the UTF-8 bytes of the path (also for paths which are not valid
+    UTF-8), so text and binary manifests of the same folder are in the same order.
+    """
+    return def_path.encode("utf-8", "surrogateescape")
+
+
+def scan_entries(
+    def_folder,
+    def_hash_algorithm="blake3",
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_workers=1,
+    def_block_size=4096,
+):
+    """
+    Scans a folder and hashes its files.
+    :param def_hash_algorithm:  str, algorithm of the digests (None: the files are not hashed)
+    :return:                    list of (relative path, size, mtime_ns, digest bytes or None), sorted by
+                                path_key
+    """
+    files, _ = create_file_dict(
+        def_folder,
+        def_exclude_files,
+        def_exclude_extensions,
+    )
+
+    def scan_file(def_file):
+        file_stat = os.stat(files[def_file])
+        digest = None
+        if def_hash_algorithm is not None:
+            digest = sha_digest(
+                files[def_file],
+                def_hash_algorithm,
+                def_block_size,
+            )
+        return def_file, file_stat.st_size, file_stat.st_mtime_ns, digest
+
+    return list(
+        map_in_parallel(
+            scan_file,
+            sorted(files, key=path_key),
+            def_workers,
+        )
+    )
+
+
+def write_manifest(
+    def_output,
+    def_entries,
+    def_hash_algorithm,
+    def_folder,
+):
+    """
+    Writes the entries (sorted by path_key) as a text manifest.
+    """
+    with open(def_output, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+        f.write(f"{MANIFEST_MAGIC} {MANIFEST_VERSION}\n")
+        f.write(f"# algorithm: {def_hash_algorithm or '-'}\n")
+        f.write(f"# folder: {escape_path(os.path.abspath(def_folder))}\n")
+        f.write(f"# files: {len(def_entries)}\n")
+        f.write(f"# size: {sum(entry[1] for entry in def_entries)}\n")
+        f.writelines(
+            f"{escape_path(file)}\t{size}\t{mtime_ns}\t{digest.hex() if digest is not None else '-'}\n"
+            for file, size, mtime_ns, digest in def_entries
+        )
+
+
+def write_binary_manifest(
+    def_output,
+    def_entries,
+    def_hash_algorithm,
+    def_folder,
+    def_compression=None,
+):
+    """
+    Writes the entries as a binary manifest.
+    :param def_compression:     str, "gzip" or "lzma" for archival copies (None: uncompressed, memory-mapped)
+    """
+    entries = sorted(
+        (path_key(file), size, mtime_ns, digest)
+        for file, size, mtime_ns, digest in def_entries
+    )
+    digest_size = max((len(entry[3]) for entry in entries if entry[3] is not None), default=0)
+    record_size = _BINARY_RECORD.size + digest_size
+    folder = os.path.abspath(def_folder).encode("utf-8", "surrogateescape")
+    records_offset = _BINARY_HEADER.size + len(folder)
+    paths_offset = records_offset + len(entries) * record_size
+
+    data = bytearray(paths_offset)
+    paths = bytearray()
+    empty_digest = bytes(digest_size)
+    for index, (file, size, mtime_ns, digest) in enumerate(entries):
+        offset = records_offset + index * record_size
+        _BINARY_RECORD.pack_into(
+            data,
+            offset,
+            len(paths),
+            len(file),
+            digest is not None,
+            size,
+            mtime_ns,
+        )
+        data[offset + _BINARY_RECORD.size : offset + record_size] = (
+            digest if digest is not None else empty_digest
+        )
+        paths += file
+    _BINARY_HEADER.pack_into(
+        data,
+        0,
+        BINARY_MANIFEST_MAGIC,
+        BINARY_MANIFEST_VERSION,
+        digest_size,
+        record_size,
+        0,
+        len(entries),
+        sum(entry[1] for entry in entries),
+        records_offset,
+        paths_offset,
+        len(paths),
+        (def_hash_algorithm or "").encode("ascii"),
+        len(folder),
+    )
+    data[_BINARY_HEADER.size : records_offset] = folder
+    data += paths
+
+    if def_compression == "gzip":
+        import gzip
+
+        data = gzip.compress(data)
+    elif def_compression == "lzma":
+        import lzma
+
+        data = lzma.compress(data)
+    with open(def_output, "wb") as f:
+        f.write(data)
+
+
+def export_manifest(
+    def_folder,
+    def_output,
+    def_hash_algorithm="blake3",
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_workers=1,
+    def_block_size=4096,
+    def_format="text",
+    def_compression=None,
+):
+    """
+    Scans a folder and writes its manifest.
+    :param def_hash_algorithm:  str, algorithm of the digests (None: size and mtime only)
+    :param def_format:          str, "text" or "binary"
+    :param def_compression:     str, "gzip" or "lzma" (binary format only)
+    :return:                    int, number of files in the manifest
+    """
+    start_time = datetime.datetime.now()
+    print_report(
+        f"{timestamp()}: "
+        f"BEGIN:     Export of manifest '{def_output}' from '{def_folder}'"
+    )
+    entries = scan_entries(
+        def_folder,
+        def_hash_algorithm,
+        def_exclude_files,
+        def_exclude_extensions,
+        def_workers,
+        def_block_size,
+    )
+    if def_format == "binary":
+        write_binary_manifest(
+            def_output,
+            entries,
+            def_hash_algorithm,
+            def_folder,
+            def_compression,
+        )
+    else:
+        write_manifest(
+            def_output,
+            entries,
+            def_hash_algorithm,
+            def_folder,
+        )
+    print_report(
+        f"{timestamp()}: "
+        f"-> Number of files: '{len(entries)}' (algorithm: '{def_hash_algorithm or '-'}')"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"TIME:      '{strfdelta(datetime.datetime.now() - start_time, '%H:%M:%S')}'"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"END:       Export of manifest"
+    )
+    return len(entries)
+
+
+class Manifest:
+    """
+    Text manifest. Iterating yields the entries in path order while the file is read, the index for lookups
+    by path is only built by create_file_dict.
+    """
+
+    # Lookups use the index built by create_file_dict
+    indexed = True
+
+    def __init__(self, def_path):
+        self.path = def_path
+        self.header = {}
+        self.index = {}
+        with open(def_path, encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+            first_line = f.readline()
+            if not first_line.startswith(MANIFEST_MAGIC):
+                raise ValueError(f"'{def_path}' is not a manifest")
+            try:
+                version = int(first_line[len(MANIFEST_MAGIC) :])
+            except ValueError:
+                raise ValueError(f"'{def_path}' is not a manifest") from None
+            if version != MANIFEST_VERSION:
+                raise ValueError(f"manifest version '{version}' of '{def_path}' is not supported")
+            for line in f:
+                if not line.startswith("# "):
+                    break
+                key, _, value = line[2:].rstrip("\n").partition(": ")
+                self.header[key] = value
+        self.algorithm = None if self.header.get("algorithm", "-") == "-" else self.header["algorithm"]
+        self.folder = unescape_path(self.header.get("folder", ""))
+        self.number_of_files = int(self.header.get("files", 0))
+        self.size = int(self.header.get("size", 0))
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        """
+        :return:    generator of (relative path, size, mtime_ns, digest bytes or None), sorted by path_key
+        """
+        with open(self.path, encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+            # Header: magic line and the "# key: value" lines
+            for _ in range(len(self.header) + 1):
+                f.readline()
+            for line in f:
+                file, size, mtime_ns, digest = line.rstrip("\n").split("\t")
+                yield (
+                    unescape_path(file),
+                    int(size),
+                    int(mtime_ns),
+                    None if digest == "-" else bytes.fromhex(digest),
+                )
+
+    def iter_entries(
+        self,
+        def_exclude_files=None,
+        def_exclude_extensions=None,
+    ):
+        """
+        Same as iterating, without the entries excluded by file name or extension.
+        """
+        for entry in self:
+            file_name = entry[0].rpartition("/")[2]
+            if def_exclude_files and file_name in def_exclude_files:
+                continue
+            if (
+                def_exclude_extensions
+                and os.path.splitext(file_name)[1].lower() in def_exclude_extensions
+            ):
+                continue
+            yield entry
+
+    def create_file_dict(
+        self,
+        def_exclude_files=None,
+        def_exclude_extensions=None,
+        def_file_sizes=None,
+    ):
+        """
+        Same as create_file_dict for the folder of the manifest, the paths are "manifest path/relative path".
+        """
+        self.index = {}
+        files = {}
+        size = 0
+        for entry in self.iter_entries(
+            def_exclude_files,
+            def_exclude_extensions,
+        ):
+            if self.indexed:
+                self.index[entry[0]] = entry
+            files[entry[0]] = f"{self.path}/{entry[0]}"
+            size += entry[1]
+            if def_file_sizes is not None:
+                def_file_sizes[entry[0]] = entry[1]
+        return files, size
+
+    def lookup(self, def_file):
+        """
+        :param def_file:    str, path as returned by create_file_dict
+        :return:            tuple, entry of the file
+        """
+        return self.index[def_file[len(self.path) + 1 :]]
+
+
+class BinaryManifest(Manifest):
+    """
+    Binary manifest, memory-mapped (or decompressed into memory). Entries are unpacked when they are iterated
+    or looked up by a binary search of the sorted records, nothing is loaded when it is opened.
+    """
+
+    indexed = False
+
+    def __init__(self, def_path):
+        self.path = def_path
+        self.index = {}
+        self._mmap = None
+        with open(def_path, "rb") as f:
+            leading_bytes = f.read(8)
+            f.seek(0)
+            compression = None
+            for magic, name in _COMPRESSION_MAGICS:
+                if leading_bytes.startswith(magic):
+                    compression = name
+            if compression == "gzip":
+                import gzip
+
+                try:
+                    self.buffer = gzip.decompress(f.read())
+                except (OSError, EOFError):
+                    raise ValueError(f"'{def_path}' is not a manifest (damaged gzip data)") from None
+            elif compression == "lzma":
+                import lzma
+
+                try:
+                    self.buffer = lzma.decompress(f.read())
+                except (lzma.LZMAError, EOFError):
+                    raise ValueError(f"'{def_path}' is not a manifest (damaged lzma data)") from None
+            elif leading_bytes != BINARY_MANIFEST_MAGIC or os.fstat(f.fileno()).st_size < _BINARY_HEADER.size:
+                # Also keeps mmap away from empty files
+                raise ValueError(f"'{def_path}' is not a manifest")
+            else:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buffer = self._mmap
+        if len(self.buffer) < _BINARY_HEADER.size or self.buffer[:8] != BINARY_MANIFEST_MAGIC:
+            self.close()
+            raise ValueError(f"'{def_path}' is not a manifest")
+        (
+            _,
+            version,
+            self.digest_size,
+            self.record_size,
+            _,
+            self.number_of_files,
+            self.size,
+            self.records_offset,
+            self.paths_offset,
+            paths_length,
+            algorithm,
+            folder_length,
+        ) = _BINARY_HEADER.unpack_from(self.buffer, 0)
+        if version != BINARY_MANIFEST_VERSION:
+            self.close()
+            raise ValueError(f"manifest version '{version}' of '{def_path}' is not supported")
+        if (
+            self.record_size != _BINARY_RECORD.size + self.digest_size
+            or self.records_offset + self.number_of_files * self.record_size > self.paths_offset
+            or self.paths_offset + paths_length > len(self.buffer)
+        ):
+            self.close()
+            raise ValueError(f"manifest '{def_path}' is damaged (truncated or inconsistent header)")
+        self.algorithm = algorithm.rstrip(b"\0").decode("ascii") or None
+        self.folder = bytes(
+            self.buffer[_BINARY_HEADER.size : _BINARY_HEADER.size + folder_length]
+        ).decode("utf-8", "surrogateescape")
+        self.header = {
+            "algorithm": self.algorithm or "-",
+            "folder": self.folder,
+            "files": str(self.number_of_files),
+            "size": str(self.size),
+        }
+        self._record = struct.Struct(f"{_BINARY_RECORD.format}{self.digest_size}s")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _entry(self, def_record):
+        path_offset, path_length, has_digest, size, mtime_ns, digest = def_record
+        start = self.paths_offset + path_offset
+        return (
+            str(self.buffer[start : start + path_length], "utf-8", "surrogateescape"),
+            size,
+            mtime_ns,
+            digest if has_digest else None,
+        )
+
+    def _path(self, def_index):
+        path_offset, path_length = struct.unpack_from(
+            "<QI",
+            self.buffer,
+            self.records_offset + def_index * self.record_size,
+        )
+        start = self.paths_offset + path_offset
+        return self.buffer[start : start + path_length]
+
+    def __iter__(self):
+        """
+        :return:    generator of (relative path, size, mtime_ns, digest bytes or None), sorted by path_key
+        """
+        records = memoryview(self.buffer)[
+            self.records_offset : self.records_offset + self.number_of_files * self.record_size
+        ]
+        try:
+            for record in self._record.iter_unpack(records):
+                yield self._entry(record)
+        finally:
+            records.release()
+
+    def find(self, def_file_relative):
+        """
+        Binary search of the sorted records.
+        :param def_file_relative:   str, relative path
+        :return:                    tuple, entry of the file (None if not in the manifest)
+        """
+        key = path_key(def_file_relative)
+        low = 0
+        high = self.number_of_files
+        while low < high:
+            middle = (low + high) // 2
+            if self._path(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.number_of_files and self._path(low) == key:
+            return self._entry(
+                self._record.unpack_from(
+                    self.buffer,
+                    self.records_offset + low * self.record_size,
+                )
+            )
+        return None
+
+    def lookup(self, def_file):
+        """
+        :param def_file:    str, path as returned by create_file_dict
+        :return:            tuple, entry of the file
+        """
+        entry = self.find(def_file[len(self.path) + 1 :])
+        if entry is None:
+            raise KeyError(def_file)
+        return entry
+
+
+def open_manifest(def_path):
+    """
+    :param def_path:    str, text or binary (optionally compressed) manifest
+    :return:            Manifest or BinaryManifest
+    Raises ValueError if the file is not a manifest of a supported version (or is damaged).
+    """
+    with open(def_path, "rb") as f:
+        leading_bytes = f.read(len(MANIFEST_MAGIC))
+    if leading_bytes == MANIFEST_MAGIC.encode("ascii"):
+        return Manifest(def_path)
+    if leading_bytes.startswith(BINARY_MANIFEST_MAGIC) or any(
+        leading_bytes.startswith(magic) for magic, _ in _COMPRESSION_MAGICS
+    ):
+        return BinaryManifest(def_path)
+    raise ValueError(f"'{def_path}' is not a manifest")
+
+
+def check_manifest(def_path):
+    """
+    Opens and closes a manifest, raises ValueError as open_manifest does.
+    """
+    open_manifest(def_path).close()
+
+
+def warn_about_manifest_checks(
+    def_options,
+    def_manifest_source=None,
+    def_manifest_target=None,
+):
+    """
+    Reports the requested checks which can not be done because one side is a manifest.
+    """
+    if "B" in def_options:
+        print_report(
+            f"{timestamp()}: "
+            f"WARNING:   B: Bitwise comparison is not possible against a manifest, it is skipped"
+        )
+    if "H" not in def_options:
+        return
+    algorithms = {
+        manifest.algorithm
+        for manifest in (def_manifest_source, def_manifest_target)
+        if manifest is not None
+    }
+    if None in algorithms or len(algorithms) > 1:
+        print_report(
+            f"{timestamp()}: "
+            f"WARNING:   H: Manifests without digests or with different algorithms, the hash check is skipped"
+        )
+    else:
+        print_report(
+            f"{timestamp()}: "
+            f"OPTIONS:   H: Hashes are compared with the algorithm of the manifest: '{algorithms.pop()}'"
+        )
+    print_report()
+
+
+def compare_entries(
+    def_entry_source,
+    def_entry_target,
+    def_options,
+):
+    """
+    Compares two entries by size, mtime and digest (if both have one).
+    :param def_entry_source:    tuple, (relative path, size, mtime_ns, digest or None)
+    :param def_entry_target:    tuple, (relative path, size, mtime_ns, digest or None)
+    :return:                    ComparisonResult
+    """
+    _, source_size, source_mtime_ns, source_digest = def_entry_source
+    _, target_size, target_mtime_ns, target_digest = def_entry_target
+    result = ComparisonResult(
+        def_source_size=source_size,
+        def_target_size=target_size,
+        def_source_mtime_ns=source_mtime_ns,
+        def_target_mtime_ns=target_mtime_ns,
+    )
+    if "S" in def_options:
+        result.checked |= CHECK_SIZE
+        if source_size == target_size:
+            result.passed |= CHECK_SIZE
+    if "T" in def_options:
+        result.checked |= CHECK_MTIME
+        if source_mtime_ns == target_mtime_ns:
+            result.passed |= CHECK_MTIME
+    if "H" in def_options and source_digest is not None and target_digest is not None:
+        result.checked |= CHECK_HASH
+        result.source_digest = source_digest
+        result.target_digest = target_digest
+        if source_digest == target_digest:
+            result.passed |= CHECK_HASH
+    return result
+
+
+def make_compare_files(
+    def_manifest_source=None,
+    def_manifest_target=None,
+):
+    """
+    Creates a replacement of compare_files for a comparison where one side or both are manifests. The files
+    of the live side are hashed with the algorithm of the manifest, only if the manifest has a digest.
+    :param def_manifest_source:     Manifest, None if the source is a folder
+    :param def_manifest_target:     Manifest, None if the target is a folder
+    :return:                        function, same arguments as compare_files
+    """
+    manifest = def_manifest_source or def_manifest_target
+
+    def live_entry(def_file, def_entry_manifest, def_options, def_block_size):
+        file_stat = os.stat(def_file)
+        digest = None
+        if "H" in def_options and def_entry_manifest[3] is not None:
+            digest = sha_digest(
+                def_file,
+                manifest.algorithm,
+                def_block_size,
+            )
+        return def_file, file_stat.st_size, file_stat.st_mtime_ns, digest
+
+    def compare_files_manifest(
+        def_file_source,
+        def_file_target,
+        def_hash_algorithm,
+        def_options,
+        def_block_size=4096,
+    ):
+        if def_manifest_source is not None and def_manifest_target is not None:
+            entry_source = def_manifest_source.lookup(def_file_source)
+            entry_target = def_manifest_target.lookup(def_file_target)
+        elif def_manifest_source is not None:
+            entry_source = def_manifest_source.lookup(def_file_source)
+            entry_target = live_entry(def_file_target, entry_source, def_options, def_block_size)
+        else:
+            entry_target = def_manifest_target.lookup(def_file_target)
+            entry_source = live_entry(def_file_source, entry_target, def_options, def_block_size)
+        return compare_entries(
+            entry_source,
+            entry_target,
+            def_options,
+        )
+
+    return compare_files_manifest
+
+
+def merge_manifests(
+    def_manifest_source,
+    def_manifest_target,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+):
+    """
+    Joins the sorted entries of two manifests.
+    :return:    generator of (relative path, source entry or None, target entry or None), sorted by path_key
+    """
+    # (sort key, entry), the paths are compared in the order of the entries and not as str
+    entries_source = (
+        (path_key(entry[0]), entry)
+        for entry in def_manifest_source.iter_entries(def_exclude_files, def_exclude_extensions)
+    )
+    entries_target = (
+        (path_key(entry[0]), entry)
+        for entry in def_manifest_target.iter_entries(def_exclude_files, def_exclude_extensions)
+    )
+    key_source, entry_source = next(entries_source, (None, None))
+    key_target, entry_target = next(entries_target, (None, None))
+    while entry_source is not None or entry_target is not None:
+        if entry_target is None or (entry_source is not None and key_source < key_target):
+            yield entry_source[0], entry_source, None
+            key_source, entry_source = next(entries_source, (None, None))
+        elif entry_source is None or key_target < key_source:
+            yield entry_target[0], None, entry_target
+            key_target, entry_target = next(entries_target, (None, None))
+        else:
+            yield entry_source[0], entry_source, entry_target
+            key_source, entry_source = next(entries_source, (None, None))
+            key_target, entry_target = next(entries_target, (None, None))
+
+
+def evaluate_manifest_comparison_state(
+    def_manifest_source,
+    def_manifest_target,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options="STH",
+    def_verbose=None,
+    def_structured_writer=None,
+    def_shard=None,
+    def_record_options=None,
+):
+    """
+    Same as evaluate_file_comparison_state for two manifests, by a merge of their sorted entries.
+    :return:    same as evaluate_file_comparison_state
+    """
+    record_options = def_record_options or [def_options]
+    if def_verbose is None:
+        def_verbose = {
+            "general": True,
+            "files-pass": True,
+            "summary": True,
+        }
+    print_initial_information(
+        def_options,
+        def_manifest_source.algorithm,
+        def_manifest_source.path,
+        def_manifest_target.path,
+        def_manifest_source.number_of_files,
+        def_manifest_target.number_of_files,
+        def_manifest_source.size,
+        def_manifest_target.size,
+    )
+    if def_shard is not None:
+        from ctf_shard import shard_of
+
+        print_report(
+            f"{timestamp()}: "
+            f"SHARD:     '{def_shard[0]}' of '{def_shard[1]}' (split by '{def_shard[2]}')"
+        )
+        print_report()
+    warn_about_manifest_checks(
+        def_options,
+        def_manifest_source,
+        def_manifest_target,
+    )
+    if def_manifest_source.algorithm != def_manifest_target.algorithm:
+        def_options = def_options.replace("H", "")
+
+    comparison_start_time = datetime.datetime.now()
+    print_report(
+        f"{timestamp()}: "
+        f"BEGIN:     Comparison of manifests"
+    )
+
+    files_missing_source = {}
+    files_missing_target = {}
+    files_identical = {}
+    count_files_identical = 0
+    files_only_mtime_difference = {}
+    files_any_difference_but_mtime = {}
+    files_source_size = 0
+    files_target_size = 0
+    for file, entry_source, entry_target in merge_manifests(
+        def_manifest_source,
+        def_manifest_target,
+        def_exclude_files,
+        def_exclude_extensions,
+    ):
+        if def_shard is not None and shard_of(file, def_shard[1], def_shard[2]) != def_shard[0]:
+            continue
+        if entry_source is None:
+            files_target_size += entry_target[1]
+            files_missing_source[file] = f"{def_manifest_target.path}/{file}"
+            if def_structured_writer is not None:
+                write_file_records(
+                    def_structured_writer,
+                    record_options,
+                    file,
+                    def_file_target=files_missing_source[file],
+                    def_classification="missing_in_source",
+                )
+            continue
+        files_source_size += entry_source[1]
+        if entry_target is None:
+            files_missing_target[file] = f"{def_manifest_target.path}/{file}"
+            if def_structured_writer is not None:
+                write_file_records(
+                    def_structured_writer,
+                    record_options,
+                    file,
+                    def_file_source=f"{def_manifest_source.path}/{file}",
+                    def_classification="missing_in_target",
+                )
+            continue
+        files_target_size += entry_target[1]
+
+        results = compare_entries(
+            entry_source,
+            entry_target,
+            def_options,
+        )
+        category = classify_outcome(
+            results.checked,
+            results.passed,
+        )
+        if category == FileCategory.PASS:
+            count_files_identical += 1
+            if def_verbose["files-pass"]:
+                files_identical[file] = results
+        elif category == FileCategory.ONLY_MTIME_DIFFERENCE:
+            files_only_mtime_difference[file] = results
+        else:
+            files_any_difference_but_mtime[file] = results
+        if def_structured_writer is not None:
+            write_file_records(
+                def_structured_writer,
+                record_options,
+                file,
+                f"{def_manifest_source.path}/{file}",
+                f"{def_manifest_target.path}/{file}",
+                results,
+            )
+
+    print_report(
+        f"{timestamp()}: "
+        f"TIME:      '{strfdelta(datetime.datetime.now() - comparison_start_time, '%H:%M:%S')}'\n"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"END:       Comparison of manifests"
+    )
+    print_report()
+
+    return (
+        files_missing_source,
+        files_missing_target,
+        files_identical,
+        count_files_identical,
+        files_only_mtime_difference,
+        files_any_difference_but_mtime,
+        files_source_size,
+        files_target_size,
+    )
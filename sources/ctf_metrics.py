@@ -0,0 +1,258 @@
+"""
+Prometheus metrics of a comparison run, written as a text file for the textfile collector of node_exporter.
+The file is rewritten periodically while the comparison runs (from a background thread which reads the counters
+of the progress, nothing is added to the per-file work) and at the end of the run. It is written next to its
+final name and moved into place, so the collector never reads a partial file.
+
+Metrics (labels "source", "target" and "profile", if given):
+- ctf_run_in_progress, ctf_run_success, ctf_run_start_timestamp_seconds, ctf_run_duration_seconds,
+  ctf_last_success_timestamp_seconds (kept from the previous file if the run fails)
+- ctf_files_to_compare, ctf_files_compared, ctf_bytes_to_compare, ctf_bytes_compared,
+  ctf_throughput_bytes_per_second
+- ctf_files{options, category}, ctf_files_size_bytes{side}
+- ctf_phase_duration_seconds{phase}, ctf_phase_cpu_seconds{phase}, ctf_phase_read_bytes{phase}
+- ctf_cache_hit_ratio{cache}: "page_cache" (share of the compared bytes not read from the storage) and
+  "missing_file_search" (searches of missing files answered from the results of another option string)
+
+Writing the metrics of a nightly comparison:
+./compare_two_folders.py compare --config nightly.ini --config-profile backup \\
+    --metrics-file /var/lib/node_exporter/textfile_collector/compare_two_folders_backup.prom
+"""
+
+import os
+import threading
+import time
+
+
+METRICS_PREFIX = "ctf_"
+
+# Help text and type of every metric
+METRICS = {
+    "run_in_progress": ("1 while the comparison runs", "gauge"),
+    "run_success": ("1 if the last run finished, 0 if it failed", "gauge"),
+    "run_start_timestamp_seconds": ("Start of the last run", "gauge"),
+    "run_duration_seconds": ("Duration of the last run (so far)", "gauge"),
+    "last_success_timestamp_seconds": ("End of the last finished run", "gauge"),
+    "files_to_compare": ("Files present in source and target", "gauge"),
+    "files_compared": ("Files compared so far", "gauge"),
+    "bytes_to_compare": ("Bytes of the files present in source and target (source size)", "gauge"),
+    "bytes_compared": ("Bytes of the files compared so far", "gauge"),
+    "throughput_bytes_per_second": ("Bytes compared per second since the previous update", "gauge"),
+    "files": ("Files by option string and category", "gauge"),
+    "files_size_bytes": ("Total size of the files by side", "gauge"),
+    "phase_duration_seconds": ("Wall time of the phase", "gauge"),
+    "phase_cpu_seconds": ("CPU time of the process during the phase", "gauge"),
+    "phase_read_bytes": ("Bytes read by the process during the phase", "gauge"),
+    "cache_hit_ratio": ("Share of the requests answered from a cache", "gauge"),
+}
+
+CATEGORY_KEYS = {
+    "pass": "files_pass",
+    "missing_in_source": "files_missing_in_source",
+    "missing_in_target": "files_missing_in_target",
+    "only_mtime_difference": "files_only_mtime_difference",
+    "any_difference_but_mtime": "files_any_difference_but_mtime",
+}
+
+
+def escape_label_value(def_value):
+    return str(def_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(def_labels):
+    """
+    :param def_labels:  dict, label name -> value
+    :return:            str, e.g. '{source="/data",target="/backup"}' (empty without labels)
+    """
+    if not def_labels:
+        return ""
+    labels = ",".join(f'{name}="{escape_label_value(value)}"' for name, value in def_labels.items())
+    return f"{{{labels}}}"
+
+
+def read_last_success(
+    def_output,
+    def_labels,
+):
+    """
+    :return:    float, last success timestamp of the previous metrics file (None: not found)
+    """
+    prefix = f"{METRICS_PREFIX}last_success_timestamp_seconds{format_labels(def_labels)} "
+    try:
+        with open(def_output, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(prefix):
+                    return float(line[len(prefix) :])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class ComparisonMetrics:
+    """
+    Metrics file of one comparison run. Created (and closed) by the caller of compare_folders, the comparison
+    hands over the progress (watch) and the results (set_results).
+    """
+
+    def __init__(
+        self,
+        def_output,
+        def_labels=None,
+        def_interval=15.0,
+    ):
+        """
+        :param def_output:      str, metrics file, e.g. ".../textfile_collector/compare_two_folders.prom"
+        :param def_labels:      dict, labels of all metrics, e.g. {"source": ..., "target": ...}
+        :param def_interval:    float, seconds between two updates while the comparison runs (0: only at the end)
+        """
+        self.output = def_output
+        self.labels = dict(def_labels or {})
+        self.interval = def_interval
+        self.time_started = time.time()
+        self.last_success = read_last_success(
+            def_output,
+            self.labels,
+        )
+        self.success = None
+        self.progress = None
+        self.return_data_per_options = None
+        self.phases = {}
+        self.cache_hit_ratios = {}
+        self.bytes_old = 0
+        self.time_old = time.monotonic()
+        self.bytes_per_second = 0.0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.write()
+        if self.interval > 0:
+            self.thread = threading.Thread(
+                target=self._write_periodically,
+                name="ComparisonMetrics",
+                daemon=True,
+            )
+            self.thread.start()
+
+    def _write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def watch(self, def_progress):
+        """
+        :param def_progress:    ComparisonProgress, its counters are read on every update
+        """
+        self.progress = def_progress
+
+    def set_results(
+        self,
+        def_return_data_per_options,
+        def_cache_hit_ratios=None,
+    ):
+        """
+        Marks the run as finished.
+        :param def_return_data_per_options:     dict, option string -> counts (as returned by compare_folders,
+                                                including "phases")
+        :param def_cache_hit_ratios:            dict, cache name -> hit ratio (0..1)
+        """
+        self.return_data_per_options = def_return_data_per_options
+        return_data = next(iter(def_return_data_per_options.values()), {})
+        self.phases = return_data.get("phases", {})
+        self.cache_hit_ratios = dict(def_cache_hit_ratios or {})
+        compare_phase = self.phases.get("compare", {})
+        if compare_phase.get("bytes_read"):
+            self.cache_hit_ratios["page_cache"] = max(
+                0.0,
+                1 - compare_phase.get("storage_bytes_read", 0) / compare_phase["bytes_read"],
+            )
+        self.success = True
+        self.last_success = time.time()
+
+    def close(self):
+        """
+        Stops the updates and writes the final metrics, a run without results counts as failed.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.success is None:
+            self.success = False
+        self.write()
+
+    def _samples(self):
+        """
+        :return:    list, (metric name, additional labels, value)
+        """
+        samples = [
+            ("run_in_progress", {}, 0 if self.success is not None else 1),
+            ("run_start_timestamp_seconds", {}, self.time_started),
+            ("run_duration_seconds", {}, time.time() - self.time_started),
+        ]
+        if self.success is not None:
+            samples.append(("run_success", {}, 1 if self.success else 0))
+        if self.last_success is not None:
+            samples.append(("last_success_timestamp_seconds", {}, self.last_success))
+
+        progress = self.progress
+        if progress is not None:
+            with progress.lock:
+                files_completed = progress.files_completed
+                bytes_completed = progress.bytes_completed
+            time_now = time.monotonic()
+            if time_now > self.time_old and bytes_completed != self.bytes_old:
+                self.bytes_per_second = (bytes_completed - self.bytes_old) / (time_now - self.time_old)
+                self.bytes_old = bytes_completed
+                self.time_old = time_now
+            samples += [
+                ("files_to_compare", {}, progress.files_total),
+                ("files_compared", {}, files_completed),
+                ("bytes_to_compare", {}, progress.bytes_total),
+                ("bytes_compared", {}, bytes_completed),
+                ("throughput_bytes_per_second", {}, self.bytes_per_second),
+            ]
+
+        if self.return_data_per_options is not None:
+            for options, return_data in self.return_data_per_options.items():
+                for category, key in CATEGORY_KEYS.items():
+                    samples.append(("files", {"options": options, "category": category}, return_data[key]))
+            return_data = next(iter(self.return_data_per_options.values()), None)
+            if return_data is not None:
+                samples.append(("files_size_bytes", {"side": "source"}, return_data["files_source_size"]))
+                samples.append(("files_size_bytes", {"side": "target"}, return_data["files_target_size"]))
+        for phase, values in self.phases.items():
+            samples.append(("phase_duration_seconds", {"phase": phase}, values["wall_s"]))
+            samples.append(("phase_cpu_seconds", {"phase": phase}, values["cpu_s"]))
+            if "bytes_read" in values:
+                samples.append(("phase_read_bytes", {"phase": phase}, values["bytes_read"]))
+        for cache, ratio in self.cache_hit_ratios.items():
+            samples.append(("cache_hit_ratio", {"cache": cache}, ratio))
+        return samples
+
+    def write(self):
+        """
+        Writes the current metrics (atomically, the file is replaced).
+        """
+        with self.lock:
+            # The samples of a metric have to follow each other
+            samples_per_metric = {}
+            for name, labels, value in self._samples():
+                samples_per_metric.setdefault(name, []).append((labels, value))
+            lines = []
+            for name, samples in samples_per_metric.items():
+                help_text, metric_type = METRICS[name]
+                lines.append(f"# HELP {METRICS_PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{METRICS_PREFIX}{name}{format_labels({**self.labels, **labels})} {value!r}")
+            # The textfile collector only reads "*.prom", the temporary file is ignored
+            output_temporary = f"{self.output}.{os.getpid()}.tmp"
+            try:
+                with open(output_temporary, "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                os.replace(output_temporary, self.output)
+            except OSError:
+                # Metrics must never fail the comparison, the next update tries again
+                if os.path.exists(output_temporary):
+                    os.unlink(output_temporary)
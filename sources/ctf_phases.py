@@ -0,0 +1,210 @@
+"""
+Per-phase instrumentation of a comparison run. For every phase (scanning, comparing, searching, reporting, ...)
+the wall time, CPU time, bytes read, read calls, file opens and stat calls are recorded, plus the I/O counters of
+the whole process from /proc/self/io (Linux) and resource.getrusage (Unix).
+
+File opens are counted by an audit hook ("open" events of open() and os.open()). The hook is registered once per
+process and only counts while at least one phase is running, so the opens of comparisons running at the same time
+in the same process (API, watch mode) are counted for each of them. Stat calls are counted where the comparison
+makes them, by create_file_dict and compare_files with the CallCounter of the PhaseTimings (the stats of manifests
+and agents are not counted).
+"""
+
+import contextlib
+import os
+import sys
+import threading
+import time
+
+
+PROC_SELF_IO = "/proc/self/io"
+
+# Counters of /proc/self/io -> name in the phase data
+PROC_IO_FIELDS = {
+    "rchar": "bytes_read",
+    "read_bytes": "storage_bytes_read",
+    "syscr": "read_calls",
+}
+
+
+class CallCounter:
+    """
+    Stat calls and directory listings of one comparison run, counted by create_file_dict, search_file and
+    compare_files (def_call_counter). The increments of parallel workers are not locked, the count is exact with
+    one worker and may miss a few calls with many.
+    """
+
+    __slots__ = (
+        "stats",
+        "listings",
+    )
+
+    def __init__(self):
+        self.stats = 0
+        self.listings = 0
+
+
+# File opens of the process while at least one phase is running, and the number of running phases
+_opens = 0
+_phases_running = 0
+_phases_lock = threading.Lock()
+_audit_hook_installed = False
+
+
+def _audit_hook(
+    def_event,
+    def_args,
+):
+    global _opens
+    # Called for every audit event of the process, kept to a string comparison and a module global
+    if def_event == "open" and _phases_running:
+        _opens += 1
+
+
+def _start_counting():
+    global _audit_hook_installed, _phases_running
+    with _phases_lock:
+        if not _audit_hook_installed:
+            # Audit hooks can not be removed again, the hook only counts while a phase is running
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+        _phases_running += 1
+
+
+def _stop_counting():
+    global _phases_running
+    with _phases_lock:
+        _phases_running -= 1
+
+
+# Bytes and read calls spent on reading /proc/self/io so far, not counted for the phases
+_proc_io_overhead = [0, 0]
+
+
+def read_proc_io():
+    """
+    :return:    dict, counters of /proc/self/io (empty if not available)
+    """
+    try:
+        fd = os.open(PROC_SELF_IO, os.O_RDONLY)
+    except OSError:
+        return {}
+    try:
+        # One read call, the file is much smaller than the buffer
+        data = os.read(fd, 4096)
+    finally:
+        os.close(fd)
+    counters = {}
+    for line in data.decode().splitlines():
+        name, _, value = line.partition(":")
+        counters[name.strip()] = int(value)
+    # The counters were taken before this read
+    if "rchar" in counters:
+        counters["rchar"] -= _proc_io_overhead[0]
+        counters["syscr"] -= _proc_io_overhead[1]
+    _proc_io_overhead[0] += len(data)
+    _proc_io_overhead[1] += 1
+    return counters
+
+
+def read_rusage():
+    """
+    :return:    dict, resource usage of the process (empty if not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        return {}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "user_s": usage.ru_utime,
+        "system_s": usage.ru_stime,
+        "block_reads": usage.ru_inblock,
+        "block_writes": usage.ru_oublock,
+        "major_page_faults": usage.ru_majflt,
+        "voluntary_context_switches": usage.ru_nvcsw,
+        "involuntary_context_switches": usage.ru_nivcsw,
+        # Kilobytes on Linux, bytes on macOS
+        "max_rss": usage.ru_maxrss,
+    }
+
+
+def _snapshot():
+    """
+    :return:    dict, current values of all counters
+    """
+    snapshot = {
+        "wall_s": time.perf_counter(),
+        "cpu_s": time.process_time(),
+    }
+    # Before /proc/self/io, so that loading the resource module is not counted as reading
+    usage = read_rusage()
+    for field in ("user_s", "system_s", "block_reads"):
+        if field in usage:
+            snapshot[field] = usage[field]
+    proc_io = read_proc_io()
+    for name, field in PROC_IO_FIELDS.items():
+        if name in proc_io:
+            snapshot[field] = proc_io[name]
+    return snapshot
+
+
+class PhaseTimings:
+    """
+    Resource usage per phase of a comparison run. A phase may be entered several times, its values add up.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        # Passed to create_file_dict and compare_files as def_call_counter
+        self.calls = CallCounter()
+
+    @contextlib.contextmanager
+    def phase(self, def_name):
+        """
+        Records the resource usage of the code run in the with block.
+        :param def_name:    str, name of the phase, e.g. "scan_source"
+        """
+        _start_counting()
+        # /proc/self/io is opened outside of the counted range (before the opens at start, after them at end)
+        start = _snapshot()
+        opens_start = _opens
+        stats_start = self.calls.stats
+        listings_start = self.calls.listings
+        try:
+            yield
+        finally:
+            opens = _opens - opens_start
+            stats = self.calls.stats - stats_start
+            listings = self.calls.listings - listings_start
+            end = _snapshot()
+            _stop_counting()
+            phase = self.phases.setdefault(def_name, {})
+            for field, value in end.items():
+                phase[field] = phase.get(field, 0) + value - start[field]
+            phase["opens"] = phase.get("opens", 0) + opens
+            phase["stats"] = phase.get("stats", 0) + stats
+            phase["listings"] = phase.get("listings", 0) + listings
+            phase["calls"] = phase.get("calls", 0) + 1
+
+    def as_dict(self):
+        """
+        :return:    dict, phase name -> dict of the values (times rounded to microseconds)
+        """
+        return {
+            name: {
+                field: round(value, 6) if isinstance(value, float) else value
+                for field, value in phase.items()
+            }
+            for name, phase in self.phases.items()
+        }
+
+
+def process_counters():
+    """
+    :return:    dict, I/O counters ("io", from /proc/self/io) and resource usage ("rusage") of the whole process
+    """
+    return {
+        "io": read_proc_io(),
+        "rusage": read_rusage(),
+    }
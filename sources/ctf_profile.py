@@ -0,0 +1,267 @@
+"""
+Profiling of a command line run. The run is wrapped in a profiler and three results are produced:
+- PREFIX.pstats:     statistics readable by pstats / snakeviz
+- PREFIX.collapsed:  collapsed stacks ("thread;caller;callee count") for flamegraph.pl or speedscope
+- a report of the time spent in the hot functions of compare_two_folders (hashing, comparing, scanning,
+  searching, printing)
+
+Profilers:
+- "cprofile":   deterministic, exact call counts, but only of the main thread (with --workers > 1 the files are
+                compared in worker threads, see the collapsed stacks for them). Slows the run down.
+- "sampling":   samples the stacks of all threads every interval, low overhead, statistics are estimates.
+The collapsed stacks always come from the sampler (cProfile does not record stacks), in "cprofile" mode the
+sampler runs next to cProfile.
+
+Profiling a comparison:
+./compare_two_folders.py compare SOURCE TARGET --profiler sampling --profile-output slow-run
+python -m pstats slow-run.pstats
+flamegraph.pl slow-run.collapsed > slow-run.svg
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+from ctf_report import (
+    print_report,
+    timestamp,
+)
+
+
+PROFILERS = ("cprofile", "sampling")
+
+# Functions of this project the profile report attributes the time to
+HOT_FUNCTIONS = (
+    "sha_hash",
+    "sha_digest",
+    "compare_files",
+    "create_file_dict",
+    "search_file",
+    "print_files_identical",
+    "print_files_missing_with_search",
+    "print_files_only_mtime_difference",
+    "print_files_any_difference_but_mtime",
+    "print_summary",
+    "print_report",
+)
+
+SOURCES = os.path.dirname(os.path.abspath(__file__))
+
+# Innermost frames of waiting threads (file name, function), their samples are dropped
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+}
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads (except its own) from a background thread. Threads waiting for work or
+    for other threads (see IDLE_FRAMES) are not sampled.
+    """
+
+    def __init__(self, def_interval=0.005):
+        """
+        :param def_interval:    float, seconds between two samples
+        """
+        self.interval = def_interval
+        # (thread name, code objects from the outermost to the innermost frame) -> number of samples
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._sample,
+            name="SamplingProfiler",
+            daemon=True,
+        )
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                self.stacks[(names.get(thread_id, str(thread_id)), tuple(codes))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write_collapsed(self, def_output):
+        """
+        Writes the stacks in the collapsed format of flamegraph.pl, one line per distinct stack.
+        """
+        with open(def_output, "w", encoding="utf-8") as f:
+            for (thread_name, codes), count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                frames = [thread_name.replace(";", ":")] + [
+                    function_label(code).replace(";", ":") for code in codes
+                ]
+                f.write(f"{';'.join(frames)} {count}\n")
+
+    def as_pstats(self):
+        """
+        Converts the samples into the statistics dict of pstats: every sample counts as one call of every
+        function on the stack, the own time of the innermost function and the cumulative time of all functions
+        on the stack grow by the interval.
+        :return:    dict, (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        """
+        stats = {}
+        for (_, codes), count in self.stacks.items():
+            seconds = count * self.interval
+            keys = [(code.co_filename, code.co_firstlineno, code.co_name) for code in codes]
+            seen = set()
+            for index, key in enumerate(keys):
+                calls, own_time, cumulative_time, callers = stats.get(key, (0, 0.0, 0.0, {}))
+                if key not in seen:
+                    # Recursion counts once per sample
+                    calls += count
+                    cumulative_time += seconds
+                    seen.add(key)
+                if index == len(keys) - 1:
+                    own_time += seconds
+                if index > 0:
+                    caller_calls, _, caller_own, caller_cumulative = callers.get(
+                        keys[index - 1], (0, 0, 0.0, 0.0)
+                    )
+                    callers[keys[index - 1]] = (
+                        caller_calls + count,
+                        caller_calls + count,
+                        caller_own + (seconds if index == len(keys) - 1 else 0.0),
+                        caller_cumulative + seconds,
+                    )
+                stats[key] = (calls, own_time, cumulative_time, callers)
+        return {
+            key: (calls, calls, own_time, cumulative_time, callers)
+            for key, (calls, own_time, cumulative_time, callers) in stats.items()
+        }
+
+
+def function_label(def_code):
+    """
+    :return:    str, e.g. "compare_files (ctf_functions.py:274)"
+    """
+    return f"{def_code.co_name} ({os.path.basename(def_code.co_filename)}:{def_code.co_firstlineno})"
+
+
+def write_pstats(
+    def_stats,
+    def_output,
+):
+    """
+    Writes a statistics dict in the format of pstats (as written by cProfile.Profile.dump_stats).
+    """
+    import marshal
+
+    with open(def_output, "wb") as f:
+        marshal.dump(def_stats, f)
+
+
+def print_hot_functions(
+    def_stats,
+    def_elapsed_time,
+    def_profiler,
+):
+    """
+    Prints the time spent in the hot functions of this project.
+    :param def_stats:           dict, statistics as in pstats
+    :param def_elapsed_time:    float, wall time of the run in seconds
+    :param def_profiler:        str, "cprofile" or "sampling"
+    """
+    hot_functions = []
+    for (filename, line, function), (_, calls, own_time, cumulative_time, _) in def_stats.items():
+        if function in HOT_FUNCTIONS and os.path.dirname(os.path.abspath(filename)) == SOURCES:
+            hot_functions.append((cumulative_time, own_time, calls, function, os.path.basename(filename), line))
+    hot_functions.sort(reverse=True)
+
+    print_report()
+    print_report(
+        f"{timestamp()}: "
+        f"PROFILE:   Hot functions ('{def_profiler}', wall time: '{def_elapsed_time:.3f}' s)"
+    )
+    if def_profiler == "sampling":
+        print_report("                     -> calls are samples, times are estimated from the samples")
+    else:
+        print_report("                     -> main thread only, functions run by worker threads are not counted")
+    for cumulative_time, own_time, calls, function, filename, line in hot_functions:
+        share = 100 * cumulative_time / def_elapsed_time if def_elapsed_time else 0.0
+        print_report(
+            f"                     -> {function:<38} cumulative '{cumulative_time:8.3f}' s ({share:5.1f} %), "
+            f"own '{own_time:8.3f}' s, calls '{calls}' ({filename}:{line})"
+        )
+    print_report()
+
+
+def run_profiled(
+    def_function,
+    def_args,
+    def_profiler="cprofile",
+    def_output="ctf-profile",
+    def_interval=0.005,
+):
+    """
+    Runs a function under a profiler and writes the statistics and the collapsed stacks.
+    :param def_function:    function, run with def_args
+    :param def_args:        tuple, arguments of the function
+    :param def_profiler:    str, "cprofile" or "sampling"
+    :param def_output:      str, prefix of the output files (PREFIX.pstats, PREFIX.collapsed)
+    :param def_interval:    float, seconds between two samples of the sampler
+    :return:                return value of the function
+    """
+    if def_profiler not in PROFILERS:
+        raise NotImplementedError(f"No profiler: '{def_profiler}'")
+    profile = None
+    if def_profiler == "cprofile":
+        import cProfile
+
+        profile = cProfile.Profile()
+    sampler = SamplingProfiler(def_interval)
+
+    start_time = time.perf_counter()
+    sampler.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        return def_function(*def_args)
+    finally:
+        if profile is not None:
+            profile.disable()
+        sampler.stop()
+        elapsed_time = time.perf_counter() - start_time
+
+        if profile is not None:
+            profile.create_stats()
+            stats = profile.stats
+        else:
+            stats = sampler.as_pstats()
+        write_pstats(
+            stats,
+            f"{def_output}.pstats",
+        )
+        sampler.write_collapsed(f"{def_output}.collapsed")
+        print_hot_functions(
+            stats,
+            elapsed_time,
+            def_profiler,
+        )
+        print_report(
+            f"{timestamp()}: "
+            f"PROFILE:   Written '{def_output}.pstats' and '{def_output}.collapsed' ('{sampler.samples}' samples)"
+        )
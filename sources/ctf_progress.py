@@ -0,0 +1,205 @@
+import datetime
+import threading
+import time
+
+
+def format_bytes(def_number_of_bytes):
+    """
+    Formats a number of bytes with a binary unit, e.g. "1.5 GB".
+    :param def_number_of_bytes:     int, number of bytes
+    :return:                        str, formatted number of bytes
+    """
+    value = float(def_number_of_bytes)
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if value < 1024 or unit == "TB":
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+class ComparisonProgress:
+    """
+    Byte based progress of the comparison. The bytes scheduled and completed are counted per file, a
+    background thread reports the throughput, an EWMA smoothed ETA and the large files currently being
+    compared on a wall-clock interval.
+    """
+
+    def __init__(
+        self,
+        def_logger,
+        def_files_total,
+        def_bytes_total,
+        def_interval=10.0,
+        def_smoothing=0.3,
+        def_large_file_size=67108864,
+        def_latencies=None,
+    ):
+        """
+        :param def_logger:              ReportLogger, progress is reported in the "general" category
+        :param def_files_total:         int, number of files to be compared
+        :param def_bytes_total:         int, number of bytes scheduled for the comparison (source sizes)
+        :param def_interval:            float, seconds between two progress reports
+        :param def_smoothing:           float, weight of the latest throughput sample in the EWMA (0..1)
+        :param def_large_file_size:     int, files from this size on are listed while in progress
+        :param def_latencies:           LatencyRecorder, if given, the latency of every file is recorded in it
+                                        (see ctf_latency)
+        """
+        self.logger = def_logger
+        self.files_total = def_files_total
+        self.bytes_total = def_bytes_total
+        self.interval = def_interval
+        self.smoothing = def_smoothing
+        self.large_file_size = def_large_file_size
+        self.latencies = def_latencies
+        self.files_completed = 0
+        self.bytes_completed = 0
+        self.bytes_per_second = None
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.digits_number_of_files = f"0{len(str(def_files_total))}d"
+
+    def start(self):
+        if not self.logger.enabled("general") or self.interval <= 0:
+            return
+        self.time_started = time.monotonic()
+        self.thread = threading.Thread(
+            target=self._report_periodically,
+            name="ComparisonProgress",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def start_file(
+        self,
+        def_file,
+        def_size,
+    ):
+        with self.lock:
+            self.in_flight[def_file] = (def_size, time.monotonic())
+
+    def finish_file(
+        self,
+        def_file,
+        def_size,
+        def_checked=0,
+    ):
+        """
+        :param def_checked:     int, mask of the checks run (recorded with the latency)
+        """
+        time_finished = time.monotonic()
+        with self.lock:
+            _, time_started = self.in_flight.pop(def_file, (def_size, time_finished))
+            self.files_completed += 1
+            self.bytes_completed += def_size
+            if self.latencies is not None:
+                self.latencies.add(
+                    time_finished - time_started,
+                    def_file,
+                    def_size,
+                    def_checked,
+                )
+
+    def _report_periodically(self):
+        time_old = time.monotonic()
+        bytes_old = 0
+        while not self.stopped.wait(self.interval):
+            time_new = time.monotonic()
+            with self.lock:
+                files_completed = self.files_completed
+                bytes_completed = self.bytes_completed
+                in_flight = sorted(
+                    self.in_flight.items(),
+                    key=lambda item: item[1][0],
+                    reverse=True,
+                )
+            bytes_per_second = (bytes_completed - bytes_old) / (time_new - time_old)
+            # Intervals spent entirely inside a large file do not tell anything about the throughput
+            if bytes_completed > bytes_old or not in_flight:
+                if self.bytes_per_second is None:
+                    self.bytes_per_second = bytes_per_second
+                else:
+                    self.bytes_per_second = (
+                        self.smoothing * bytes_per_second
+                        + (1 - self.smoothing) * self.bytes_per_second
+                    )
+                time_old = time_new
+                bytes_old = bytes_completed
+            self._report(
+                files_completed,
+                bytes_completed,
+                bytes_per_second,
+                in_flight,
+                time_new,
+            )
+
+    def _report(
+        self,
+        def_files_completed,
+        def_bytes_completed,
+        def_bytes_per_second,
+        def_in_flight,
+        def_time_now,
+    ):
+        self.logger.log_time(
+            "general",
+            "Number of files compared so far: '{:{}}' of '{}'",
+            def_files_completed,
+            self.digits_number_of_files,
+            self.files_total,
+        )
+        self.logger.log(
+            "general",
+            "                     -> '{}' of '{}' compared",
+            format_bytes(def_bytes_completed),
+            format_bytes(self.bytes_total),
+        )
+        self.logger.log(
+            "general",
+            "                     -> '{:.1f}' MB/s (smoothed: '{:.1f}' MB/s)",
+            def_bytes_per_second / 1048576,
+            (self.bytes_per_second or 0) / 1048576,
+        )
+        if self.bytes_per_second:
+            comparison_eta = datetime.timedelta(
+                seconds=round(
+                    (self.bytes_total - def_bytes_completed) / self.bytes_per_second
+                )
+            )
+        else:
+            comparison_eta = "unknown"
+        self.logger.log(
+            "general",
+            "                     -> ETA: '{}'",
+            comparison_eta,
+        )
+        large_files = [
+            (file, size, time_started)
+            for file, (size, time_started) in def_in_flight
+            if size >= self.large_file_size
+        ]
+        for file, size, time_started in large_files[:5]:
+            self.logger.log(
+                "general",
+                "                     -> In progress: '{}' ('{}', since '{}')",
+                file,
+                format_bytes(size),
+                datetime.timedelta(seconds=round(def_time_now - time_started)),
+            )
+        if not large_files and def_in_flight:
+            self.logger.log(
+                "general",
+                "                     -> Current file: '{}'",
+                def_in_flight[0][0],
+            )
+        self.logger.log(
+            "general",
+            "",
+        )
@@ -0,0 +1,442 @@
+"""
+Delta repair of differing files: the data the target already holds is not taken from the source again.
+
+- Same size (e.g. VM images or databases with a few changed blocks): the block digests of both sides are
+  compared and only the differing source blocks are written into the target in place. Nothing is written if
+  the source no longer has the digest of the comparison. The target blocks are saved in an undo journal next
+  to the target before they are overwritten: if the source changes while it is written or the target read
+  back differs from the source, the target is restored. A journal left by an interrupted run is rolled back
+  before the file is repaired again.
+- Different size (inserted or removed data): rsync-style matching. The target blocks are indexed by a weak
+  rolling checksum and a strong digest, the source is scanned at every byte offset and a new file is assembled
+  from the matched target blocks and the unmatched source data, then moved into place. The whole file is
+  written (nothing is saved on writes), only the data copied from the source into it is reduced.
+
+The weak checksums of all offsets are computed with NumPy if it is available, otherwise byte by byte.
+"""
+
+import os
+import shutil
+import struct
+
+from ctf_functions import new_hash
+from ctf_sync import (
+    CopyResult,
+    hash_written,
+)
+
+
+# Block size of the block digests and the rolling checksum
+REPAIR_BLOCK_SIZE = 65536
+
+# Number of source offsets whose weak checksums are computed at once
+ROLLING_SEGMENT_SIZE = 1048576
+
+# Record of the undo journal: offset and length of the saved target block (the block follows)
+_JOURNAL_RECORD = struct.Struct("<QI")
+
+
+def block_digests(
+    def_fd,
+    def_size,
+    def_hash_algorithm,
+    def_block_size=REPAIR_BLOCK_SIZE,
+):
+    """
+    :param def_fd:      int, file descriptor
+    :param def_size:    int, number of bytes to cover
+    :return:            list of bytes, digest of every block (the last block may be shorter)
+    """
+    return [
+        new_hash(def_hash_algorithm, os.pread(def_fd, def_block_size, offset)).digest()
+        for offset in range(0, def_size, def_block_size)
+    ]
+
+
+def weak_checksum(def_data):
+    """
+    Rolling checksum of rsync: a = sum of the bytes, b = sum of the bytes weighted by their distance from the
+    end of the block, both modulo 2^16 (see weak_checksums).
+    :param def_data:    bytes, one block
+    :return:            int, 32-bit checksum
+    """
+    return int(weak_checksums(def_data, len(def_data))[0])
+
+
+def weak_checksums(
+    def_data,
+    def_block_size,
+):
+    """
+    Weak checksums of every block-sized window of the data.
+    :param def_data:        bytes, data (at least one block)
+    :param def_block_size:  int, window size
+    :return:                array (NumPy) or list of int, checksum of the window starting at every offset
+    """
+    number_of_windows = len(def_data) - def_block_size + 1
+    try:
+        import numpy
+    except ImportError:
+        checksums = []
+        a = sum(def_data[:def_block_size])
+        b = sum(
+            (def_block_size - index) * byte
+            for index, byte in enumerate(def_data[:def_block_size])
+        )
+        checksums.append((a & 0xFFFF) | ((b & 0xFFFF) << 16))
+        for offset in range(1, number_of_windows):
+            byte_out = def_data[offset - 1]
+            a += def_data[offset + def_block_size - 1] - byte_out
+            b += a - def_block_size * byte_out
+            checksums.append((a & 0xFFFF) | ((b & 0xFFFF) << 16))
+        return checksums
+
+    # Prefix sums of the bytes and of the bytes weighted by their position, each window is a difference of two
+    data = numpy.frombuffer(def_data, dtype=numpy.uint8).astype(numpy.int64)
+    positions = numpy.arange(len(data) + 1, dtype=numpy.int64)
+    sums = numpy.zeros(len(data) + 1, dtype=numpy.int64)
+    numpy.cumsum(data, out=sums[1:])
+    weighted_sums = numpy.zeros(len(data) + 1, dtype=numpy.int64)
+    numpy.cumsum(data * positions[:-1], out=weighted_sums[1:])
+    a = sums[def_block_size:] - sums[:number_of_windows]
+    b = positions[def_block_size:] * a - (
+        weighted_sums[def_block_size:] - weighted_sums[:number_of_windows]
+    )
+    a &= 0xFFFF
+    b &= 0xFFFF
+    b <<= 16
+    a |= b
+    return a
+
+
+def known_checksums(def_target_checksums):
+    """
+    Weak checksums of the target in the form matching_offsets searches, built once per file.
+    :param def_target_checksums:    dict, weak checksum -> list of (strong digest, target offset)
+    :return:                        array (NumPy) or the dict itself
+    """
+    try:
+        import numpy
+    except ImportError:
+        return def_target_checksums
+    return numpy.fromiter(
+        def_target_checksums.keys(),
+        dtype=numpy.int64,
+        count=len(def_target_checksums),
+    )
+
+
+def matching_offsets(
+    def_checksums,
+    def_known_checksums,
+):
+    """
+    :param def_checksums:           array or list of int, weak checksums of the source windows
+    :param def_known_checksums:     array or dict, weak checksums of the target (see known_checksums)
+    :return:                        list of int, source offsets whose weak checksum occurs in the target
+    """
+    if isinstance(def_checksums, list):
+        return [
+            offset
+            for offset, checksum in enumerate(def_checksums)
+            if checksum in def_known_checksums
+        ]
+    import numpy
+
+    return numpy.flatnonzero(numpy.isin(def_checksums, def_known_checksums)).tolist()
+
+
+def rollback_journal(
+    def_fd_target,
+    def_file_journal,
+):
+    """
+    Writes the target blocks saved in an undo journal back into the target and removes the journal.
+    :return:    int, number of blocks restored
+    """
+    number_of_blocks = 0
+    with open(def_file_journal, "rb") as f:
+        while header := f.read(_JOURNAL_RECORD.size):
+            if len(header) < _JOURNAL_RECORD.size:
+                break
+            offset, length = _JOURNAL_RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # The run was interrupted while this block was saved, it was not overwritten yet
+                break
+            os.pwrite(def_fd_target, data, offset)
+            number_of_blocks += 1
+    os.fsync(def_fd_target)
+    os.unlink(def_file_journal)
+    return number_of_blocks
+
+
+def repair_in_place(
+    def_fd_source,
+    def_fd_target,
+    def_size,
+    def_hash_algorithm,
+    def_file_journal,
+    def_expected_digest=None,
+    def_verify=True,
+    def_block_size=REPAIR_BLOCK_SIZE,
+    def_target_block_digests=None,
+):
+    """
+    Writes the source blocks whose digest differs from the target block into the target (same size only).
+    Every target block is saved in the undo journal before it is overwritten, the target is restored if the
+    repair fails.
+    :param def_file_journal:            str, path of the undo journal (removed when the repair is done)
+    :param def_expected_digest:         bytes, source digest of the comparison (None: not hashed by the comparison)
+    :param def_verify:                  bool, read the target back and compare it with the source
+    :param def_target_block_digests:    list of bytes, block digests of the target (default: computed here)
+    :return:                            int (number of bytes written), bytes (digest of the source), str (error,
+                                        None if repaired; the target is unchanged after an error)
+    """
+    if def_target_block_digests is None:
+        def_target_block_digests = block_digests(
+            def_fd_target,
+            def_size,
+            def_hash_algorithm,
+            def_block_size,
+        )
+    # First pass: the differing blocks and the digest of the source, nothing is written yet
+    sha = new_hash(def_hash_algorithm)
+    blocks_differing = []
+    for index, offset in enumerate(range(0, def_size, def_block_size)):
+        data = os.pread(def_fd_source, def_block_size, offset)
+        sha.update(data)
+        digest = new_hash(def_hash_algorithm, data).digest()
+        if digest != def_target_block_digests[index]:
+            blocks_differing.append((offset, digest))
+    digest_source = sha.digest()
+    if def_expected_digest is not None and digest_source != def_expected_digest:
+        return 0, digest_source, "digest of the source differs from the compared source (changed meanwhile?)"
+
+    error = None
+    bytes_written = 0
+    with open(def_file_journal, "wb") as journal:
+        for offset, digest in blocks_differing:
+            data = os.pread(def_fd_source, def_block_size, offset)
+            if new_hash(def_hash_algorithm, data).digest() != digest:
+                error = "source changed during the repair"
+                break
+            journal.write(_JOURNAL_RECORD.pack(offset, len(data)))
+            journal.write(os.pread(def_fd_target, len(data), offset))
+            # The saved block has to be on disk before it is overwritten
+            journal.flush()
+            os.fsync(journal.fileno())
+            os.pwrite(def_fd_target, data, offset)
+            bytes_written += len(data)
+    if error is None and def_verify:
+        sha_target = new_hash(def_hash_algorithm)
+        for offset in range(0, def_size, def_block_size):
+            sha_target.update(os.pread(def_fd_target, def_block_size, offset))
+        if sha_target.digest() != digest_source:
+            error = "digest of the repaired target differs from the source"
+    if error is not None:
+        rollback_journal(
+            def_fd_target,
+            def_file_journal,
+        )
+        return 0, digest_source, error
+    os.fsync(def_fd_target)
+    os.unlink(def_file_journal)
+    return bytes_written, digest_source, None
+
+
+def repair_rolling(
+    def_fd_source,
+    def_fd_target,
+    def_fd_output,
+    def_size_source,
+    def_size_target,
+    def_hash_algorithm,
+    def_block_size=REPAIR_BLOCK_SIZE,
+    def_segment_size=ROLLING_SEGMENT_SIZE,
+):
+    """
+    Assembles the source in the output file from the matching target blocks and the remaining source data.
+    :return:    int (number of bytes taken from the source), bytes (digest of the output)
+    """
+    # Index of the full target blocks: weak checksum -> [(strong digest, offset)]
+    target_checksums = {}
+    for offset in range(0, def_size_target - def_block_size + 1, def_block_size):
+        data = os.pread(def_fd_target, def_block_size, offset)
+        target_checksums.setdefault(weak_checksum(data), []).append(
+            (new_hash(def_hash_algorithm, data).digest(), offset)
+        )
+    known = known_checksums(target_checksums)
+
+    sha = new_hash(def_hash_algorithm)
+    bytes_from_source = 0
+
+    def write_output(def_data):
+        sha.update(def_data)
+        view = memoryview(def_data)
+        while view:
+            view = view[os.write(def_fd_output, view) :]
+
+    def write_literal(def_start, def_end):
+        nonlocal bytes_from_source
+        for offset in range(def_start, def_end, def_segment_size):
+            write_output(
+                os.pread(def_fd_source, min(def_segment_size, def_end - offset), offset)
+            )
+        bytes_from_source += def_end - def_start
+
+    literal_start = 0
+    position = 0
+    segment_start = 0
+    while target_checksums and segment_start <= def_size_source - def_block_size:
+        data = os.pread(
+            def_fd_source,
+            def_segment_size + def_block_size - 1,
+            segment_start,
+        )
+        if len(data) < def_block_size:
+            break
+        checksums = weak_checksums(data, def_block_size)
+        for offset in matching_offsets(
+            checksums,
+            known,
+        ):
+            if segment_start + offset < position:
+                # Inside a block matched before
+                continue
+            block = data[offset : offset + def_block_size]
+            digest = new_hash(def_hash_algorithm, block).digest()
+            for strong_digest, target_offset in target_checksums[int(checksums[offset])]:
+                if strong_digest == digest:
+                    write_literal(literal_start, segment_start + offset)
+                    write_output(os.pread(def_fd_target, def_block_size, target_offset))
+                    position = segment_start + offset + def_block_size
+                    literal_start = position
+                    break
+        segment_start += def_segment_size
+    write_literal(literal_start, def_size_source)
+    return bytes_from_source, sha.digest()
+
+
+def repair_file(
+    def_file,
+    def_file_source,
+    def_file_target,
+    def_hash_algorithm,
+    def_expected_digest=None,
+    def_verify=True,
+    def_block_size=REPAIR_BLOCK_SIZE,
+):
+    """
+    Repairs a differing target file by writing only what differs from the source. Same-sized files are
+    repaired in place (with an undo journal), otherwise a new file is assembled next to the target and moved
+    into place. The mtime and permissions of the source are taken over.
+    :param def_file:                str, path relative to the compared folders
+    :param def_file_source:         str, path in source
+    :param def_file_target:         str, path in target (has to exist)
+    :param def_hash_algorithm:      str, algorithm of the block digests and the verification
+    :param def_expected_digest:     bytes, source digest of the comparison (None: not hashed by the comparison)
+    :param def_verify:              bool, compare the source with def_expected_digest and read the repaired
+                                    target back (False: the block digests are still compared)
+    :param def_block_size:          int, block size
+    :return:                        CopyResult, "size" holds the bytes written (in place: the differing
+                                    blocks, rolling: the whole file), "bytes_saved" the bytes not written and
+                                    "bytes_reused" the bytes taken over from the target instead of the source
+    """
+    result = CopyResult(def_file)
+    folder_target, name_target = os.path.split(def_file_target)
+    file_temporary = os.path.join(folder_target, f".{name_target}.ctf-sync")
+    file_journal = os.path.join(folder_target, f".{name_target}.ctf-repair")
+    if not def_verify:
+        def_expected_digest = None
+    try:
+        fd_source = os.open(def_file_source, os.O_RDONLY)
+        try:
+            size_source = os.fstat(fd_source).st_size
+            size_target = os.stat(def_file_target).st_size
+            if size_source == size_target:
+                result.method = "delta_in_place"
+                fd_target = os.open(def_file_target, os.O_RDWR)
+                try:
+                    if os.path.exists(file_journal):
+                        # Left by an interrupted repair: the target gets its old blocks back first
+                        rollback_journal(
+                            fd_target,
+                            file_journal,
+                        )
+                    try:
+                        result.size, result.digest, result.error = repair_in_place(
+                            fd_source,
+                            fd_target,
+                            size_source,
+                            def_hash_algorithm,
+                            file_journal,
+                            def_expected_digest,
+                            def_verify,
+                            def_block_size,
+                        )
+                    except OSError:
+                        if os.path.exists(file_journal):
+                            rollback_journal(
+                                fd_target,
+                                file_journal,
+                            )
+                        raise
+                finally:
+                    os.close(fd_target)
+                if result.error is not None:
+                    return result
+                result.bytes_reused = size_source - result.size
+                if def_verify:
+                    result.verified = True
+            else:
+                result.method = "delta_rolling"
+                fd_target = os.open(def_file_target, os.O_RDONLY)
+                try:
+                    fd_output = os.open(
+                        file_temporary,
+                        os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                        0o600,
+                    )
+                    try:
+                        bytes_from_source, result.digest = repair_rolling(
+                            fd_source,
+                            fd_target,
+                            fd_output,
+                            size_source,
+                            size_target,
+                            def_hash_algorithm,
+                            def_block_size,
+                        )
+                        if def_expected_digest is not None:
+                            result.verified = result.digest == def_expected_digest
+                            error = "digest of the source differs from the compared source (changed meanwhile?)"
+                        elif def_verify:
+                            result.verified = result.digest == hash_written(
+                                fd_output,
+                                def_hash_algorithm,
+                            )
+                            error = "digest of the written file differs from the assembled data"
+                    finally:
+                        os.close(fd_output)
+                finally:
+                    os.close(fd_target)
+                if result.verified is False:
+                    result.error = error
+                    os.unlink(file_temporary)
+                    return result
+                result.size = size_source
+                result.bytes_reused = size_source - bytes_from_source
+        finally:
+            os.close(fd_source)
+        result.bytes_saved = size_source - result.size
+        if result.method == "delta_rolling":
+            shutil.copystat(def_file_source, file_temporary)
+            os.replace(file_temporary, def_file_target)
+        else:
+            shutil.copystat(def_file_source, def_file_target)
+    except OSError as error:
+        result.error = str(error)
+        if os.path.exists(file_temporary):
+            os.unlink(file_temporary)
+    return result
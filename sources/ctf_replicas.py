@@ -0,0 +1,402 @@
+"""
+Fan-out comparison of one source against several replicas. The source is scanned and read once, every replica
+is compared with the fingerprint of the source file (size, mtime, digest, block digests) on its own thread pool.
+The results are taken as they finish, whatever the replica. The fingerprint of a file is kept until every replica
+has compared it and only a bounded number of files (REPLICA_WINDOW per worker) is held, so the source and the
+faster replicas run at most that many files ahead of the slowest replica: a slow replica limits the throughput of
+the whole comparison, but it does not stall the others file by file.
+
+The bitwise check compares the digests of 1 MiB blocks (as against an agent) instead of the bytes, so the
+source does not have to be read again for every replica.
+
+Comparing a primary with three backups:
+./compare_two_folders.py replicas /data/primary /backup/one /backup/two /mnt/three -j 4
+"""
+
+import concurrent.futures
+import datetime
+import os
+
+from ctf_functions import (
+    CHECK_BIT,
+    CHECK_HASH,
+    CHECK_MTIME,
+    CHECK_SIZE,
+    CATEGORY_NAMES,
+    ComparisonResult,
+    classify_outcome,
+    create_file_dict,
+    map_in_parallel,
+    new_hash,
+)
+from ctf_report import (
+    ReportLogger,
+    print_report,
+    timestamp,
+)
+
+
+# Block size of the block digests used for the bitwise check
+REPLICA_BLOCK_SIZE = 1048576
+
+# Files held (read from the source, not yet compared on every replica) per worker
+REPLICA_WINDOW = 16
+
+# Status of a file on a replica -> symbol in the matrix
+REPLICA_STATUS_SYMBOLS = {
+    "pass": ".",
+    "only_mtime_difference": "T",
+    "any_difference_but_mtime": "D",
+    "missing_in_target": "M",
+    "missing_in_source": "+",
+    "error": "E",
+    None: "-",
+}
+
+
+class FileFingerprint:
+    """
+    Everything the checks need from one file, read in one pass
+    """
+
+    __slots__ = (
+        "size",
+        "mtime_ns",
+        "digest",
+        "block_digests",
+    )
+
+    def __init__(
+        self,
+        def_size,
+        def_mtime_ns,
+        def_digest=None,
+        def_block_digests=None,
+    ):
+        self.size = def_size
+        self.mtime_ns = def_mtime_ns
+        self.digest = def_digest
+        self.block_digests = def_block_digests
+
+
+def fingerprint_file(
+    def_filename,
+    def_hash_algorithm,
+    def_options,
+    def_block_size=4096,
+):
+    """
+    :param def_options:     str, the file is only read if H or B is requested
+    :return:                FileFingerprint
+    """
+    file_stat = os.stat(def_filename)
+    fingerprint = FileFingerprint(
+        file_stat.st_size,
+        file_stat.st_mtime_ns,
+    )
+    if "H" not in def_options and "B" not in def_options:
+        return fingerprint
+
+    sha = new_hash(def_hash_algorithm)
+    if "B" in def_options:
+        fingerprint.block_digests = []
+        read_size = REPLICA_BLOCK_SIZE
+    else:
+        read_size = max(def_block_size, 4096)
+    with open(def_filename, "rb") as f:
+        while data := f.read(read_size):
+            sha.update(data)
+            if fingerprint.block_digests is not None:
+                fingerprint.block_digests.append(new_hash(def_hash_algorithm, data).digest())
+    if "H" in def_options:
+        fingerprint.digest = sha.digest()
+    return fingerprint
+
+
+def compare_fingerprints(
+    def_source,
+    def_target,
+    def_options,
+):
+    """
+    :param def_source:      FileFingerprint, source file
+    :param def_target:      FileFingerprint, replica file
+    :return:                ComparisonResult
+    """
+    result = ComparisonResult(
+        def_source_size=def_source.size,
+        def_target_size=def_target.size,
+        def_source_mtime_ns=def_source.mtime_ns,
+        def_target_mtime_ns=def_target.mtime_ns,
+        def_source_digest=def_source.digest,
+        def_target_digest=def_target.digest,
+    )
+    if "S" in def_options:
+        result.checked |= CHECK_SIZE
+        if def_source.size == def_target.size:
+            result.passed |= CHECK_SIZE
+    if "T" in def_options:
+        result.checked |= CHECK_MTIME
+        if def_source.mtime_ns == def_target.mtime_ns:
+            result.passed |= CHECK_MTIME
+    if "H" in def_options:
+        result.checked |= CHECK_HASH
+        if def_source.digest == def_target.digest:
+            result.passed |= CHECK_HASH
+    if "B" in def_options:
+        result.checked |= CHECK_BIT
+        if def_source.block_digests == def_target.block_digests:
+            result.passed |= CHECK_BIT
+    return result
+
+
+def compare_replicas(
+    def_folder_source,
+    def_folders_replica,
+    def_hash_algorithm,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_options="STHB",
+    def_verbose=None,
+    def_workers=1,
+    def_block_size=4096,
+):
+    """
+    Compares a source folder with every replica folder, reading every source file once. A file which can not be
+    read on a replica is reported as an error of that replica, the other replicas go on.
+    :param def_folders_replica:     list, replica folders (each only once)
+    :param def_workers:             int, number of files read in parallel from the source and from every replica
+    :return:                        dict (replica -> counts, as returned by compare_folders, and "files_error"),
+                                    dict (relative path -> list of the status per replica, only files which are
+                                    not identical on every replica; status as in REPLICA_STATUS_SYMBOLS)
+    """
+    if def_verbose is None:
+        def_verbose = {
+            "general": True,
+            "files-pass": True,
+            "summary": True,
+        }
+    logger = ReportLogger(def_verbose)
+    if len(set(def_folders_replica)) < len(def_folders_replica):
+        raise ValueError("every replica folder can only be given once")
+    folders = [def_folder_source] + list(def_folders_replica)
+    number_of_replicas = len(def_folders_replica)
+
+    def scan(def_folder):
+        return create_file_dict(
+            def_folder,
+            def_exclude_files,
+            def_exclude_extensions,
+        )
+
+    # All folders are scanned at the same time
+    listings = list(
+        map_in_parallel(
+            scan,
+            folders,
+            len(folders),
+        )
+    )
+    files_source, files_source_size = listings[0]
+    files_replicas = [files for files, _ in listings[1:]]
+
+    print_report()
+    print_report(">>>>>>>>> Comparing a source with its replicas <<<<<<<<<")
+    print_report()
+    print_report(
+        f"{timestamp()}: "
+        f"OPTIONS:  '{def_options}' is requested (algorithm: '{def_hash_algorithm}')"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"SOURCE:   '{def_folder_source}' (number of files: '{len(files_source)}', size: '{files_source_size}' bytes)"
+    )
+    for index, (folder, (files, size)) in enumerate(zip(def_folders_replica, listings[1:]), 1):
+        print_report(
+            f"{timestamp()}: "
+            f"REPLICA:  '{index}' '{folder}' (number of files: '{len(files)}', size: '{size}' bytes)"
+        )
+    print_report()
+
+    return_data_per_replica = {}
+    for folder, (_, size) in zip(def_folders_replica, listings[1:]):
+        return_data_per_replica[folder] = {
+            "files_pass": 0,
+            "files_missing_in_source": 0,
+            "files_missing_in_target": 0,
+            "files_only_mtime_difference": 0,
+            "files_any_difference_but_mtime": 0,
+            "files_error": 0,
+            "files_source_size": files_source_size,
+            "files_target_size": size,
+        }
+    return_data_list = list(return_data_per_replica.values())
+    matrix = {}
+
+    def fingerprint_source(def_file):
+        return def_file, fingerprint_file(
+            files_source[def_file],
+            def_hash_algorithm,
+            def_options,
+            def_block_size,
+        )
+
+    def compare_replica_file(
+        def_fingerprint_source,
+        def_path,
+    ):
+        return compare_fingerprints(
+            def_fingerprint_source,
+            fingerprint_file(
+                def_path,
+                def_hash_algorithm,
+                def_options,
+                def_block_size,
+            ),
+            def_options,
+        )
+
+    # Relative path -> [status per replica, number of replicas still comparing]
+    outstanding = {}
+    # Future -> (relative path, replica index)
+    running = {}
+
+    def record(
+        def_file,
+        def_index,
+        def_status,
+    ):
+        return_data_list[def_index][f"files_{def_status}"] += 1
+        statuses_remaining = outstanding[def_file]
+        statuses_remaining[0][def_index] = def_status
+        statuses_remaining[1] -= 1
+        if not statuses_remaining[1]:
+            del outstanding[def_file]
+            if any(status != "pass" for status in statuses_remaining[0]):
+                matrix[def_file] = statuses_remaining[0]
+
+    def collect():
+        # Whichever replica finishes first, a slow replica does not hold up the results of the others
+        done, _ = concurrent.futures.wait(
+            running,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            file, index = running.pop(future)
+            try:
+                results = future.result()
+            except OSError as error:
+                print_report(
+                    f"{timestamp()}: "
+                    f"ERROR:     Reading failed:         '{file}' on replica '{index + 1}'"
+                )
+                print_report(f"                     -> {error}")
+                record(file, index, "error")
+                continue
+            record(
+                file,
+                index,
+                CATEGORY_NAMES[
+                    classify_outcome(
+                        results.checked,
+                        results.passed,
+                    )
+                ],
+            )
+
+    comparison_start_time = datetime.datetime.now()
+    print_report(
+        f"{timestamp()}: "
+        f"BEGIN:     Comparison of files"
+    )
+    # Every replica has its own thread pool, the source is read by map_in_parallel ahead of them
+    executors = [
+        concurrent.futures.ThreadPoolExecutor(max_workers=def_workers)
+        for _ in def_folders_replica
+    ]
+    try:
+        for file, fingerprint in map_in_parallel(
+            fingerprint_source,
+            sorted(files_source),
+            def_workers,
+        ):
+            outstanding[file] = [[None] * number_of_replicas, number_of_replicas]
+            for index, (executor, files) in enumerate(zip(executors, files_replicas)):
+                if file in files:
+                    future = executor.submit(
+                        compare_replica_file,
+                        fingerprint,
+                        files[file],
+                    )
+                    running[future] = (file, index)
+                else:
+                    record(file, index, "missing_in_target")
+            while len(outstanding) >= REPLICA_WINDOW * def_workers:
+                collect()
+        while running:
+            collect()
+    finally:
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+
+    # Files which are only on some replicas
+    for index, files in enumerate(files_replicas):
+        for file in files.keys() - files_source.keys():
+            return_data_list[index]["files_missing_in_source"] += 1
+            matrix.setdefault(file, [None] * number_of_replicas)[index] = "missing_in_source"
+
+    print_report(
+        f"{timestamp()}: "
+        f"TIME:      '{datetime.datetime.now() - comparison_start_time}'"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"END:       Comparison of files"
+    )
+    print_report()
+    print_replica_matrix(
+        matrix,
+        def_folders_replica,
+        logger,
+    )
+    return return_data_per_replica, matrix
+
+
+def print_replica_matrix(
+    def_matrix,
+    def_folders_replica,
+    def_logger,
+):
+    """
+    Prints one line per file which is not identical on every replica, one symbol per replica.
+    """
+    if not def_matrix:
+        print_report(
+            f"{timestamp()}: "
+            f"MATRIX:    All files are identical on all replicas"
+        )
+        print_report()
+        return
+    print_report(
+        f"{timestamp()}: "
+        f"MATRIX:    '{len(def_matrix)}' files are not identical on every replica"
+    )
+    def_logger.log(
+        "general",
+        "                     -> "
+        "'.' identical, 'T' only mtime differs, 'D' differs, 'M' missing on the replica, "
+        "'+' only on the replica, 'E' not readable on the replica, '-' not in source and not on the replica",
+    )
+    def_logger.log(
+        "general",
+        "                     -> {} replicas {}",
+        "".join(str(index % 10) for index in range(1, len(def_folders_replica) + 1)),
+        ", ".join(f"'{index}' '{folder}'" for index, folder in enumerate(def_folders_replica, 1)),
+    )
+    for file in sorted(def_matrix):
+        print_report(
+            "                     -> "
+            + "".join(REPLICA_STATUS_SYMBOLS[status] for status in def_matrix[file])
+            + f" '{file}'"
+        )
+    print_report()
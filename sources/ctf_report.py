@@ -0,0 +1,598 @@
+import atexit
+import datetime
+import queue
+import signal
+import sys
+import threading
+import time
+
+
+STRUCTURED_REPORT_FORMATS = ("jsonl", "csv")
+
+REPORT_LOG_COMPRESSIONS = (None, "gzip", "lzma")
+
+# Cached timestamp string and the second it was formatted for
+_timestamp_second = None
+_timestamp_string = ""
+
+# Report writer used by print_report (None: write directly to stdout)
+_report_writer = None
+
+
+def timestamp():
+    """
+    Formats the current time as used at the beginning of the report lines. The string is only formatted once
+    per second and cached in between.
+    :return:    str, current time formatted as "%Y-%m-%d %H:%M:%S"
+    """
+    global _timestamp_second, _timestamp_string
+    second = int(time.time())
+    if second != _timestamp_second:
+        _timestamp_string = datetime.datetime.fromtimestamp(second).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        _timestamp_second = second
+    return _timestamp_string
+
+
+def set_report_writer(def_report_writer):
+    """
+    Routes all report lines written by print_report through a ReportWriter.
+    :param def_report_writer:   ReportWriter, writer to use (None: write directly to stdout)
+    """
+    global _report_writer
+    _report_writer = def_report_writer
+
+
+def print_report(*def_values):
+    """
+    Replacement for print() used for all report lines.
+    :param def_values:  values to print, separated by a space
+    """
+    text = " ".join(str(value) for value in def_values) + "\n"
+    if _report_writer is None:
+        sys.stdout.write(text)
+    else:
+        _report_writer.write(text)
+
+
+class ReportLogger:
+    """
+    Leveled report logger. Every message belongs to one or more verbosity categories ("general", "files-pass",
+    "details", "summary") and is only formatted (str.format with the given arguments) if all of them are enabled.
+    """
+
+    def __init__(self, def_verbose):
+        """
+        :param def_verbose:     dict, verbosity per category
+        """
+        self.categories = frozenset(
+            category for category, enabled in def_verbose.items() if enabled
+        )
+
+    def enabled(self, def_category):
+        """
+        :param def_category:    str or tuple, category or categories which all have to be enabled
+        :return:                bool, True if messages of the category are reported
+        """
+        if isinstance(def_category, str):
+            return def_category in self.categories
+        return self.categories.issuperset(def_category)
+
+    def log(
+        self,
+        def_category,
+        def_message,
+        *def_args,
+    ):
+        if self.enabled(def_category):
+            print_report(def_message.format(*def_args) if def_args else def_message)
+
+    def log_time(
+        self,
+        def_category,
+        def_message,
+        *def_args,
+    ):
+        """
+        Same as log, prefixed by the current time.
+        """
+        if self.enabled(def_category):
+            print_report(
+                f"{timestamp()}: "
+                + (def_message.format(*def_args) if def_args else def_message)
+            )
+
+    def log_details(
+        self,
+        def_category,
+        def_results,
+    ):
+        """
+        Reports the details of a comparison result, one line per check.
+        :param def_category:    str or tuple, category or categories which all have to be enabled
+        :param def_results:     ComparisonResult, comparison result as returned by compare_files
+        """
+        if self.enabled(def_category):
+            for detail in def_results:
+                print_report(f"                     -> {detail}")
+
+
+class ReportWriter:
+    """
+    Buffered report writer. The text is collected in a large buffer and written by a background thread,
+    either to stdout or to an optionally gzip- or lzma-compressed log file. Pending text is written at least
+    every flush interval and when the process exits or is terminated by a signal.
+    """
+
+    def __init__(
+        self,
+        def_output=None,
+        def_compression=None,
+        def_buffer_size=1048576,
+        def_flush_interval=1.0,
+    ):
+        """
+        :param def_output:              str, path of the log file (None: stdout)
+        :param def_compression:         str, None, "gzip" or "lzma" (log file only)
+        :param def_buffer_size:         int, number of characters collected before handing them to the writer thread
+        :param def_flush_interval:      float, maximum number of seconds text stays in the buffer
+        """
+        if def_compression not in REPORT_LOG_COMPRESSIONS:
+            raise NotImplementedError(f"No report log compression: '{def_compression}'")
+        if def_output is None:
+            self.stream = sys.stdout.buffer
+            self.owns_stream = False
+        elif def_compression == "gzip":
+            import gzip
+
+            self.stream = gzip.open(def_output, "wb")
+            self.owns_stream = True
+        elif def_compression == "lzma":
+            import lzma
+
+            self.stream = lzma.open(def_output, "wb")
+            self.owns_stream = True
+        else:
+            self.stream = open(def_output, "wb")
+            self.owns_stream = True
+        self.buffer_size = def_buffer_size
+        self.flush_interval = def_flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffer_length = 0
+        self.chunks = queue.Queue()
+        self.closed = False
+        # First exception of the writer thread, raised by flush() and close()
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._write_chunks,
+            name="ReportWriter",
+            daemon=True,
+        )
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, def_text):
+        with self.lock:
+            self.buffer.append(def_text)
+            self.buffer_length += len(def_text)
+            if self.buffer_length >= self.buffer_size:
+                self.chunks.put(self._take_buffer())
+
+    def flush(self):
+        """
+        Writes all pending text and waits until it has been written.
+        Raises the first error of the writer thread (e.g. EPIPE, ENOSPC), the text after it is discarded.
+        """
+        with self.lock:
+            if self.buffer:
+                self.chunks.put(self._take_buffer())
+        self.chunks.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            self.chunks.put(None)
+            self.thread.join()
+            atexit.unregister(self.close)
+            if self.owns_stream:
+                self.stream.close()
+
+    def install_signal_handlers(self):
+        """
+        Turns SIGTERM and SIGHUP into a normal exit so the pending text is written by the exit handler.
+        Must be called from the main thread.
+        """
+
+        def exit_on_signal(def_signal_number, def_frame):
+            raise SystemExit(128 + def_signal_number)
+
+        for signal_name in ("SIGTERM", "SIGHUP"):
+            if hasattr(signal, signal_name):
+                signal.signal(getattr(signal, signal_name), exit_on_signal)
+
+    def _take_buffer(self):
+        chunk = "".join(self.buffer)
+        self.buffer = []
+        self.buffer_length = 0
+        return chunk
+
+    def _write_chunks(self):
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # Queue the text that waited longer than the flush interval
+                with self.lock:
+                    if self.buffer:
+                        self.chunks.put(self._take_buffer())
+                continue
+            if chunk is None:
+                self.chunks.task_done()
+                break
+            try:
+                if self.error is None:
+                    # File names which are not valid UTF-8 are written with their original bytes
+                    self.stream.write(chunk.encode("utf-8", "surrogateescape"))
+                    self.stream.flush()
+            except Exception as error:
+                self.error = error
+            finally:
+                # flush() must never wait for a chunk which was not written
+                self.chunks.task_done()
+
+
+CSV_FIELDNAMES = [
+    "record",
+    "time",
+    "options",
+    "classification",
+    "file",
+    "file_source",
+    "file_target",
+    "file_size",
+    "file_mtime",
+    "file_hash",
+    "file_bit",
+    "count",
+    "seconds",
+    "size",
+    "checks",
+]
+
+# CSV rows making up the latency record: histogram buckets, slowest files and slowest directories
+LATENCY_CSV_RECORDS = ("latency", "slowest_file", "slowest_directory")
+
+
+class StructuredReportWriter:
+    """
+    Streams one record per file classification as JSON Lines or CSV
+    """
+
+    def __init__(
+        self,
+        def_output,
+        def_format="jsonl",
+    ):
+        """
+        :param def_output:      str or file object, path of the report ("-" for stdout) or an open text stream
+        :param def_format:      str, "jsonl" or "csv"
+        """
+        if def_format not in STRUCTURED_REPORT_FORMATS:
+            raise NotImplementedError(f"No structured report format: '{def_format}'")
+        self.format = def_format
+        if def_output == "-":
+            self.stream = sys.stdout
+            self.owns_stream = False
+        elif isinstance(def_output, str):
+            self.stream = open(def_output, "w", newline="", encoding="utf-8", errors="surrogateescape")
+            self.owns_stream = True
+        else:
+            self.stream = def_output
+            self.owns_stream = False
+        self.csv_writer = None
+        if self.format == "jsonl":
+            import json
+
+            self.json_encoder = json.JSONEncoder(separators=(",", ":"))
+        else:
+            import csv
+
+            self.csv_writer = csv.DictWriter(
+                self.stream,
+                fieldnames=CSV_FIELDNAMES,
+            )
+            self.csv_writer.writeheader()
+
+    def write_file_record(
+        self,
+        def_options,
+        def_classification,
+        def_file,
+        def_file_source=None,
+        def_file_target=None,
+        def_results=None,
+    ):
+        """
+        Writes the record of one classified file.
+        :param def_options:             str, options of the comparison run
+        :param def_classification:      str, e.g. "pass", "missing_in_target", "only_mtime_difference"
+        :param def_file:                str, file path relative to the compared folders
+        :param def_file_source:         str, file path in source (None if missing)
+        :param def_file_target:         str, file path in target (None if missing)
+        :param def_results:             ComparisonResult, comparison result as returned by compare_files
+        """
+        if self.format == "jsonl":
+            self._write_json(
+                {
+                    "record": "file",
+                    "time": _record_time(),
+                    "options": def_options,
+                    "classification": def_classification,
+                    "file": def_file,
+                    "file_source": def_file_source,
+                    "file_target": def_file_target,
+                    "checks": list(def_results or []),
+                }
+            )
+        else:
+            row = {
+                "record": "file",
+                "time": _record_time(),
+                "options": def_options,
+                "classification": def_classification,
+                "file": def_file,
+                "file_source": def_file_source or "",
+                "file_target": def_file_target or "",
+            }
+            for result in def_results or []:
+                row[result["details"]] = "pass" if result["result"] else "fail"
+            self.csv_writer.writerow(row)
+
+    def write_summary_record(
+        self,
+        def_options,
+        def_counts,
+    ):
+        """
+        Writes the final summary record carrying the counts returned by compare_folders.
+        :param def_options:     str, options of the comparison run
+        :param def_counts:      dict, counts as returned by compare_folders
+        """
+        if self.format == "jsonl":
+            self._write_json(
+                {
+                    "record": "summary",
+                    "time": _record_time(),
+                    "options": def_options,
+                    "counts": def_counts,
+                }
+            )
+        else:
+            time_string = _record_time()
+            for key, value in def_counts.items():
+                self.csv_writer.writerow(
+                    {
+                        "record": "summary",
+                        "time": time_string,
+                        "options": def_options,
+                        "classification": key,
+                        "count": value,
+                    }
+                )
+        self.stream.flush()
+
+    def write_latency_record(self, def_latency):
+        """
+        Writes the per-file latency of the comparison pass (shared by all options).
+        :param def_latency:     dict, histogram and slowest files and directories (see LatencyRecorder.as_dict)
+        """
+        if self.format == "jsonl":
+            self._write_json(
+                {
+                    "record": "latency",
+                    "time": _record_time(),
+                    "latency": def_latency,
+                }
+            )
+        else:
+            # One row per histogram bucket ("classification": upper bound), slowest file and slowest directory
+            time_string = _record_time()
+            for bound, count in def_latency["buckets"].items():
+                self.csv_writer.writerow(
+                    {
+                        "record": "latency",
+                        "time": time_string,
+                        "classification": bound,
+                        "count": count,
+                    }
+                )
+            for item in def_latency["slowest_files"]:
+                self.csv_writer.writerow(
+                    {
+                        "record": "slowest_file",
+                        "time": time_string,
+                        "file": item["file"],
+                        "seconds": item["seconds"],
+                        "size": item["size"],
+                        "checks": item["checks"],
+                    }
+                )
+            for item in def_latency["slowest_directories"]:
+                self.csv_writer.writerow(
+                    {
+                        "record": "slowest_directory",
+                        "time": time_string,
+                        "file": item["directory"],
+                        "count": item["files"],
+                        "seconds": item["seconds"],
+                        "size": item["size"],
+                    }
+                )
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+        if self.owns_stream:
+            self.stream.close()
+
+    def _write_json(self, def_record):
+        self.stream.write(self.json_encoder.encode(def_record))
+        self.stream.write("\n")
+
+
+def _record_time():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def read_structured_report(
+    def_input,
+    def_format="jsonl",
+):
+    """
+    Reads a structured report back as a stream of records (the shape written for JSON Lines): "file", "summary"
+    (one per option string) and "latency" records. The CSV latency record has no "total_s".
+    :param def_input:       str, path of the report
+    :param def_format:      str, "jsonl" or "csv"
+    :return:                generator of dict records
+    """
+    import csv
+    import json
+
+    with open(def_input, newline="", encoding="utf-8", errors="surrogateescape") as f:
+        if def_format == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif def_format == "csv":
+            # The summary and the latency records are spread over several rows
+            summary = None
+            latency = None
+            for row in csv.DictReader(f):
+                record_type = row["record"]
+                if summary is not None and (record_type != "summary" or summary["options"] != row["options"]):
+                    yield summary
+                    summary = None
+                if latency is not None and record_type not in LATENCY_CSV_RECORDS:
+                    yield latency
+                    latency = None
+                if record_type == "summary":
+                    if summary is None:
+                        summary = {
+                            "record": "summary",
+                            "time": row["time"],
+                            "options": row["options"],
+                            "counts": {},
+                        }
+                    summary["counts"][row["classification"]] = int(row["count"])
+                elif record_type in LATENCY_CSV_RECORDS:
+                    if latency is None:
+                        latency = {
+                            "record": "latency",
+                            "time": row["time"],
+                            "latency": {
+                                "files": 0,
+                                "buckets": {},
+                                "slowest_files": [],
+                                "slowest_directories": [],
+                            },
+                        }
+                    values = latency["latency"]
+                    if record_type == "latency":
+                        values["files"] += int(row["count"])
+                        values["buckets"][row["classification"]] = int(row["count"])
+                    elif record_type == "slowest_file":
+                        values["slowest_files"].append(
+                            {
+                                "file": row["file"],
+                                "seconds": float(row["seconds"]),
+                                "size": int(row["size"]),
+                                "checks": row["checks"],
+                            }
+                        )
+                    else:
+                        values["slowest_directories"].append(
+                            {
+                                "directory": row["file"],
+                                "seconds": float(row["seconds"]),
+                                "files": int(row["count"]),
+                                "size": int(row["size"]),
+                            }
+                        )
+                elif record_type == "file":
+                    yield {
+                        "record": "file",
+                        "time": row["time"],
+                        "options": row["options"],
+                        "classification": row["classification"],
+                        "file": row["file"],
+                        "file_source": row["file_source"] or None,
+                        "file_target": row["file_target"] or None,
+                        "checks": [
+                            {"details": details, "result": row[details] == "pass"}
+                            for details in ("file_size", "file_mtime", "file_hash", "file_bit")
+                            if row[details]
+                        ],
+                    }
+            if summary is not None:
+                yield summary
+            if latency is not None:
+                yield latency
+        else:
+            raise NotImplementedError(f"No structured report format: '{def_format}'")
+
+
+def render_structured_report(
+    def_input,
+    def_format="jsonl",
+    def_verbose=None,
+):
+    """
+    Renders the human readable report from a structured report stream.
+    :param def_input:       str, path of the report
+    :param def_format:      str, "jsonl" or "csv"
+    :param def_verbose:     dict, verbosity as used by compare_folders
+    """
+    if def_verbose is None:
+        def_verbose = {
+            "general": True,
+            "files-pass": True,
+            "details": True,
+            "summary": True,
+        }
+    info_text = {
+        "pass": "PASS:      Files are identical:    ",
+        "missing_in_source": "ERROR:     File missing in source: ",
+        "missing_in_target": "ERROR:     File missing in target: ",
+        "only_mtime_difference": "ERROR->OK: File differs:           ",
+        "any_difference_but_mtime": "ERROR:     File differs:           ",
+        "removed": "WATCH:     File removed:           ",
+    }
+    for record in read_structured_report(def_input, def_format):
+        if record["record"] == "summary":
+            if def_verbose["summary"]:
+                print_report(f"{record['time'].replace('T', ' ')}: SUMMARY: '{record['options']}'")
+                for key, value in record["counts"].items():
+                    print_report(f"                     -> {key}: '{value}'")
+                print_report()
+            continue
+        if record["record"] != "file":
+            # The latency record is part of the summary of the comparison run, not of the file report
+            continue
+        classification = record["classification"]
+        if classification == "pass" and not def_verbose["files-pass"]:
+            continue
+        print_report(
+            f"{record['time'].replace('T', ' ')}: "
+            f"{info_text[classification]}'{record['file']}'"
+        )
+        if def_verbose["details"]:
+            for detail in record["checks"]:
+                print_report(f"                     -> {detail}")
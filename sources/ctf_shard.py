@@ -0,0 +1,269 @@
+"""
+Sharded comparison: the relative paths are split deterministically into N shards, every run (on its own host
+or process) compares only its shard and writes a partial result file, the partial results are merged into the
+totals of the whole comparison.
+
+Split methods:
+- "hash": by the CRC-32 of the relative path, spreads the files evenly
+- "top":  by the CRC-32 of the top-level directory (or file), keeps directories together and lets every shard
+          scan only its own top-level directories
+
+Running three shards and merging them:
+./compare_two_folders.py compare SOURCE TARGET --shard 0/3 --shard-result shard0.json
+./compare_two_folders.py compare SOURCE TARGET --shard 1/3 --shard-result shard1.json
+./compare_two_folders.py compare SOURCE TARGET --shard 2/3 --shard-result shard2.json
+./compare_two_folders.py merge-shards shard0.json shard1.json shard2.json
+"""
+
+import json
+import os
+import zlib
+
+from ctf_functions import create_file_dict
+from ctf_latency import merge_latency
+
+
+SHARD_METHODS = ("hash", "top")
+
+SHARD_RESULT_VERSION = 1
+
+# Counts of the shard results which are peaks of one process (see ctf_phases.read_rusage), merged by their maximum
+PEAK_COUNTS = ("max_rss",)
+
+
+def parse_shard(
+    def_value,
+    def_method="hash",
+):
+    """
+    :param def_value:   str, "INDEX/COUNT" with INDEX from 0 to COUNT - 1, e.g. "2/8"
+    :param def_method:  str, "hash" or "top"
+    :return:            tuple, (index, count, method)
+    """
+    index, _, count = def_value.partition("/")
+    index = int(index)
+    count = int(count)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard: '{def_value}' (use INDEX/COUNT, INDEX from 0 to COUNT - 1)")
+    if def_method not in SHARD_METHODS:
+        raise ValueError(f"invalid shard method: '{def_method}'")
+    return index, count, def_method
+
+
+def shard_of(
+    def_file,
+    def_number_of_shards,
+    def_method="hash",
+):
+    """
+    :param def_file:                str, relative path
+    :param def_number_of_shards:    int, number of shards
+    :param def_method:              str, "hash" or "top"
+    :return:                        int, shard of the file (the same on every host)
+    """
+    def_file = def_file.replace(os.sep, "/")
+    if def_method == "top":
+        def_file = def_file.partition("/")[0]
+    return zlib.crc32(def_file.encode("utf-8", "surrogateescape")) % def_number_of_shards
+
+
+def filter_shard(
+    def_files,
+    def_shard,
+    def_file_sizes=None,
+):
+    """
+    Keeps the files of one shard.
+    :param def_files:       dict, relative path -> path
+    :param def_shard:       tuple, (index, count, method)
+    :param def_file_sizes:  dict, relative path -> size, reduced to the shard as well (if given)
+    :return:                dict (relative path -> path), int (total size of the files of the shard, if sizes given)
+    """
+    index, count, method = def_shard
+    files = {
+        file: path
+        for file, path in def_files.items()
+        if shard_of(file, count, method) == index
+    }
+    size = 0
+    if def_file_sizes is not None:
+        for file in list(def_file_sizes):
+            if file in files:
+                size += def_file_sizes[file]
+            else:
+                del def_file_sizes[file]
+    return files, size
+
+
+def create_shard_file_dict(
+    def_folder,
+    def_shard,
+    def_exclude_files=None,
+    def_exclude_extensions=None,
+    def_file_sizes=None,
+    def_call_counter=None,
+):
+    """
+    Same as create_file_dict for the files of one shard. With the "top" method only the top-level directories
+    of the shard are scanned.
+    :param def_shard:   tuple, (index, count, method)
+    """
+    index, count, method = def_shard
+    if method != "top":
+        file_sizes = {}
+        files, _ = create_file_dict(
+            def_folder,
+            def_exclude_files,
+            def_exclude_extensions,
+            file_sizes,
+            def_call_counter,
+        )
+        files, size = filter_shard(
+            files,
+            def_shard,
+            file_sizes,
+        )
+        if def_file_sizes is not None:
+            def_file_sizes.update(file_sizes)
+        return files, size
+
+    files = {}
+    size = 0
+    if def_call_counter is not None:
+        def_call_counter.listings += 1
+    for entry in os.scandir(def_folder):
+        if shard_of(entry.name, count, method) != index:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            file_sizes = {}
+            files_directory, size_directory = create_file_dict(
+                entry.path,
+                def_exclude_files,
+                def_exclude_extensions,
+                file_sizes,
+                def_call_counter,
+            )
+            for file, path in files_directory.items():
+                files[os.path.join(entry.name, file)] = path
+            if def_file_sizes is not None:
+                for file, file_size in file_sizes.items():
+                    def_file_sizes[os.path.join(entry.name, file)] = file_size
+            size += size_directory
+        elif entry.is_file():
+            if def_exclude_files and entry.name in def_exclude_files:
+                continue
+            if (
+                def_exclude_extensions
+                and os.path.splitext(entry.name)[1].lower() in def_exclude_extensions
+            ):
+                continue
+            files[entry.name] = entry.path
+            file_size = entry.stat().st_size
+            if def_call_counter is not None:
+                def_call_counter.stats += 1
+            size += file_size
+            if def_file_sizes is not None:
+                def_file_sizes[entry.name] = file_size
+    return files, size
+
+
+def write_shard_result(
+    def_output,
+    def_shard,
+    def_folder_source,
+    def_folder_target,
+    def_return_data_per_options,
+):
+    """
+    Writes the partial result of one shard.
+    :param def_shard:                       tuple, (index, count, method)
+    :param def_return_data_per_options:     dict, option string -> counts (as returned by compare_folders)
+    """
+    index, count, method = def_shard
+    with open(def_output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": SHARD_RESULT_VERSION,
+                "shard": index,
+                "shards": count,
+                "method": method,
+                "source": def_folder_source,
+                "target": def_folder_target,
+                "results": def_return_data_per_options,
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def merge_shard_results(def_inputs):
+    """
+    Adds up the partial results of all shards of a comparison.
+    :param def_inputs:  list, partial result files (one per shard, in any order)
+    :return:            dict (option string -> counts, as returned by compare_folders), dict (shard settings)
+    """
+    shard_results = {}
+    settings = None
+    for input_file in def_inputs:
+        with open(input_file, encoding="utf-8") as f:
+            shard_result = json.load(f)
+        if shard_result.get("version") != SHARD_RESULT_VERSION:
+            raise ValueError(f"'{input_file}' is not a shard result of version {SHARD_RESULT_VERSION}")
+        # Source and target are not compared, the hosts may mount the folders at different paths
+        shard_settings = {
+            key: shard_result[key]
+            for key in ("shards", "method")
+        }
+        shard_settings["options"] = sorted(shard_result["results"])
+        if settings is None:
+            settings = shard_settings
+        elif shard_settings != settings:
+            raise ValueError(f"'{input_file}' belongs to another comparison: {shard_settings}")
+        if shard_result["shard"] in shard_results:
+            raise ValueError(f"shard '{shard_result['shard']}' is given twice")
+        shard_results[shard_result["shard"]] = shard_result["results"]
+    if settings is None:
+        raise ValueError("no shard results given")
+    missing_shards = set(range(settings["shards"])) - set(shard_results)
+    if missing_shards:
+        raise ValueError(f"shard results missing for shards: {sorted(missing_shards)}")
+
+    return_data_per_options = {}
+    for results in shard_results.values():
+        for options, return_data in results.items():
+            totals = return_data_per_options.setdefault(options, {})
+            # The slowest files and directories are merged, not added up
+            latency = return_data.pop("latency", None)
+            add_counts(
+                totals,
+                return_data,
+            )
+            if latency is not None:
+                merge_latency(
+                    totals.setdefault("latency", {}),
+                    latency,
+                )
+    return return_data_per_options, settings
+
+
+def add_counts(
+    def_totals,
+    def_counts,
+):
+    """
+    Adds counts to totals, nested dicts (e.g. the resource usage per phase) are added up key by key. Peaks of
+    one process (see PEAK_COUNTS) are not added up, the largest is kept.
+    :param def_totals:  dict, totals (modified in place)
+    :param def_counts:  dict, counts of one shard
+    """
+    for key, value in def_counts.items():
+        if isinstance(value, dict):
+            add_counts(
+                def_totals.setdefault(key, {}),
+                value,
+            )
+        elif key in PEAK_COUNTS:
+            def_totals[key] = max(def_totals.get(key, value), value)
+        else:
+            def_totals[key] = def_totals.get(key, 0) + value
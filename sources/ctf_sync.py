@@ -0,0 +1,505 @@
+"""
+Copies the files missing in target and the files differing from source to target, reusing the file index and
+the classification of the comparison (nothing is scanned or compared a second time).
+
+Every file is written to a temporary file next to the target and only moved into place once it is complete.
+The copy method is chosen per file:
+- reflink (FICLONE), if source and target are on a filesystem with shared extents (btrfs, XFS, ...)
+- with verification: one read of the source, hashed while it is written to target; the digest is compared to
+  the source digest of the comparison. Files the comparison did not hash (e.g. missing in target) have no such
+  digest, their copy is read back and hashed instead
+- without verification: os.copy_file_range, os.sendfile and finally read/write
+"""
+
+import os
+import shutil
+import time
+
+from ctf_functions import (
+    CHECK_BIT,
+    CHECK_HASH,
+    map_in_parallel,
+    new_hash,
+)
+from ctf_progress import format_bytes
+from ctf_report import (
+    ReportLogger,
+    print_report,
+    timestamp,
+)
+
+
+# ioctl request number of FICLONE (_IOW(0x94, 9, int)), Linux only
+FICLONE = 0x40049409
+
+# Number of bytes handed to the kernel per copy_file_range/sendfile call
+KERNEL_COPY_CHUNK_SIZE = 1073741824
+
+
+class CopyResult:
+    """
+    Outcome of one copied file
+    """
+
+    __slots__ = (
+        "file",
+        "method",
+        "size",
+        "digest",
+        "verified",
+        "error",
+        "bytes_saved",
+        "bytes_reused",
+    )
+
+    def __init__(
+        self,
+        def_file,
+        def_method=None,
+        def_size=0,
+        def_digest=None,
+        def_verified=None,
+        def_error=None,
+        def_bytes_saved=0,
+        def_bytes_reused=0,
+    ):
+        """
+        :param def_file:        str, path relative to the compared folders
+        :param def_method:      str, "reflink", "stream_hash", "copy_file_range", "sendfile", "read_write",
+                                "delta_in_place", "delta_rolling" (see ctf_repair) or "mtime" (only the
+                                modification time was set)
+        :param def_size:        int, number of bytes written to the target
+        :param def_digest:      bytes, digest of the copied data stream (None if not hashed)
+        :param def_verified:    bool, digest equals the source digest of the comparison or the digest of the
+                                copy read back (None: not verified)
+        :param def_error:       str, reason why the file was not copied (None if copied)
+        :param def_bytes_saved: int, bytes not written compared with a full copy (delta repair)
+        :param def_bytes_reused: int, bytes taken over from the target instead of read from the source (delta
+                                repair)
+        """
+        self.file = def_file
+        self.method = def_method
+        self.size = def_size
+        self.digest = def_digest
+        self.verified = def_verified
+        self.error = def_error
+        self.bytes_saved = def_bytes_saved
+        self.bytes_reused = def_bytes_reused
+
+
+def clone_file(
+    def_fd_source,
+    def_fd_target,
+):
+    """
+    Shares the extents of the source with the target (copy-on-write), no data is read or written.
+    :return:    bool, True if the filesystem supports reflinks between both files
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(def_fd_target, FICLONE, def_fd_source)
+    except OSError:
+        return False
+    return True
+
+
+def copy_stream_hashed(
+    def_fd_source,
+    def_fd_target,
+    def_hash_algorithm,
+    def_block_size=1048576,
+):
+    """
+    Copies the source to the target in blocks and hashes every block on its way.
+    :return:    int (number of bytes copied), bytes (digest of the copied data)
+    """
+    sha = new_hash(def_hash_algorithm)
+    buffer = memoryview(bytearray(def_block_size))
+    size = 0
+    while number_of_bytes := os.readv(def_fd_source, [buffer]):
+        block = buffer[:number_of_bytes]
+        sha.update(block)
+        while block:
+            block = block[os.write(def_fd_target, block) :]
+        size += number_of_bytes
+    return size, sha.digest()
+
+
+def hash_written(
+    def_fd,
+    def_hash_algorithm,
+    def_block_size=1048576,
+):
+    """
+    Reads a written file back from its start and hashes it.
+    :return:    bytes, digest
+    """
+    sha = new_hash(def_hash_algorithm)
+    offset = 0
+    while data := os.pread(def_fd, def_block_size, offset):
+        sha.update(data)
+        offset += len(data)
+    return sha.digest()
+
+
+def copy_kernel(
+    def_fd_source,
+    def_fd_target,
+    def_size,
+    def_block_size=1048576,
+):
+    """
+    Copies the source to the target inside the kernel (copy_file_range, then sendfile) and falls back to
+    read/write if neither is supported for this pair of files.
+    :param def_size:    int, size of the source
+    :return:            int (number of bytes copied), str (copy method)
+    """
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        size = 0
+        try:
+            while size < def_size:
+                count = min(def_size - size, KERNEL_COPY_CHUNK_SIZE)
+                if method == "copy_file_range":
+                    number_of_bytes = os.copy_file_range(
+                        def_fd_source,
+                        def_fd_target,
+                        count,
+                        size,
+                        size,
+                    )
+                else:
+                    number_of_bytes = os.sendfile(
+                        def_fd_target,
+                        def_fd_source,
+                        size,
+                        count,
+                    )
+                if not number_of_bytes:
+                    # Source got shorter since it was scanned
+                    break
+                size += number_of_bytes
+        except OSError:
+            # Not supported (e.g. across filesystems on older kernels): try the next method from the start
+            if size:
+                raise
+            continue
+        return size, method
+
+    os.lseek(def_fd_source, 0, os.SEEK_SET)
+    os.lseek(def_fd_target, 0, os.SEEK_SET)
+    size = 0
+    while data := os.read(def_fd_source, def_block_size):
+        while data:
+            number_of_bytes = os.write(def_fd_target, data)
+            data = data[number_of_bytes:]
+            size += number_of_bytes
+    return size, "read_write"
+
+
+def copy_file(
+    def_file,
+    def_file_source,
+    def_file_target,
+    def_hash_algorithm=None,
+    def_expected_digest=None,
+    def_block_size=1048576,
+):
+    """
+    Copies one file to a temporary file next to the target, takes over the modification time and permissions
+    of the source and moves it into place. If the copy fails or its digest does not match, the target is left
+    untouched.
+    :param def_file:                str, path relative to the compared folders
+    :param def_file_source:         str, path in source
+    :param def_file_target:         str, path in target (created or replaced)
+    :param def_hash_algorithm:      str, hash the data while copying (None: no verification, kernel copy)
+    :param def_expected_digest:     bytes, source digest of the comparison (None: not hashed by the comparison,
+                                    the hashed copy is read back and compared with the digest of the stream)
+    :param def_block_size:          int, read block size of the hashed and the read/write copy
+    :return:                        CopyResult
+    """
+    result = CopyResult(def_file)
+    folder_target, name_target = os.path.split(def_file_target)
+    file_temporary = os.path.join(folder_target, f".{name_target}.ctf-sync")
+    try:
+        os.makedirs(folder_target, exist_ok=True)
+        fd_source = os.open(def_file_source, os.O_RDONLY)
+        try:
+            fd_target = os.open(
+                file_temporary,
+                os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                0o600,
+            )
+            try:
+                size_source = os.fstat(fd_source).st_size
+                if clone_file(fd_source, fd_target):
+                    # Shared extents are identical by construction, there is no data stream to verify
+                    result.method = "reflink"
+                    result.size = size_source
+                elif def_hash_algorithm is not None:
+                    result.method = "stream_hash"
+                    result.size, result.digest = copy_stream_hashed(
+                        fd_source,
+                        fd_target,
+                        def_hash_algorithm,
+                        def_block_size,
+                    )
+                    if def_expected_digest is not None:
+                        result.verified = result.digest == def_expected_digest
+                        error = "digest of the copied data differs from the compared source"
+                    else:
+                        result.verified = result.digest == hash_written(
+                            fd_target,
+                            def_hash_algorithm,
+                            def_block_size,
+                        )
+                        error = "digest of the written copy differs from the copied data"
+                else:
+                    result.size, result.method = copy_kernel(
+                        fd_source,
+                        fd_target,
+                        size_source,
+                        def_block_size,
+                    )
+            finally:
+                os.close(fd_target)
+        finally:
+            os.close(fd_source)
+        if result.verified is False:
+            result.error = error
+            os.unlink(file_temporary)
+            return result
+        shutil.copystat(def_file_source, file_temporary)
+        os.replace(file_temporary, def_file_target)
+    except OSError as error:
+        result.error = str(error)
+        if os.path.exists(file_temporary):
+            os.unlink(file_temporary)
+    return result
+
+
+def update_mtime(
+    def_file,
+    def_file_source,
+    def_file_target,
+):
+    """
+    Sets the modification time of a target file whose content equals the source.
+    :return:    CopyResult
+    """
+    result = CopyResult(
+        def_file,
+        "mtime",
+    )
+    try:
+        file_source_stat = os.stat(def_file_source)
+        os.utime(
+            def_file_target,
+            ns=(file_source_stat.st_atime_ns, file_source_stat.st_mtime_ns),
+        )
+    except OSError as error:
+        result.error = str(error)
+    return result
+
+
+def sync_to_target(
+    def_folder_source,
+    def_folder_target,
+    def_files_missing_target,
+    def_files_only_mtime_difference,
+    def_files_any_difference_but_mtime,
+    def_hash_algorithm,
+    def_verify=True,
+    def_verbose=None,
+    def_workers=1,
+    def_block_size=1048576,
+    def_repair=False,
+    def_repair_min_size=67108864,
+):
+    """
+    Brings the target in line with the source for the files classified by the comparison. Files missing in
+    target and differing files are copied, files where only the mtime differs get the mtime of the source.
+    Files missing in source are left alone (nothing is deleted). With several option strings the classification
+    of their union is used.
+    :param def_files_missing_target:            dict, relative path -> path in target
+    :param def_files_only_mtime_difference:     dict, relative path -> ComparisonResult
+    :param def_files_any_difference_but_mtime:  dict, relative path -> ComparisonResult
+    :param def_verify:                          bool, hash the data while copying and compare it with the
+                                                source digest of the comparison (files the comparison did not
+                                                hash, e.g. missing in target: with the digest of the copy read
+                                                back)
+    :param def_block_size:                      int, read block size of the copies
+    :param def_repair:                          bool, differing files from def_repair_min_size on are
+                                                repaired by writing only the differing data (see ctf_repair)
+    :return:                                    dict, counts of the synchronisation
+    """
+    if def_verbose is None:
+        def_verbose = {
+            "general": True,
+            "details": True,
+        }
+    logger = ReportLogger(def_verbose)
+
+    # Only the mtime is set if the content was compared, otherwise "only the mtime differs" may hide a
+    # content difference (e.g. options "ST") and the file is copied
+    files_mtime = []
+    files_differing = dict(def_files_any_difference_but_mtime)
+    for file, results in def_files_only_mtime_difference.items():
+        if results.checked & (CHECK_HASH | CHECK_BIT):
+            files_mtime.append(file)
+        else:
+            files_differing[file] = results
+
+    # (relative path, source digest of the comparison or None)
+    files_to_be_copied = [(file, None) for file in sorted(def_files_missing_target)]
+    files_to_be_copied += [
+        (file, results.source_digest if results.checked & CHECK_HASH else None)
+        for file, results in sorted(files_differing.items())
+    ]
+
+    def sync_file(def_item):
+        file, expected_digest = def_item
+        if (
+            def_repair
+            and file in files_differing
+            and files_differing[file].source_size >= def_repair_min_size
+        ):
+            from ctf_repair import repair_file
+
+            return repair_file(
+                file,
+                os.path.join(def_folder_source, file),
+                os.path.join(def_folder_target, file),
+                def_hash_algorithm,
+                expected_digest,
+                def_verify,
+            )
+        return copy_file(
+            file,
+            os.path.join(def_folder_source, file),
+            os.path.join(def_folder_target, file),
+            def_hash_algorithm if def_verify else None,
+            expected_digest,
+            def_block_size,
+        )
+
+    print_report(
+        f"{timestamp()}: "
+        f"BEGIN:     Synchronisation to target"
+    )
+    print_report(
+        f"{timestamp()}: "
+        f"-> Number of files to be copied: '{len(files_to_be_copied)}'"
+    )
+    print_report()
+
+    time_started = time.monotonic()
+    return_data = {
+        "files_copied": 0,
+        "files_mtime_updated": 0,
+        "files_failed": 0,
+        "bytes_copied": 0,
+        "bytes_saved": 0,
+        "bytes_reused": 0,
+        "copy_methods": {},
+    }
+    for result in map_in_parallel(
+        sync_file,
+        files_to_be_copied,
+        def_workers,
+    ):
+        if result.error is not None:
+            return_data["files_failed"] += 1
+            print_report(
+                f"{timestamp()}: "
+                f"ERROR:     Copy failed:            '{result.file}'"
+            )
+            print_report(f"                     -> {result.error}")
+            continue
+        return_data["files_copied"] += 1
+        return_data["bytes_copied"] += result.size
+        return_data["bytes_saved"] += result.bytes_saved
+        return_data["bytes_reused"] += result.bytes_reused
+        return_data["copy_methods"][result.method] = (
+            return_data["copy_methods"].get(result.method, 0) + 1
+        )
+        logger.log_time(
+            "general",
+            "COPY:      Copied to target:       '{}' ('{}', '{}')",
+            result.file,
+            format_bytes(result.size),
+            result.method,
+        )
+        if result.bytes_saved:
+            logger.log(
+                "details",
+                "                     -> Not written compared with a full copy: '{}'",
+                format_bytes(result.bytes_saved),
+            )
+        if result.bytes_reused:
+            logger.log(
+                "details",
+                "                     -> Reused from target instead of copied from source: '{}'",
+                format_bytes(result.bytes_reused),
+            )
+        if result.digest is not None:
+            logger.log(
+                "details",
+                "                     -> Digest: '{}' (verified: '{}')",
+                result.digest.hex(),
+                "not verified" if result.verified is None else result.verified,
+            )
+
+    for file in sorted(files_mtime):
+        result = update_mtime(
+            file,
+            os.path.join(def_folder_source, file),
+            os.path.join(def_folder_target, file),
+        )
+        if result.error is not None:
+            return_data["files_failed"] += 1
+            print_report(
+                f"{timestamp()}: "
+                f"ERROR:     Setting mtime failed:   '{file}'"
+            )
+            print_report(f"                     -> {result.error}")
+            continue
+        return_data["files_mtime_updated"] += 1
+        logger.log_time(
+            "general",
+            "COPY:      Set mtime in target:    '{}'",
+            file,
+        )
+
+    elapsed_seconds = time.monotonic() - time_started
+    print_report()
+    print_report(
+        f"{timestamp()}: "
+        f"SYNC:      Files copied: '{return_data['files_copied']}' "
+        f"('{format_bytes(return_data['bytes_copied'])}', "
+        f"'{return_data['bytes_copied'] / 1048576 / max(elapsed_seconds, 1e-9):.1f}' MB/s), "
+        f"mtime set: '{return_data['files_mtime_updated']}', "
+        f"failed: '{return_data['files_failed']}'"
+    )
+    if return_data["bytes_saved"]:
+        print_report(
+            f"                     -> Not written thanks to delta repair: "
+            f"'{format_bytes(return_data['bytes_saved'])}' compared with full copies"
+        )
+    if return_data["bytes_reused"]:
+        print_report(
+            f"                     -> Reused from target by delta repair: "
+            f"'{format_bytes(return_data['bytes_reused'])}' (not copied from source)"
+        )
+    for method, count in sorted(return_data["copy_methods"].items()):
+        print_report(f"                     -> {method}: '{count}'")
+    print_report(
+        f"{timestamp()}: "
+        f"END:       Synchronisation to target"
+    )
+    print_report()
+    return return_data
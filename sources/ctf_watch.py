@@ -0,0 +1,489 @@
+"""
+Watch mode (Linux): one full comparison of two folders, then the classification of every file is kept up to date
+from inotify events of both trees. Only the files and directories touched since the last update are scanned and
+compared again, the changes are reported a few seconds (see settle time) after they happened.
+
+inotify is used through ctypes from the C library, no other package or service is needed. Every directory of
+both trees takes one watch, the number of watches of a user is limited by /proc/sys/fs/inotify/max_user_watches.
+If the kernel drops events (queue overflow), both trees are scanned again completely.
+
+Watching two folders:
+./compare_two_folders.py watch SOURCE TARGET [--options STHB] [--settle 2] [--output changes.jsonl]
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from ctf_functions import (
+    CATEGORY_NAMES,
+    classify_outcome,
+    compare_files,
+    create_file_dict,
+    map_in_parallel,
+)
+from ctf_report import ReportLogger
+
+
+# Events and flags of <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+# Events of the parent directory of a removed root: the root is created (or moved) again
+PARENT_WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR | IN_MASK_ADD
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+
+# Classification of a file present on one side only
+MISSING_IN_SOURCE = "missing_in_source"
+MISSING_IN_TARGET = "missing_in_target"
+
+CLASSIFICATIONS = (
+    "pass",
+    MISSING_IN_SOURCE,
+    MISSING_IN_TARGET,
+    "only_mtime_difference",
+    "any_difference_but_mtime",
+)
+
+
+class Inotify:
+    """
+    inotify instance of the C library (ctypes). The events are read without blocking, after select.
+    """
+
+    def __init__(self):
+        if not hasattr(select, "select") or not os.path.exists("/proc/sys/fs/inotify"):
+            raise OSError(errno.ENOSYS, "inotify is not available (Linux only)")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.inotify_add_watch.restype = ctypes.c_int
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        # Watch descriptor -> watched directory
+        self.watches = {}
+
+    def add_watch(
+        self,
+        def_path,
+        def_mask=WATCH_MASK,
+    ):
+        """
+        :param def_path:    str, directory to watch (not recursive)
+        :param def_mask:    int, events to watch
+        :return:            int, watch descriptor (None: the directory does not exist (anymore))
+        """
+        wd = self.inotify_add_watch(self.fd, os.fsencode(def_path), def_mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached, raise fs.inotify.max_user_watches", def_path)
+            raise OSError(error, f"inotify_add_watch: {os.strerror(error)}", def_path)
+        self.watches[wd] = def_path
+        return wd
+
+    def add_watches(self, def_folder):
+        """
+        Watches a directory and all directories below it.
+        """
+        for root, _, _ in os.walk(def_folder):
+            self.add_watch(root)
+
+    def read_events(self, def_timeout=None):
+        """
+        :param def_timeout:     float, seconds to wait for events (None: until there are events)
+        :return:                list, (watched directory, mask, name) of the events; the directory is None for
+                                an overflow of the event queue
+        """
+        readable, _, _ = select.select([self.fd], [], [], def_timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_IGNORED:
+                    # The directory was removed (or unmounted), its watch is gone
+                    self.watches.pop(wd, None)
+                    continue
+                events.append((self.watches.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatch:
+    """
+    Classification of the files of two folders, kept up to date from inotify events.
+    """
+
+    def __init__(
+        self,
+        def_folder_source,
+        def_folder_target,
+        def_hash_algorithm,
+        def_exclude_files=None,
+        def_exclude_extensions=None,
+        def_options="STHB",
+        def_verbose=None,
+        def_workers=1,
+        def_block_size=4096,
+        def_settle=2.0,
+        def_structured_writer=None,
+    ):
+        """
+        :param def_settle:              float, seconds without events before the touched files are compared
+                                        (a file written continuously is compared after 5 times this at the latest)
+        :param def_structured_writer:   StructuredReportWriter, a record is written for every changed
+                                        classification ("removed": the file is gone from both folders)
+        """
+        self.folder_source = os.path.abspath(def_folder_source)
+        self.folder_target = os.path.abspath(def_folder_target)
+        self.hash_algorithm = def_hash_algorithm
+        self.exclude_files = def_exclude_files or []
+        self.exclude_extensions = def_exclude_extensions or []
+        self.options = def_options
+        self.logger = ReportLogger(
+            def_verbose
+            or {
+                "general": True,
+                "files-pass": True,
+                "details": True,
+                "summary": True,
+            }
+        )
+        self.workers = def_workers
+        self.block_size = def_block_size
+        self.settle = def_settle
+        self.structured_writer = def_structured_writer
+        self.inotify = Inotify()
+        # Relative path -> classification
+        self.classification = {}
+        self.dirty_files = set()
+        self.dirty_folders = set()
+        self.rescan = False
+        self.time_first_event = None
+        self.time_last_event = None
+
+    def relative_path(
+        self,
+        def_folder,
+        def_name,
+    ):
+        """
+        :return:    str, path of an entry of a watched directory relative to its tree (None: not in a tree)
+        """
+        for root in (self.folder_source, self.folder_target):
+            if def_folder == root:
+                return def_name
+            if def_folder.startswith(root + os.sep):
+                return os.path.join(def_folder[len(root) + 1 :], def_name)
+        return None
+
+    def excluded(self, def_name):
+        return def_name in self.exclude_files or (
+            self.exclude_extensions and os.path.splitext(def_name)[1].lower() in self.exclude_extensions
+        )
+
+    def start(self):
+        """
+        Watches both trees and compares them completely.
+        """
+        # Watched before the scan, changes made during the scan are compared again afterwards
+        self.inotify.add_watches(self.folder_source)
+        self.inotify.add_watches(self.folder_target)
+        self.logger.log_time(
+            "general",
+            "WATCH:     Watching '{}' directories of '{}' and '{}'",
+            len(self.inotify.watches),
+            self.folder_source,
+            self.folder_target,
+        )
+        self.compare_all()
+
+    def compare_all(self):
+        files_source, _ = create_file_dict(
+            self.folder_source,
+            self.exclude_files,
+            self.exclude_extensions,
+        )
+        files_target, _ = create_file_dict(
+            self.folder_target,
+            self.exclude_files,
+            self.exclude_extensions,
+        )
+        files = set(files_source) | set(files_target) | set(self.classification)
+        time_started = time.monotonic()
+        changes = self.update(files)
+        self.logger.log_time(
+            "general",
+            "WATCH:     Compared '{}' files in '{:.3f}' s ('{}' changed)",
+            len(files),
+            time.monotonic() - time_started,
+            changes,
+        )
+        self.log_counts()
+
+    def classify(self, def_file):
+        """
+        :param def_file:    str, relative path
+        :return:            str, relative path, str, classification (None: in neither folder), ComparisonResult
+                            (None: not compared)
+        """
+        file_source = os.path.join(self.folder_source, def_file)
+        file_target = os.path.join(self.folder_target, def_file)
+        in_source = os.path.isfile(file_source)
+        in_target = os.path.isfile(file_target)
+        if in_source and in_target:
+            try:
+                results = compare_files(
+                    file_source,
+                    file_target,
+                    self.hash_algorithm,
+                    self.options,
+                    self.block_size,
+                )
+            except OSError:
+                # Removed or replaced while being compared, the event of that change follows
+                return def_file, self.classification.get(def_file), None
+            return def_file, CATEGORY_NAMES[classify_outcome(results.checked, results.passed)], results
+        if in_source:
+            return def_file, MISSING_IN_TARGET, None
+        if in_target:
+            return def_file, MISSING_IN_SOURCE, None
+        return def_file, None, None
+
+    def update(self, def_files):
+        """
+        Classifies the files again and reports the changed classifications.
+        :param def_files:   iterable, relative paths
+        :return:            int, number of changed classifications
+        """
+        changes = 0
+        for file, classification, results in map_in_parallel(
+            self.classify,
+            sorted(def_files),
+            self.workers,
+        ):
+            classification_old = self.classification.get(file)
+            if classification == classification_old:
+                continue
+            changes += 1
+            if classification is None:
+                del self.classification[file]
+            else:
+                self.classification[file] = classification
+            # The initial classification of passing files is only reported with "files-pass"
+            category = "files-pass" if classification_old is None and classification == "pass" else "general"
+            self.logger.log_time(
+                category,
+                "WATCH:     '{}': '{}' -> '{}'",
+                file,
+                classification_old or "new",
+                classification or "removed",
+            )
+            if self.structured_writer is not None:
+                self.structured_writer.write_file_record(
+                    self.options,
+                    classification or "removed",
+                    file,
+                    os.path.join(self.folder_source, file) if classification != MISSING_IN_SOURCE else None,
+                    os.path.join(self.folder_target, file) if classification != MISSING_IN_TARGET else None,
+                    results,
+                )
+        return changes
+
+    def counts(self):
+        """
+        :return:    dict, classification -> number of files
+        """
+        counter = collections.Counter(self.classification.values())
+        return {classification: counter[classification] for classification in CLASSIFICATIONS}
+
+    def log_counts(self):
+        counts = self.counts()
+        self.logger.log_time(
+            "summary",
+            "WATCH:     Pass '{}', missing in source '{}', missing in target '{}', only mtime differs '{}', "
+            "other differences '{}'",
+            counts["pass"],
+            counts[MISSING_IN_SOURCE],
+            counts[MISSING_IN_TARGET],
+            counts["only_mtime_difference"],
+            counts["any_difference_but_mtime"],
+        )
+
+    def handle_events(self, def_events):
+        for folder, mask, name in def_events:
+            if folder is None or mask & IN_Q_OVERFLOW:
+                self.rescan = True
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if folder in (self.folder_source, self.folder_target):
+                    # A watched root is gone, the files below it are classified as missing. Its parent is
+                    # watched to notice when it is created again.
+                    self.rescan = True
+                    self.inotify.add_watch(
+                        os.path.dirname(folder),
+                        PARENT_WATCH_MASK,
+                    )
+                continue
+            if mask & IN_ISDIR and os.path.join(folder, name) in (self.folder_source, self.folder_target):
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # A root is there again, it is watched again by the rescan
+                    self.rescan = True
+                continue
+            if not name or (not mask & IN_ISDIR and self.excluded(name)):
+                continue
+            file = self.relative_path(folder, name)
+            if file is None:
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files created before the watch of the new directory are found by scanning it
+                    self.inotify.add_watches(os.path.join(folder, name))
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    self.dirty_folders.add(file)
+            else:
+                self.dirty_files.add(file)
+
+    def files_below(self, def_folder):
+        """
+        :return:    set, relative paths of the known and the present files below a directory (both trees)
+        """
+        files = set()
+        prefix = def_folder + os.sep
+        for file in self.classification:
+            if file.startswith(prefix):
+                files.add(file)
+        for root in (self.folder_source, self.folder_target):
+            if os.path.isdir(os.path.join(root, def_folder)):
+                files_folder, _ = create_file_dict(
+                    os.path.join(root, def_folder),
+                    self.exclude_files,
+                    self.exclude_extensions,
+                )
+                files.update(os.path.join(def_folder, file) for file in files_folder)
+        return files
+
+    def process(self):
+        """
+        Compares the files touched since the last update.
+        """
+        time_started = time.monotonic()
+        if self.rescan:
+            self.logger.log_time(
+                "general",
+                "WARNING:   Events were lost or a watched folder was moved, comparing all files",
+            )
+            self.rescan = False
+            self.dirty_files.clear()
+            self.dirty_folders.clear()
+            # A root which was removed and created again has lost its watches
+            self.inotify.add_watches(self.folder_source)
+            self.inotify.add_watches(self.folder_target)
+            self.compare_all()
+            return
+        files = self.dirty_files
+        for folder in self.dirty_folders:
+            files |= self.files_below(folder)
+        self.dirty_files = set()
+        self.dirty_folders = set()
+        changes = self.update(files)
+        if changes:
+            self.logger.log_time(
+                "general",
+                "WATCH:     Compared '{}' touched files in '{:.3f}' s ('{}' changed)",
+                len(files),
+                time.monotonic() - time_started,
+                changes,
+            )
+            self.log_counts()
+
+    def run(self, def_duration=None):
+        """
+        Processes events until interrupted (or for def_duration seconds).
+        :param def_duration:    float, seconds to watch (None: until interrupted)
+        """
+        time_end = None if def_duration is None else time.monotonic() + def_duration
+        try:
+            while True:
+                time_now = time.monotonic()
+                if time_end is not None and time_now >= time_end:
+                    break
+                pending = self.dirty_files or self.dirty_folders or self.rescan
+                if pending and (
+                    time_now - self.time_last_event >= self.settle
+                    or time_now - self.time_first_event >= 5 * self.settle
+                ):
+                    self.process()
+                    self.time_first_event = None
+                    continue
+                timeout = None
+                if pending:
+                    timeout = self.settle - (time_now - self.time_last_event)
+                if time_end is not None:
+                    timeout = time_end - time_now if timeout is None else min(timeout, time_end - time_now)
+                events = self.inotify.read_events(timeout)
+                if events:
+                    self.handle_events(events)
+                    self.time_last_event = time.monotonic()
+                    if self.time_first_event is None:
+                        self.time_first_event = self.time_last_event
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.inotify.close()
+        self.logger.log_time(
+            "general",
+            "WATCH:     Stopped",
+        )
+        self.log_counts()
+        return self.counts()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the tool are not installed, they are imported from sources/ (as compare_two_folders.py does)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sources"))
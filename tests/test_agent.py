@@ -0,0 +1,81 @@
+import os
+import socket
+import threading
+
+import pytest
+
+import compare_two_folders
+from ctf_agent import (
+    AgentClient,
+    AgentServer,
+)
+
+
+def create_folder(def_folder, def_files):
+    for file, data in def_files.items():
+        path = os.path.join(def_folder, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, ns=(1600000000 * 10**9, 1600000000 * 10**9))
+
+
+@pytest.fixture
+def agent(tmp_path):
+    """
+    :return:    str, folder served by the agent, str, URL of the agent
+    """
+    folder = tmp_path / "target"
+    folder.mkdir()
+    server = AgentServer(str(folder), "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield str(folder), f"agent://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_compare_against_agent(tmp_path, agent):
+    folder_target, url = agent
+    files = {"a.txt": b"a" * 3000000, "sub/b.txt": b"b", "sub/c.txt": b"c"}
+    create_folder(str(tmp_path / "source"), files)
+    create_folder(folder_target, dict(files, **{"sub/c.txt": b"x", "d.txt": b"d"}))
+    # A symbolic link to a file outside of the folder is listed and hashed like a file
+    create_folder(str(tmp_path / "outside"), {"e.txt": b"e"})
+    create_folder(str(tmp_path / "source"), {"e.txt": b"e"})
+    os.symlink(str(tmp_path / "outside" / "e.txt"), os.path.join(folder_target, "e.txt"))
+    os.utime(os.path.join(folder_target, "e.txt"), ns=(1600000000 * 10**9, 1600000000 * 10**9))
+
+    for options in ("STH", "STHB"):
+        return_data = compare_two_folders.compare_folders(
+            str(tmp_path / "source"),
+            url,
+            "sha256",
+            def_options=options,
+            def_progress_interval=0,
+        )
+        assert return_data["files_pass"] == 3
+        assert return_data["files_any_difference_but_mtime"] == 1
+        assert return_data["files_missing_in_source"] == 1
+        assert return_data["files_missing_in_target"] == 0
+
+
+def test_agent_rejects_paths_outside(tmp_path, agent):
+    folder_target, url = agent
+    create_folder(str(tmp_path), {"secret.txt": b"s"})
+    os.symlink(str(tmp_path), os.path.join(folder_target, "link"))
+    client = AgentClient("127.0.0.1", int(url.rpartition(":")[2]))
+    for file in ("../secret.txt", "link/secret.txt", str(tmp_path / "secret.txt")):
+        with pytest.raises(OSError, match="outside of the folder"):
+            client.call({"command": "hash", "file": file, "algorithm": "sha256"})
+
+
+def test_client_timeout():
+    # The peer accepts the connection but never answers
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        client = AgentClient("127.0.0.1", listener.getsockname()[1], 0.2)
+        with pytest.raises(TimeoutError):
+            client.call({"command": "list"})
+        assert client.local.connection is None
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+import ctf_api
+import ctf_functions
+from ctf_api import (
+    FolderComparison,
+    compare_folders_summary,
+    iter_compare_folders,
+)
+
+
+def create_folder(def_folder, def_files):
+    for file, data in def_files.items():
+        path = os.path.join(def_folder, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, ns=(1600000000 * 10**9, 1600000000 * 10**9))
+
+
+@pytest.fixture
+def folders(tmp_path):
+    source = str(tmp_path / "source")
+    target = str(tmp_path / "target")
+    files = {f"file{index}.txt": b"x" * index for index in range(20)}
+    create_folder(source, dict(files, **{"only_source.txt": b"s"}))
+    create_folder(target, dict(files, **{"file3.txt": b"yyy", "sub/only_target.txt": b"t"}))
+    # Same content, other mtime
+    os.utime(os.path.join(target, "file5.txt"), ns=(1700000000 * 10**9, 1700000000 * 10**9))
+    return source, target
+
+
+def test_summary(folders):
+    summary = compare_folders_summary(*folders, def_hash_algorithm="sha256", def_workers=2)
+    assert summary.complete
+    assert summary.as_dict() == {
+        "files_pass": 18,
+        "files_missing_in_source": 1,
+        "files_missing_in_target": 1,
+        "files_only_mtime_difference": 1,
+        "files_any_difference_but_mtime": 1,
+        "files_source_size": sum(range(20)) + 1,
+        "files_target_size": sum(range(20)) + 1,
+    }
+
+
+def test_file_results(folders):
+    comparison = FolderComparison(*folders, def_hash_algorithm="sha256")
+    results = {file_result.file: file_result for file_result in comparison}
+    assert results["sub/only_target.txt"].category == "missing_in_source"
+    assert results["only_source.txt"].file_target is None
+    assert results["file3.txt"].category == "any_difference_but_mtime"
+    assert results["file5.txt"].category == "only_mtime_difference"
+    assert [check["details"] for check in results["file1.txt"].as_dict()["checks"]] == [
+        "file_size",
+        "file_mtime",
+        "file_hash",
+        "file_bit",
+    ]
+    assert comparison.summary.complete
+
+
+def test_early_stop(folders, monkeypatch):
+    compare_files = ctf_functions.compare_files
+    compared = []
+
+    def compare_files_counting(def_file_source, *args, **kwargs):
+        compared.append(def_file_source)
+        return compare_files(def_file_source, *args, **kwargs)
+
+    monkeypatch.setattr(ctf_functions, "compare_files", compare_files_counting)
+    with FolderComparison(*folders, def_hash_algorithm="sha256") as comparison:
+        for file_result in comparison:
+            if file_result.results is not None:
+                break
+    # The missing files come first, then one compared file
+    assert not comparison.summary.complete
+    assert sum(comparison.summary.counts.values()) == 3
+    # The files after the stop are not compared
+    assert len(compared) < 20
+    with pytest.raises(StopIteration):
+        next(comparison)
+
+
+@pytest.mark.parametrize("missing", ["source", "target"])
+def test_missing_folder_checked_once(folders, monkeypatch, missing):
+    source, target = folders
+    calls = []
+    check_folder = ctf_api.check_folder
+
+    def check_folder_counting(def_folder):
+        calls.append(def_folder)
+        check_folder(def_folder)
+
+    monkeypatch.setattr(ctf_api, "check_folder", check_folder_counting)
+    list(FolderComparison(source, target, def_hash_algorithm="sha256"))
+    assert calls == [source, target]
+
+    # Raised when called, before iterating
+    with pytest.raises(FileNotFoundError):
+        if missing == "source":
+            iter_compare_folders(source + "_missing", target)
+        else:
+            FolderComparison(source, target + "_missing")
+    with pytest.raises(NotADirectoryError):
+        iter_compare_folders(source, os.path.join(target, "file1.txt"))
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from ctf_cli import (
+    apply_config_profile,
+    build_parser,
+    main,
+)
+
+
+def parse(def_argv):
+    parser = build_parser()
+    args = parser.parse_args(def_argv)
+    apply_config_profile(
+        parser,
+        args,
+    )
+    return args
+
+
+def write_config(def_path):
+    with open(def_path, "w") as f:
+        f.write("[DEFAULT]\nexclude_files = .DS_Store, Thumbs.db\nworkers = 2\n\n[fast]\nblock_size = 1M\n")
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["compare", "a", "b"],
+        ["manifest", "a", "a.manifest"],
+        ["replicas", "a", "b", "c"],
+        ["watch", "a", "b"],
+    ],
+)
+def test_defaults(argv):
+    args = parse(argv)
+    assert args.exclude_files == [".DS_Store"]
+    assert args.exclude_extensions == []
+    assert args.algorithm == "blake3"
+    assert args.workers == 1
+    assert args.block_size == 4096
+
+
+def test_command_line_replaces_default_exclusion():
+    args = parse(["manifest", "a", "a.manifest", "--exclude-file", "Thumbs.db"])
+    assert args.exclude_files == ["Thumbs.db"]
+
+
+def test_watch_verbose_default():
+    assert parse(["watch", "a", "b"]).verbose == ["general", "summary"]
+    assert parse(["watch", "a", "b", "-q"]).verbose == []
+
+
+@pytest.mark.parametrize("command", [["compare", "a", "b"], ["manifest", "a", "a.manifest"], ["replicas", "a", "b"]])
+def test_config_profile(tmp_path, command):
+    config = str(tmp_path / "ctf.ini")
+    write_config(config)
+    args = parse(command + ["--config", config, "--config-profile", "fast", "-j", "3"])
+    assert args.exclude_files == [".DS_Store", "Thumbs.db"]
+    assert args.block_size == 1048576
+    # The command line takes precedence over the profile
+    assert args.workers == 3
+
+
+def test_config_profile_not_found(tmp_path):
+    config = str(tmp_path / "ctf.ini")
+    write_config(config)
+    with pytest.raises(SystemExit):
+        parse(["compare", "a", "b", "--config", config, "--config-profile", "slow"])
+
+
+def test_config_profile_and_profiler():
+    args = parse(["compare", "a", "b", "--profiler", "sampling"])
+    assert args.profiler == "sampling"
+    assert args.config_profile is None
+    with pytest.raises(SystemExit):
+        parse(["compare", "a", "b", "--profile", "fast"])
+
+
+def test_manifest_no_hash(tmp_path, capsys):
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    (folder / "a.txt").write_bytes(b"a")
+    (folder / ".DS_Store").write_bytes(b"x")
+    manifest = str(tmp_path / "folder.manifest")
+
+    assert main(["manifest", str(folder), manifest, "--no-hash"]) == 0
+    with open(manifest, encoding="utf-8") as f:
+        lines = [line for line in f if not line.startswith("#")]
+    assert len(lines) == 1
+    assert lines[0].startswith("a.txt\t")
+
+
+def test_compare(tmp_path, capsys):
+    for folder in ("source", "target"):
+        os.makedirs(str(tmp_path / folder))
+        with open(str(tmp_path / folder / "a.txt"), "wb") as f:
+            f.write(b"a")
+    (tmp_path / "source" / "b.txt").write_bytes(b"b")
+
+    assert main(["compare", str(tmp_path / "source"), str(tmp_path / "target"), "-q"]) == 0
+    with pytest.raises(SystemExit):
+        main(["compare", str(tmp_path / "source"), str(tmp_path / "missing")])
@@ -0,0 +1,110 @@
+import io
+import itertools
+import json
+import os
+import sys
+
+import pytest
+
+import compare_two_folders
+from ctf_functions import (
+    ALL_CHECKS,
+    classify_outcome,
+    classify_outcomes,
+)
+from ctf_report import StructuredReportWriter
+
+
+OPTIONS_LIST = ["S", "ST", "SH", "STHB"]
+
+
+def create_folders(def_folder):
+    """
+    Creates a source and a target whose files differ in size, mtime or content only.
+    :return:    str (source), str (target)
+    """
+    source = os.path.join(def_folder, "source")
+    target = os.path.join(def_folder, "target")
+    files = {
+        "pass.txt": (b"same", b"same", 0),
+        "mtime.txt": (b"same", b"same", 1),
+        "content.txt": (b"abcd", b"abce", 0),
+        "content_mtime.txt": (b"abcd", b"abce", 1),
+        "size.txt": (b"abc", b"abcd", 0),
+        "sub/only_source.txt": (b"s", None, 0),
+        "sub/only_target.txt": (None, b"t", 0),
+    }
+    for file, (data_source, data_target, mtime_delta) in files.items():
+        for folder, data, delta in ((source, data_source, 0), (target, data_target, mtime_delta)):
+            if data is None:
+                continue
+            path = os.path.join(folder, file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            mtime_ns = 1600000000 * 10**9 + delta * 10**9
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+    return source, target
+
+
+def file_records(def_stream):
+    """
+    :return:    dict, options -> list of the file records (without the time), sorted by file
+    """
+    records = {}
+    for line in def_stream.getvalue().splitlines():
+        record = json.loads(line)
+        if record["record"] == "file":
+            del record["time"]
+            records.setdefault(record["options"], []).append(record)
+    return {options: sorted(records, key=lambda record: record["file"]) for options, records in records.items()}
+
+
+def test_multi_options_match_single_runs(tmp_path):
+    source, target = create_folders(str(tmp_path))
+    stream = io.StringIO()
+    return_data_per_options = compare_two_folders.compare_folders_multi_options(
+        source,
+        target,
+        "sha256",
+        def_options_list=OPTIONS_LIST,
+        def_structured_writer=StructuredReportWriter(stream),
+        def_progress_interval=0,
+    )
+    records = file_records(stream)
+
+    for options in OPTIONS_LIST:
+        stream_single = io.StringIO()
+        return_data = compare_two_folders.compare_folders(
+            source,
+            target,
+            "sha256",
+            def_options=options,
+            def_structured_writer=StructuredReportWriter(stream_single),
+            def_progress_interval=0,
+        )
+        for key, value in return_data.items():
+            if key not in ("phases", "process", "latency"):
+                assert return_data_per_options[options][key] == value, (options, key)
+        assert records[options] == file_records(stream_single)[options]
+
+    assert return_data_per_options["S"]["files_pass"] == 4
+    assert return_data_per_options["ST"]["files_only_mtime_difference"] == 2
+    assert return_data_per_options["STHB"]["files_any_difference_but_mtime"] == 3
+
+
+def test_classify_outcomes_backends_agree(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    masks = list(itertools.product(range(ALL_CHECKS + 1), repeat=2))
+    checked = [mask[0] for mask in masks]
+    passed = [mask[1] & mask[0] for mask in masks]
+
+    categories_numpy = classify_outcomes(checked, passed)
+    assert isinstance(categories_numpy, numpy.ndarray)
+    # "import numpy" raises ImportError
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    categories_python = classify_outcomes(checked, passed)
+    assert isinstance(categories_python, list)
+
+    assert categories_numpy.tolist() == categories_python
+    assert categories_python == [classify_outcome(*mask) for mask in zip(checked, passed)]
@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from ctf_manifest import (
+    check_manifest,
+    merge_manifests,
+    open_manifest,
+    scan_entries,
+    write_binary_manifest,
+    write_manifest,
+)
+
+
+# Names which collide with the syntax of the text format
+SPECIAL_NAMES = (
+    "# x: y",
+    "#hash",
+    "a\rb",
+    "tab\tname",
+    "new\nline",
+    "back\\slash",
+    "plain.txt",
+    os.fsdecode(b"bad\xff.txt"),
+)
+
+
+def create_tree(def_folder, def_names):
+    for index, name in enumerate(def_names):
+        with open(os.path.join(os.fsencode(def_folder), os.fsencode(name)), "wb") as f:
+            f.write(b"x" * index)
+
+
+def test_text_manifest_round_trip(tmp_path):
+    folder = tmp_path / "folder"
+    (folder / "# sub").mkdir(parents=True)
+    create_tree(str(folder), SPECIAL_NAMES)
+    create_tree(str(folder / "# sub"), ("# y: z",))
+    output = str(tmp_path / "folder.ctfm")
+
+    entries = scan_entries(str(folder), "sha256")
+    write_manifest(output, entries, "sha256", str(folder))
+    manifest = open_manifest(output)
+
+    assert len(entries) == len(SPECIAL_NAMES) + 1
+    assert list(manifest) == entries
+    assert manifest.header.keys() == {"algorithm", "folder", "files", "size"}
+    assert manifest.algorithm == "sha256"
+    assert manifest.folder == str(folder)
+    assert manifest.number_of_files == len(entries)
+    files, size = manifest.create_file_dict()
+    assert sorted(files) == sorted(entry[0] for entry in entries)
+    assert size == sum(entry[1] for entry in entries)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "lzma"])
+def test_binary_manifest_round_trip(tmp_path, compression):
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    create_tree(str(folder), SPECIAL_NAMES)
+    output = str(tmp_path / "folder.ctfb")
+
+    entries = scan_entries(str(folder), "sha256")
+    write_binary_manifest(output, entries, "sha256", str(folder), compression)
+    manifest = open_manifest(output)
+    try:
+        assert list(manifest) == entries
+        assert manifest.algorithm == "sha256"
+        assert manifest.folder == str(folder)
+        for entry in entries:
+            assert manifest.find(entry[0]) == entry
+        assert manifest.find("not there") is None
+    finally:
+        manifest.close()
+
+
+def test_merge_text_and_binary_manifest(tmp_path):
+    # In str order "é" comes before "\udc80x", in UTF-8 byte order after it
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    create_tree(str(folder), ("é", os.fsdecode(b"\x80x"), "z"))
+    output_text = str(tmp_path / "folder.ctfm")
+    output_binary = str(tmp_path / "folder.ctfb")
+    entries = scan_entries(str(folder), "sha256")
+    write_manifest(output_text, entries, "sha256", str(folder))
+    write_binary_manifest(output_binary, entries, "sha256", str(folder))
+
+    manifest_text = open_manifest(output_text)
+    manifest_binary = open_manifest(output_binary)
+    try:
+        assert list(manifest_text) == list(manifest_binary)
+        for manifest_source, manifest_target in (
+            (manifest_text, manifest_binary),
+            (manifest_binary, manifest_text),
+        ):
+            merged = list(merge_manifests(manifest_source, manifest_target))
+            assert [file for file, _, _ in merged] == [entry[0] for entry in entries]
+            assert all(
+                entry_source == entry_target
+                for _, entry_source, entry_target in merged
+            )
+    finally:
+        manifest_binary.close()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"a.txt\t1\t2\t-\n",
+        b"# ctf-manifest x\n",
+        b"CTFMANIF",
+        b"CTFMANIF" + bytes(200),
+        b"\x1f\x8b damaged",
+    ],
+)
+def test_not_a_manifest(tmp_path, data):
+    path = tmp_path / "manifest"
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        check_manifest(str(path))
@@ -0,0 +1,27 @@
+import os
+
+import compare_two_folders
+
+
+def test_search_phase_is_counted(tmp_path):
+    # The file is in another folder on each side: missing on both sides, found by the search
+    data = os.urandom(10000)
+    for path in (tmp_path / "source" / "a" / "f.bin", tmp_path / "target" / "b" / "f.bin"):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(data)
+
+    return_data = compare_two_folders.compare_folders(
+        str(tmp_path / "source"),
+        str(tmp_path / "target"),
+        "sha256",
+        def_options="STH",
+        def_progress_interval=0,
+    )
+    assert return_data["files_missing_in_source"] == 1
+    assert return_data["files_missing_in_target"] == 1
+    phases = return_data["phases"]
+    assert phases["scan_source"]["stats"] == 1
+    assert phases["scan_source"]["listings"] == 2
+    # Both sides are searched for each missing file and the found files are compared
+    assert phases["search"]["listings"] >= 4
+    assert phases["search"]["stats"] >= 2
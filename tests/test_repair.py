@@ -0,0 +1,186 @@
+import errno
+import os
+import random
+import sys
+
+import pytest
+
+import ctf_repair
+from ctf_functions import sha_digest
+from ctf_repair import (
+    repair_file,
+    weak_checksums,
+)
+
+
+BLOCK_SIZE = 1024
+
+
+@pytest.fixture(params=["numpy", "python"])
+def checksum_backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        # "import numpy" raises ImportError
+        monkeypatch.setitem(sys.modules, "numpy", None)
+    return request.param
+
+
+def random_data(def_size, def_seed):
+    return random.Random(def_seed).randbytes(def_size)
+
+
+def write_file(def_path, def_data):
+    with open(def_path, "wb") as f:
+        f.write(def_data)
+
+
+def repair(def_folder, def_data_source, def_data_target, def_expected=True):
+    """
+    :return:    CopyResult, str (path of the target)
+    """
+    file_source = os.path.join(def_folder, "source.bin")
+    file_target = os.path.join(def_folder, "target.bin")
+    write_file(file_source, def_data_source)
+    write_file(file_target, def_data_target)
+    result = repair_file(
+        "file.bin",
+        file_source,
+        file_target,
+        "sha256",
+        sha_digest(file_source, "sha256") if def_expected else None,
+        def_block_size=BLOCK_SIZE,
+    )
+    return result, file_target
+
+
+def read_file(def_path):
+    with open(def_path, "rb") as f:
+        return f.read()
+
+
+def assert_no_leftovers(def_folder):
+    assert sorted(os.listdir(def_folder)) == ["source.bin", "target.bin"]
+
+
+def test_weak_checksums_backends_agree(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    data = random_data(5000, 1)
+    checksums_numpy = weak_checksums(data, BLOCK_SIZE)
+    assert isinstance(checksums_numpy, numpy.ndarray)
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    checksums_python = weak_checksums(data, BLOCK_SIZE)
+    assert isinstance(checksums_python, list)
+    assert checksums_numpy.tolist() == checksums_python
+
+
+@pytest.mark.parametrize("expected", [True, False])
+def test_repair_inserted_data(tmp_path, checksum_backend, expected):
+    data_target = random_data(40 * BLOCK_SIZE, 2)
+    data_source = data_target[: 10 * BLOCK_SIZE + 17] + b"inserted" * 100 + data_target[10 * BLOCK_SIZE + 17 :]
+
+    result, file_target = repair(str(tmp_path), data_source, data_target, expected)
+    assert result.error is None
+    assert result.method == "delta_rolling"
+    assert result.verified is True
+    assert read_file(file_target) == data_source
+    assert result.size == len(data_source)
+    # Only the block around the insertion is taken from the source
+    assert result.bytes_reused >= 38 * BLOCK_SIZE
+    assert_no_leftovers(str(tmp_path))
+
+
+def test_repair_shifted_data(tmp_path, checksum_backend):
+    data_target = random_data(40 * BLOCK_SIZE, 3)
+    data_source = b"header" + data_target[BLOCK_SIZE // 2 :]
+
+    result, file_target = repair(str(tmp_path), data_source, data_target)
+    assert result.error is None
+    assert result.method == "delta_rolling"
+    assert read_file(file_target) == data_source
+    assert result.bytes_reused >= 38 * BLOCK_SIZE
+    assert_no_leftovers(str(tmp_path))
+
+
+def test_repair_same_size(tmp_path, checksum_backend):
+    data_target = random_data(40 * BLOCK_SIZE + 100, 4)
+    data_source = bytearray(data_target)
+    data_source[5 * BLOCK_SIZE + 3] ^= 0xFF
+    data_source[-1] ^= 0xFF
+
+    result, file_target = repair(str(tmp_path), bytes(data_source), data_target)
+    assert result.error is None
+    assert result.method == "delta_in_place"
+    assert result.verified is True
+    assert read_file(file_target) == data_source
+    # One full block and the short last block
+    assert result.size == BLOCK_SIZE + 100
+    assert result.bytes_reused == len(data_source) - result.size
+    assert_no_leftovers(str(tmp_path))
+
+
+def test_repair_source_changed_since_comparison(tmp_path):
+    data_target = random_data(8 * BLOCK_SIZE, 5)
+    data_source = random_data(8 * BLOCK_SIZE, 6)
+    file_source = os.path.join(str(tmp_path), "source.bin")
+    file_target = os.path.join(str(tmp_path), "target.bin")
+    write_file(file_source, data_source)
+    write_file(file_target, data_target)
+
+    result = repair_file(
+        "file.bin",
+        file_source,
+        file_target,
+        "sha256",
+        sha_digest(file_target, "sha256"),
+        def_block_size=BLOCK_SIZE,
+    )
+    assert result.error is not None
+    # Nothing is written
+    assert read_file(file_target) == data_target
+    assert_no_leftovers(str(tmp_path))
+
+
+def test_repair_in_place_rolled_back_on_write_error(tmp_path, monkeypatch):
+    data_target = random_data(8 * BLOCK_SIZE, 7)
+    data_source = random_data(8 * BLOCK_SIZE, 8)
+    pwrite = os.pwrite
+    calls = []
+
+    def pwrite_failing(def_fd, def_data, def_offset):
+        calls.append(def_offset)
+        if len(calls) == 3:
+            raise OSError(errno.EIO, "Input/output error")
+        return pwrite(def_fd, def_data, def_offset)
+
+    monkeypatch.setattr(ctf_repair.os, "pwrite", pwrite_failing)
+    result, file_target = repair(str(tmp_path), data_source, data_target)
+    monkeypatch.undo()
+    assert result.error is not None
+    assert read_file(file_target) == data_target
+    assert_no_leftovers(str(tmp_path))
+
+
+def test_repair_in_place_rolls_back_interrupted_journal(tmp_path):
+    # An interrupted repair left the first block half new and its journal: the journal is rolled back first
+    data_target = random_data(8 * BLOCK_SIZE, 9)
+    data_source = random_data(8 * BLOCK_SIZE, 10)
+    file_source = os.path.join(str(tmp_path), "source.bin")
+    file_target = os.path.join(str(tmp_path), "target.bin")
+    write_file(file_source, data_source)
+    write_file(file_target, data_source[:BLOCK_SIZE] + data_target[BLOCK_SIZE:])
+    with open(os.path.join(str(tmp_path), ".target.bin.ctf-repair"), "wb") as f:
+        f.write(ctf_repair._JOURNAL_RECORD.pack(0, BLOCK_SIZE) + data_target[:BLOCK_SIZE])
+
+    result = repair_file(
+        "file.bin",
+        file_source,
+        file_target,
+        "sha256",
+        def_block_size=BLOCK_SIZE,
+    )
+    assert result.error is None
+    assert read_file(file_target) == data_source
+    # The first block was restored from the journal and written again
+    assert result.size == 8 * BLOCK_SIZE
+    assert_no_leftovers(str(tmp_path))
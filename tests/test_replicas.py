@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import ctf_replicas
+from ctf_replicas import compare_replicas
+
+
+def create_folder(def_folder, def_files):
+    os.makedirs(def_folder)
+    for file, data in def_files.items():
+        path = os.path.join(def_folder, file)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, ns=(1600000000 * 10**9, 1600000000 * 10**9))
+
+
+def test_compare_replicas(tmp_path):
+    files = {"a.txt": b"a", "b.txt": b"b", "c.txt": b"c"}
+    create_folder(str(tmp_path / "source"), files)
+    create_folder(str(tmp_path / "one"), files)
+    create_folder(str(tmp_path / "two"), {"a.txt": b"x", "b.txt": b"b", "d.txt": b"d"})
+
+    return_data_per_replica, matrix = compare_replicas(
+        str(tmp_path / "source"),
+        [str(tmp_path / "one"), str(tmp_path / "two")],
+        "sha256",
+        def_workers=2,
+    )
+    assert return_data_per_replica[str(tmp_path / "one")]["files_pass"] == 3
+    assert return_data_per_replica[str(tmp_path / "two")]["files_pass"] == 1
+    assert return_data_per_replica[str(tmp_path / "two")]["files_any_difference_but_mtime"] == 1
+    assert matrix == {
+        "a.txt": ["pass", "any_difference_but_mtime"],
+        "c.txt": ["pass", "missing_in_target"],
+        "d.txt": [None, "missing_in_source"],
+    }
+
+
+def test_compare_replicas_read_error(tmp_path, monkeypatch):
+    # A file which can not be read on one replica is an error of that replica only
+    files = {"a.txt": b"a", "b.txt": b"b"}
+    for folder in ("source", "one", "two"):
+        create_folder(str(tmp_path / folder), files)
+    fingerprint_file = ctf_replicas.fingerprint_file
+
+    def fingerprint_file_failing(def_filename, *args):
+        if def_filename == str(tmp_path / "one" / "a.txt"):
+            raise PermissionError(13, "Permission denied", def_filename)
+        return fingerprint_file(def_filename, *args)
+
+    monkeypatch.setattr(ctf_replicas, "fingerprint_file", fingerprint_file_failing)
+    return_data_per_replica, matrix = compare_replicas(
+        str(tmp_path / "source"),
+        [str(tmp_path / "one"), str(tmp_path / "two")],
+        "sha256",
+    )
+    assert return_data_per_replica[str(tmp_path / "one")]["files_error"] == 1
+    assert return_data_per_replica[str(tmp_path / "one")]["files_pass"] == 1
+    assert return_data_per_replica[str(tmp_path / "two")]["files_pass"] == 2
+    assert matrix == {"a.txt": ["error", "pass"]}
+
+
+def test_compare_replicas_duplicate(tmp_path):
+    create_folder(str(tmp_path / "source"), {})
+    create_folder(str(tmp_path / "one"), {})
+    with pytest.raises(ValueError):
+        compare_replicas(
+            str(tmp_path / "source"),
+            [str(tmp_path / "one"), str(tmp_path / "one")],
+            "sha256",
+        )
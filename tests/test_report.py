@@ -0,0 +1,107 @@
+import errno
+import os
+import threading
+
+import pytest
+
+from ctf_latency import LatencyRecorder
+from ctf_report import (
+    ReportWriter,
+    StructuredReportWriter,
+    read_structured_report,
+    render_structured_report,
+)
+
+
+def close_in_thread(def_report_writer):
+    """
+    Closes the writer in a thread, a writer waiting forever fails the test instead of blocking it.
+    :return:    BaseException, raised by close() (None: no error)
+    """
+    errors = []
+
+    def close():
+        try:
+            def_report_writer.close()
+        except BaseException as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=close, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "ReportWriter.close() does not return"
+    return errors[0] if errors else None
+
+
+def test_report_writer_non_utf8_file_name(tmp_path):
+    log = tmp_path / "report.log"
+    report_writer = ReportWriter(str(log), def_flush_interval=0.01)
+    file = os.fsdecode(b"bad\xff.txt")
+    report_writer.write(f"PASS: '{file}'\n")
+    report_writer.write("PASS: 'ok.txt'\n")
+
+    assert close_in_thread(report_writer) is None
+    assert log.read_bytes() == b"PASS: 'bad\xff.txt'\nPASS: 'ok.txt'\n"
+
+
+@pytest.mark.skipif(not os.path.exists("/dev/full"), reason="needs /dev/full")
+def test_report_writer_write_error():
+    # Every write to /dev/full fails with ENOSPC
+    report_writer = ReportWriter("/dev/full", def_flush_interval=0.01)
+    report_writer.write("PASS: 'ok.txt'\n")
+    with pytest.raises(OSError) as error:
+        report_writer.flush()
+    assert error.value.errno == errno.ENOSPC
+
+    report_writer.write("PASS: 'later.txt'\n")
+    error = close_in_thread(report_writer)
+    assert isinstance(error, OSError) and error.errno == errno.ENOSPC
+    assert report_writer.closed
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "csv"])
+def test_structured_report_round_trip(tmp_path, capsys, output_format):
+    output = tmp_path / f"report.{output_format}"
+    latency_recorder = LatencyRecorder()
+    latency_recorder.add(0.002, "a.txt", 10, 0b1111)
+    latency_recorder.add(0.5, os.path.join("sub", "b.txt"), 20, 0b1111)
+    latency = latency_recorder.as_dict()
+
+    structured_writer = StructuredReportWriter(str(output), output_format)
+    structured_writer.write_file_record(
+        "STHB",
+        "pass",
+        "a.txt",
+        "/source/a.txt",
+        "/target/a.txt",
+        [{"details": "file_size", "result": True}, {"details": "file_hash", "result": True}],
+    )
+    structured_writer.write_file_record(
+        "STHB",
+        "missing_in_target",
+        os.path.join("sub", "b.txt"),
+        "/source/sub/b.txt",
+    )
+    structured_writer.write_summary_record("STHB", {"files_pass": 1, "files_missing_in_target": 1})
+    structured_writer.write_summary_record("ST", {"files_pass": 1, "files_missing_in_target": 1})
+    structured_writer.write_latency_record(latency)
+    structured_writer.close()
+
+    records = list(read_structured_report(str(output), output_format))
+    assert [record["record"] for record in records] == ["file", "file", "summary", "summary", "latency"]
+    assert [record["classification"] for record in records[:2]] == ["pass", "missing_in_target"]
+    assert records[0]["checks"] == [
+        {"details": "file_size", "result": True},
+        {"details": "file_hash", "result": True},
+    ]
+    assert [record["options"] for record in records[2:4]] == ["STHB", "ST"]
+    assert records[3]["counts"] == {"files_pass": 1, "files_missing_in_target": 1}
+    latency_read = records[4]["latency"]
+    for key in ("files", "buckets", "slowest_files", "slowest_directories"):
+        assert latency_read[key] == latency[key]
+
+    render_structured_report(str(output), output_format)
+    lines = capsys.readouterr().out.splitlines()
+    assert sum("PASS:      Files are identical:    'a.txt'" in line for line in lines) == 1
+    assert sum("ERROR:     File missing in target: " in line for line in lines) == 1
+    assert sum("SUMMARY: " in line for line in lines) == 2
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import compare_two_folders
+from ctf_cli import main
+from ctf_shard import (
+    add_counts,
+    merge_shard_results,
+)
+
+
+SHARDS = 3
+
+
+def create_folders(def_folder):
+    """
+    Creates a source and a target with passing, differing and missing files in several top-level directories.
+    :return:    str (source), str (target)
+    """
+    source = os.path.join(def_folder, "source")
+    target = os.path.join(def_folder, "target")
+    for index in range(40):
+        file = os.path.join(f"dir{index % 5}", f"sub{index % 2}", f"file{index}.txt")
+        data = f"data {index}".encode()
+        for folder in (source, target):
+            if (folder == target and index % 7 == 0) or (folder == source and index % 11 == 0):
+                continue
+            path = os.path.join(folder, file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data + b"x" if folder == target and index % 3 == 0 else data)
+            mtime_ns = 1600000000 * 10**9 + (index % 4 == 0 and folder == target)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+    return source, target
+
+
+@pytest.mark.parametrize("method", ["hash", "top"])
+def test_shards_merge_to_unsharded_run(tmp_path, method, capsys):
+    source, target = create_folders(str(tmp_path))
+    return_data = compare_two_folders.compare_folders(
+        source,
+        target,
+        "sha256",
+        def_options="STH",
+        def_progress_interval=0,
+    )
+
+    inputs = []
+    for index in range(SHARDS):
+        inputs.append(str(tmp_path / f"shard{index}.json"))
+        assert main(
+            [
+                "compare",
+                source,
+                target,
+                "-o",
+                "STH",
+                "-a",
+                "sha256",
+                "-q",
+                "--shard",
+                f"{index}/{SHARDS}",
+                "--shard-method",
+                method,
+                "--shard-result",
+                inputs[-1],
+            ]
+        ) == 0
+    return_data_per_options, settings = merge_shard_results(inputs)
+    assert settings == {"shards": SHARDS, "method": method, "options": ["STH"]}
+    merged = return_data_per_options["STH"]
+    for key, value in return_data.items():
+        if key not in ("phases", "process", "latency"):
+            assert merged[key] == value, key
+    assert merged["files_pass"] > 0
+    assert merged["files_any_difference_but_mtime"] > 0
+    assert merged["latency"]["files"] == return_data["latency"]["files"]
+
+    assert main(["merge-shards"] + inputs) == 0
+
+
+def test_add_counts_keeps_peaks():
+    totals = {}
+    for max_rss, opens in ((300, 5), (500, 7), (400, 1)):
+        add_counts(
+            totals,
+            {"process": {"rusage": {"max_rss": max_rss, "user_s": 1.5}}, "phases": {"scan": {"opens": opens}}},
+        )
+    assert totals == {"process": {"rusage": {"max_rss": 500, "user_s": 4.5}}, "phases": {"scan": {"opens": 13}}}
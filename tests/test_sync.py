@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import compare_two_folders
+import ctf_sync
+from ctf_functions import sha_digest
+from ctf_sync import copy_file
+
+
+def create_trees(def_folder):
+    """
+    :return:    str (source folder), str (target folder)
+    """
+    folder_source = os.path.join(def_folder, "source")
+    folder_target = os.path.join(def_folder, "target")
+    files_source = {
+        "same.txt": b"same",
+        "differing.txt": b"new content",
+        "resized.bin": bytes(range(256)) * 64,
+        os.path.join("sub", "missing.txt"): b"only in source",
+        os.path.join("new", "deep", "missing.bin"): os.urandom(300000),
+    }
+    files_target = {
+        "same.txt": b"same",
+        "differing.txt": b"old content",
+        "resized.bin": bytes(range(256)) * 3,
+        "extra.txt": b"only in target",
+    }
+    for folder, files in ((folder_source, files_source), (folder_target, files_target)):
+        for file, data in files.items():
+            path = os.path.join(folder, file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            os.utime(path, ns=(1600000000 * 10**9, 1600000000 * 10**9))
+    return folder_source, folder_target
+
+
+def assert_synchronised(def_folder_source, def_folder_target):
+    for root, _, files in os.walk(def_folder_source):
+        for file in files:
+            path_source = os.path.join(root, file)
+            path_target = os.path.join(def_folder_target, os.path.relpath(path_source, def_folder_source))
+            with open(path_source, "rb") as f_source, open(path_target, "rb") as f_target:
+                assert f_source.read() == f_target.read(), path_target
+            assert os.stat(path_source).st_mtime_ns == os.stat(path_target).st_mtime_ns
+    assert not [
+        file
+        for _, _, files in os.walk(def_folder_target)
+        for file in files
+        if file.endswith(".ctf-sync")
+    ]
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    # Forces the fallback taken on filesystems without shared extents
+    monkeypatch.setattr(ctf_sync, "clone_file", lambda def_fd_source, def_fd_target: False)
+
+
+@pytest.mark.parametrize("options", ["STHB", "ST"])
+@pytest.mark.parametrize("verify", [True, False])
+def test_sync_to_target(tmp_path, no_reflink, options, verify):
+    folder_source, folder_target = create_trees(str(tmp_path))
+    os.utime(
+        os.path.join(folder_source, "differing.txt"),
+        ns=(1700000000 * 10**9, 1700000000 * 10**9),
+    )
+
+    return_data = compare_two_folders.compare_folders(
+        folder_source,
+        folder_target,
+        "sha256",
+        def_options=options,
+        def_progress_interval=0,
+        def_sync=True,
+        def_sync_verify=verify,
+    )
+    assert return_data["files_missing_in_target"] == 2
+
+    assert_synchronised(folder_source, folder_target)
+    assert os.path.exists(os.path.join(folder_target, "extra.txt"))
+    return_data = compare_two_folders.compare_folders(
+        folder_source,
+        folder_target,
+        "sha256",
+        def_options="STHB",
+        def_progress_interval=0,
+    )
+    assert return_data["files_pass"] == 5
+    assert return_data["files_missing_in_target"] == 0
+
+
+def test_copy_missing_file_is_verified(tmp_path, no_reflink):
+    folder_source, folder_target = create_trees(str(tmp_path))
+    file = os.path.join("sub", "missing.txt")
+
+    result = copy_file(
+        file,
+        os.path.join(folder_source, file),
+        os.path.join(folder_target, file),
+        "sha256",
+    )
+    assert result.error is None
+    assert result.method == "stream_hash"
+    assert result.verified is True
+    assert result.digest == sha_digest(os.path.join(folder_source, file), "sha256")
+    assert_synchronised(os.path.join(folder_source, "sub"), os.path.join(folder_target, "sub"))
+
+
+def test_copy_without_verification(tmp_path, no_reflink):
+    folder_source, folder_target = create_trees(str(tmp_path))
+    file = os.path.join("new", "deep", "missing.bin")
+
+    result = copy_file(
+        file,
+        os.path.join(folder_source, file),
+        os.path.join(folder_target, file),
+    )
+    assert result.error is None
+    assert result.method in ("copy_file_range", "sendfile", "read_write")
+    assert result.verified is None
+    assert_synchronised(os.path.join(folder_source, "new"), os.path.join(folder_target, "new"))
+
+
+def test_copy_with_wrong_expected_digest(tmp_path, no_reflink):
+    # The source changed since the comparison hashed it: the target is left untouched
+    folder_source, folder_target = create_trees(str(tmp_path))
+
+    result = copy_file(
+        "differing.txt",
+        os.path.join(folder_source, "differing.txt"),
+        os.path.join(folder_target, "differing.txt"),
+        "sha256",
+        sha_digest(os.path.join(folder_target, "differing.txt"), "sha256"),
+    )
+    assert result.verified is False
+    assert result.error is not None
+    with open(os.path.join(folder_target, "differing.txt"), "rb") as f:
+        assert f.read() == b"old content"
+    assert not os.path.exists(os.path.join(folder_target, ".differing.txt.ctf-sync"))
+
+
+def test_copy_read_back_differs(tmp_path, no_reflink, monkeypatch):
+    folder_source, folder_target = create_trees(str(tmp_path))
+    file = os.path.join("sub", "missing.txt")
+    monkeypatch.setattr(ctf_sync, "hash_written", lambda *args: b"damaged")
+
+    result = copy_file(
+        file,
+        os.path.join(folder_source, file),
+        os.path.join(folder_target, file),
+        "sha256",
+    )
+    assert result.verified is False
+    assert result.error is not None
+    assert os.listdir(os.path.join(folder_target, "sub")) == []
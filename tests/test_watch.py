@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+from ctf_cli import main
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="watch mode needs inotify (Linux)")
+
+MTIME_NS = 1600000000 * 10**9
+
+
+def write_file(def_path, def_data):
+    os.makedirs(os.path.dirname(def_path), exist_ok=True)
+    with open(def_path, "wb") as f:
+        f.write(def_data)
+    os.utime(def_path, ns=(MTIME_NS, MTIME_NS))
+
+
+def change_target(def_folder_target, def_events):
+    """
+    Changes the target while it is watched, every step waits for the changes of the previous one to be compared.
+    """
+    time.sleep(0.5)
+    write_file(os.path.join(def_folder_target, "sub", "a.txt"), b"changed")
+    time.sleep(0.6)
+    # The watched root is removed and created again
+    shutil.rmtree(def_folder_target)
+    time.sleep(0.6)
+    write_file(os.path.join(def_folder_target, "sub", "a.txt"), b"a")
+    time.sleep(0.6)
+    # Only noticed if the new root is watched
+    write_file(os.path.join(def_folder_target, "sub", "b.txt"), b"b")
+    def_events.set()
+
+
+def test_watch(tmp_path, capsys):
+    folder_source = str(tmp_path / "source")
+    folder_target = str(tmp_path / "target")
+    for folder in (folder_source, folder_target):
+        write_file(os.path.join(folder, "sub", "a.txt"), b"a")
+    output = str(tmp_path / "changes.jsonl")
+
+    changed = threading.Event()
+    thread = threading.Thread(target=change_target, args=(folder_target, changed))
+    thread.start()
+    try:
+        assert main(
+            [
+                "watch",
+                folder_source,
+                folder_target,
+                "-a",
+                "sha256",
+                "--settle",
+                "0.2",
+                "--duration",
+                "3.5",
+                "--output",
+                output,
+            ]
+        ) == 0
+    finally:
+        thread.join()
+    assert changed.is_set()
+
+    with open(output, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    classifications = {}
+    for record in records:
+        assert record["record"] == "file"
+        classifications.setdefault(record["file"], []).append(record["classification"])
+        if record["classification"] in ("pass", "only_mtime_difference", "any_difference_but_mtime"):
+            # The records carry the results of the checks, as the records of compare
+            assert [check["details"] for check in record["checks"]] == [
+                "file_size",
+                "file_mtime",
+                "file_hash",
+                "file_bit",
+            ]
+        else:
+            assert record["checks"] == []
+    assert classifications == {
+        os.path.join("sub", "a.txt"): ["pass", "any_difference_but_mtime", "missing_in_target", "pass"],
+        os.path.join("sub", "b.txt"): ["missing_in_source"],
+    }